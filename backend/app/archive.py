@@ -0,0 +1,79 @@
+"""Cold storage for the message contents of idle chats.
+
+Once a chat has had no new messages for `ARCHIVE_IDLE_DAYS`, the contents of its messages are moved out of
+`message_content` into a single zstd-compressed row of `chat_archive`. The chat and its messages stay where they are,
+and loading the chat merges the archived contents back in, so archiving is invisible to the API.
+Writes that change existing contents (editing a message or the system prompt) move them back first.
+Full-text search keeps its own copy of message text, so archived chats stay searchable.
+
+Usage (from the backend directory), to archive idle chats and report the space reclaimed:
+    python -m app.archive [--days DAYS] [--batch-size N]
+"""
+import argparse
+import datetime
+
+from app.config import config
+
+
+class ArchiveReport:
+    """What an archiving run moved. `reclaimed_bytes` is the uncompressed size of the moved contents, less what the
+    archive grew by. It is the logical size: on PostgreSQL the freed space is reused by new rows after autovacuum,
+    rather than returned to the operating system.
+    """
+
+    def __init__(self):
+        self.chats = 0
+        self.contents = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.skipped = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.raw_bytes - self.compressed_bytes
+
+    def __str__(self):
+        ratio = self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0
+        return (
+            f'archived {self.contents} contents of {self.chats} chats ({self.skipped} skipped): '
+            f'{self.raw_bytes} bytes compressed to {self.compressed_bytes} ({ratio:.1f}x), reclaiming {self.reclaimed_bytes} bytes'
+        )
+
+
+def archive_idle_chats(idle_days: int = config.archive_idle_days, batch_size: int = 100) -> ArchiveReport:
+    """Archive the contents of every chat that has been idle for at least `idle_days`, one chat per transaction,
+    so that a chat being archived is never locked for long.
+    Chats whose contents change while they are being archived are skipped, and picked up again by the next run.
+    """
+    from app import data
+    report = ArchiveReport()
+    idle_since = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=idle_days)
+    skipped = []
+    db = data.SessionLocal()
+    try:
+        while True:
+            chat_ids = data.crud.get_idle_chat_ids(db, idle_since, batch_size, exclude=skipped)
+            if not chat_ids:
+                break
+            for chat_id in chat_ids:
+                moved = data.crud.archive_chat_contents(db, chat_id)
+                if moved is None:
+                    skipped.append(chat_id)
+                    report.skipped += 1
+                    continue
+                contents, raw_bytes, compressed_bytes = moved
+                report.chats += 1
+                report.contents += contents
+                report.raw_bytes += raw_bytes
+                report.compressed_bytes += compressed_bytes
+    finally:
+        db.close()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive the message contents of idle chats.')
+    parser.add_argument('--days', type=int, default=config.archive_idle_days, help='how long a chat must have been idle for')
+    parser.add_argument('--batch-size', type=int, default=100, help='how many idle chats to look up at a time')
+    args = parser.parse_args()
+    print(archive_idle_chats(args.days, args.batch_size))
@@ -5,6 +5,7 @@ from app.schemas.model_config import ModelConfig
 
 class AnthropicConfig(ModelConfig):
     max_tokens: RangedInt = RangedInt(min=1, max=None, val=1024)
+    n: RangedInt = RangedInt(min=1, max=8, val=1) # not an API parameter; candidates are generated with concurrent calls
     temperature: RangedFloat = RangedFloat(min=0, max=1, val=1)
     top_k: int | None = None
     top_p: float | None = None
@@ -9,7 +9,7 @@ import logging
 
 from typing import TYPE_CHECKING, cast
 if TYPE_CHECKING:
-    from app.schemas import Message
+    from app.schemas import Message, Usage
 
 class AnthropicModel(ImageChatModel, StreamingChatModel):
     
@@ -56,6 +56,12 @@ class AnthropicModel(ImageChatModel, StreamingChatModel):
                         continue
                     msg['content'].append(content)
                 res.append(msg)
+        # branches of a chat share the history they were forked from; marking the end of the history as cacheable
+        # (and the end of the turn before, whose cache the previous request wrote) lets regenerating or editing a
+        # message read the shared prefix from Anthropic's prompt cache
+        for msg in res[-2:]:
+            if msg['content']:
+                msg['content'][-1]['cache_control'] = {'type': 'ephemeral'}
         return res
         
     def chat(self, messages: Sequence['Message']) -> 'Message':
@@ -74,9 +80,24 @@ class AnthropicModel(ImageChatModel, StreamingChatModel):
             raise ValueError(response.error.type + ': ' + response.error.message)
         
         from schemas import MessageBuilder
-        return MessageBuilder(role=Role.ASSISTANT, model=self.api_name, config=self.config).add_text(response.content[0].text).build()
+        message = MessageBuilder(role=Role.ASSISTANT, model=self.api_name, config=self.config).add_text(response.content[0].text).build()
+        message.usage = self.process_usage(response.usage)
+        return message
     
-    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None, None]:
+    def process_usage(self, usage: anthropic.types.Usage) -> 'Usage':
+        """
+        Convert the token counts of a response to a usage. Anthropic doesn't count the tokens read from or written to
+        the prompt cache as input tokens, so they are added back to get the whole prompt.
+        """
+        from app.schemas import Usage
+        cached_tokens = usage.cache_read_input_tokens or 0
+        return Usage(
+            prompt_tokens=usage.input_tokens + cached_tokens + (usage.cache_creation_input_tokens or 0),
+            completion_tokens=usage.output_tokens,
+            cached_tokens=cached_tokens,
+        )
+    
+    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None, 'Usage | None']:
         system_msg = [m for m in messages if m.role == Role.SYSTEM]
         system_msg = system_msg[0] if system_msg else None
         system_msg_content: str | None = cast(str, system_msg.contents[0].content) if system_msg is not None else None
@@ -88,6 +109,7 @@ class AnthropicModel(ImageChatModel, StreamingChatModel):
         ) as stream:
             for text in stream.text_stream:
                 yield text
+            return self.process_usage(stream.get_final_message().usage)
     
 class Claude3Point5Sonnet(AnthropicModel):
     
@@ -1,12 +1,29 @@
 from abc import ABC, abstractmethod
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 from app.util import ModelAPI
 from app.schemas.model_config import ModelConfig, ModelConfigWithTools
 
-from typing import TYPE_CHECKING, Sequence
+from typing import TYPE_CHECKING, Generic, Sequence, TypeVar
 
 if TYPE_CHECKING:
-    from schemas import Message
+    from schemas import Message, Usage
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+class StreamResult(Generic[T, R]):
+    """Iterate over a generator, keeping the value it returns (which a for loop drops) in `value`.
+    """
+    
+    def __init__(self, stream: Generator[T, None, R]) -> None:
+        self.stream = stream
+        self.value: R | None = None
+    
+    def __iter__(self) -> Generator[T, None, None]:
+        self.value = yield from self.stream
 
 class ChatModel(ABC):
     """An abstract class for chat models. It defines the basic methods that all chat models should implement.
@@ -49,10 +66,37 @@ class ChatModel(ABC):
             messages (Sequence[Message]): A list of messages to send to the model. The last message in the list is the one to which the model should respond.
 
         Returns:
-            Message: The response from the model.
+            Message: The response from the model, with the token counts the API reports as its `usage`, if any.
         """
         pass
     
+    def get_candidate_count(self) -> int:
+        """Get the number of candidate responses the config asks for (the `n` config item, if the model has one),
+        up to the model's own cap: a config sent by a client carries its own bounds, which can't be trusted.
+        """
+        n = getattr(self.config, 'n', None)
+        if n is None:
+            return 1
+        cap = type(self.config).model_fields['n'].default.max
+        return min(n.val, cap) if cap is not None else n.val
+    
+    def chat_candidates(self, messages: Sequence['Message'], n: int) -> list['Message']:
+        """Generate several alternative responses to the same messages.
+        By default this makes n concurrent calls to `chat`; models whose API can return several choices for one prompt should override it.
+
+        Args:
+            messages (Sequence[Message]): A list of messages to send to the model. The last message in the list is the one to which the model should respond.
+            n (int): The number of candidate responses to generate.
+
+        Returns:
+            list[Message]: The candidate responses, in candidate order. The token counts of a request that returns several
+                candidates are all on the first one.
+        """
+        if n == 1:
+            return [self.chat(messages)]
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            return list(executor.map(lambda _: self.chat(messages), range(n)))
+    
     @classmethod
     def generate_model_info(cls):
         """Generate and return information about the model.
@@ -70,17 +114,64 @@ class StreamingChatModel(ChatModel):
     """
     
     @abstractmethod
-    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None]:
+    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None, 'Usage | None']:
         """Send a list of messages to the model and stream the response.
 
         Args:
             messages (Sequence[Message]): A list of messages to send to the model. The last message in the list is the one to which the model should respond.
 
         Yields:
-            Generator[str, None]: A generator that yields the response from the model in chunks. The size of the chunks is implementation-dependent.
+            Generator[str, None, Usage | None]: A generator that yields the response from the model in chunks. The size of the chunks is implementation-dependent.
+                It returns the token counts the API reports, if any (see `StreamResult`).
         """
         pass
     
+    def chat_stream_candidates(self, messages: Sequence['Message'], n: int) -> Generator[tuple[int, str], None, dict[int, 'Usage']]:
+        """Stream several alternative responses to the same messages in parallel.
+        By default this runs n concurrent calls to `chat_stream`; models whose API can stream several choices for one prompt should override it.
+
+        Args:
+            messages (Sequence[Message]): A list of messages to send to the model. The last message in the list is the one to which the model should respond.
+            n (int): The number of candidate responses to generate.
+
+        Yields:
+            Generator[tuple[int, str], None, dict[int, Usage]]: Tuples of (candidate index, chunk), interleaved in the order the chunks arrive.
+                It returns the token counts the API reports, by candidate index; those of a request that streams several candidates are all on the first one.
+        """
+        usages = {}
+        if n == 1:
+            stream = StreamResult(self.chat_stream(messages))
+            for chunk in stream:
+                yield 0, chunk
+            if stream.value is not None:
+                usages[0] = stream.value
+            return usages
+        chunks: queue.Queue[tuple[int, str | None, Exception | None]] = queue.Queue()
+        
+        def consume(index: int):
+            try:
+                stream = StreamResult(self.chat_stream(messages))
+                for chunk in stream:
+                    chunks.put((index, chunk, None))
+                if stream.value is not None:
+                    usages[index] = stream.value
+                chunks.put((index, None, None))
+            except Exception as e:
+                chunks.put((index, None, e))
+        
+        for i in range(n):
+            threading.Thread(target=consume, args=(i,), daemon=True).start()
+        remaining = n
+        while remaining > 0:
+            index, chunk, error = chunks.get()
+            if error is not None:
+                raise error
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield index, chunk
+        return usages
+    
     @classmethod
     def generate_model_info(cls):
         info = super().generate_model_info()
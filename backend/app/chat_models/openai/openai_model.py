@@ -1,8 +1,9 @@
 from collections.abc import Generator
 from typing import Iterable, Sequence
-from app.chat_models.chat_model import ImageChatModel, StreamingChatModel, ToolChatModel
+from app.chat_models.chat_model import ImageChatModel, StreamingChatModel, StreamResult, ToolChatModel
 from app.chat_models.openai.openai_config import OpenAIConfig
 from openai import OpenAI, NOT_GIVEN, NotGiven
+from openai.types import CompletionUsage
 import openai.types.chat as chat_types
 from app.util import ModelAPI, Role
 
@@ -12,7 +13,7 @@ import logging
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from app.schemas import Message
+    from app.schemas import Message, Usage
 
 class OpenAIModel(ImageChatModel, StreamingChatModel, ToolChatModel):
 
@@ -77,7 +78,7 @@ class OpenAIModel(ImageChatModel, StreamingChatModel, ToolChatModel):
                     new_msg = {
                         'role': 'tool',
                         'tool_call_id': c.tool_call_id,
-                        'content': json.dumps(c.content)
+                        'content': json.dumps(c.get_model_content())
                     }
                     
                     res.append(new_msg)
@@ -126,25 +127,51 @@ class OpenAIModel(ImageChatModel, StreamingChatModel, ToolChatModel):
         return res if len(res) > 0 else NOT_GIVEN
         
     def chat(self, messages: Sequence['Message']) -> 'Message':
+        return self.chat_candidates(messages, 1)[0]
+    
+    def chat_candidates(self, messages: Sequence['Message'], n: int) -> list['Message']:
+        # a single request with n choices, so the prompt is only processed once
         completion: chat_types.ChatCompletion = self._client.chat.completions.create(
             model=self.api_name,
             messages=self.process_messages(messages),
             tools=self.process_tools(),
+            n=n,
             **self.config.dump_values()
         )
+        candidates = [self.process_choice(choice) for choice in sorted(completion.choices, key=lambda choice: choice.index)]
+        if completion.usage is not None and candidates:
+            candidates[0].usage = self.process_usage(completion.usage)
+        return candidates
+    
+    def process_usage(self, usage: CompletionUsage) -> 'Usage':
+        """
+        Convert the token counts of a completion to a usage.
+        """
+        from app.schemas import Usage
+        details = usage.prompt_tokens_details
+        return Usage(
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=details.cached_tokens if details is not None else None,
+        )
+    
+    def process_choice(self, choice: chat_types.chat_completion.Choice) -> 'Message':
+        """
+        Convert a completion choice to a message.
+        """
         from schemas import MessageBuilder
         message = MessageBuilder(role=Role.ASSISTANT, model=self.api_name, config=self.config)
         
-        match completion.choices[0].finish_reason:
+        match choice.finish_reason:
             case 'stop' | 'length':
-                if completion.choices[0].message.content is None:
+                if choice.message.content is None:
                     raise ValueError('No completion content')
         
-                message.add_text(completion.choices[0].message.content)
+                message.add_text(choice.message.content)
             case 'tool_calls':
-                if completion.choices[0].message.tool_calls is None:
+                if choice.message.tool_calls is None:
                     raise ValueError('No tool calls')
-                for tool_call in completion.choices[0].message.tool_calls:
+                for tool_call in choice.message.tool_calls:
                     name = tool_call.function.name
                     args = json.loads(tool_call.function.arguments)
                     message.add_tool_use(tool_call.id, name, args)
@@ -152,21 +179,33 @@ class OpenAIModel(ImageChatModel, StreamingChatModel, ToolChatModel):
                 raise ValueError('Unexpected completion finish reason')
             
         return message.build()
-        
-
     
-    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None, None]:
+    def chat_stream(self, messages: Sequence['Message']) -> Generator[str, None, 'Usage | None']:
+        stream = StreamResult(self.chat_stream_candidates(messages, 1))
+        for _, chunk in stream:
+            yield chunk
+        return stream.value.get(0) if stream.value is not None else None
+    
+    def chat_stream_candidates(self, messages: Sequence['Message'], n: int) -> Generator[tuple[int, str], None, dict[int, 'Usage']]:
         stream = self._client.chat.completions.create(
             model=self.api_name,
             messages=self.process_messages(messages),
             stream=True,
+            n=n,
+            # the usage of the whole request comes in a last chunk without choices
+            stream_options={'include_usage': True},
             # tools=self.process_tools(),
             **self.config.dump_values()
         )
         
+        usages = {}
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+            if chunk.usage is not None:
+                usages[0] = self.process_usage(chunk.usage)
+            for choice in chunk.choices:
+                if choice.delta.content is not None:
+                    yield choice.index, choice.delta.content
+        return usages
             
 class GPT4OMini(OpenAIModel):
     
@@ -4,31 +4,34 @@ from collections import defaultdict
 
 
 class ChatStreamManager:
+    """Holds the tokens streamed for each chat until a websocket consumes them.
+    Each candidate response of a chat (see `ChatModel.chat_candidates`) has its own stream; candidate 0 is the default.
+    """
     def __init__(self):
         # self.active_chats stores the token queue and the entire message sent so far
-        self.active_chats: dict[UUID4, tuple[Queue, str]] = defaultdict(lambda : (Queue(), ''))
+        self.active_chats: dict[tuple[UUID4, int], tuple[Queue, str]] = defaultdict(lambda : (Queue(), ''))
     
-    def get_full_message(self, chat_id: UUID4) -> str:
-        return self.active_chats[chat_id][1]
+    def get_full_message(self, chat_id: UUID4, candidate: int = 0) -> str:
+        return self.active_chats[(chat_id, candidate)][1]
         
-    def reset_chat(self, chat_id: UUID4):
-        self.active_chats[chat_id] = (Queue(), '')
+    def reset_chat(self, chat_id: UUID4, candidate: int = 0):
+        self.active_chats[(chat_id, candidate)] = (Queue(), '')
     
-    def chat_has_message(self, chat_id: UUID4) -> bool:
-        return self.active_chats[chat_id][0].qsize() > 0
+    def chat_has_message(self, chat_id: UUID4, candidate: int = 0) -> bool:
+        return self.active_chats[(chat_id, candidate)][0].qsize() > 0
         
-    async def send_message(self, chat_id: UUID4, message: str):
-        queue, current_message = self.active_chats[chat_id]
-        self.active_chats[chat_id] = (queue, current_message + message)
+    async def send_message(self, chat_id: UUID4, message: str, candidate: int = 0):
+        queue, current_message = self.active_chats[(chat_id, candidate)]
+        self.active_chats[(chat_id, candidate)] = (queue, current_message + message)
         await queue.put(message)
         return
     
-    async def end_message(self, chat_id: UUID4):
-        queue, _ = self.active_chats[chat_id]
+    async def end_message(self, chat_id: UUID4, candidate: int = 0):
+        queue, _ = self.active_chats[(chat_id, candidate)]
         await queue.put('END MESSAGE')
         return
     
-    async def consume_message(self, chat_id: UUID4) -> str:
-        queue, _ = self.active_chats[chat_id]
+    async def consume_message(self, chat_id: UUID4, candidate: int = 0) -> str:
+        queue, _ = self.active_chats[(chat_id, candidate)]
         message = await queue.get()
         return message
\ No newline at end of file
@@ -25,5 +25,26 @@ class Config():
     secret_key: str = os.getenv('SECRET_KEY') # type: ignore
     algorithm: str = os.getenv('ALGORITHM') # type: ignore
     access_token_expire_minutes: int = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES')) # type: ignore
+    # optional settings
+    tool_cache_size: int = int(os.getenv('TOOL_CACHE_SIZE', '1024'))
+    tool_cache_shared: bool = os.getenv('TOOL_CACHE_SHARED', 'false').lower() == 'true'
+    tool_cache_purge_seconds: float = float(os.getenv('TOOL_CACHE_PURGE_SECONDS', '3600'))
+    tool_sandbox_workers: int = int(os.getenv('TOOL_SANDBOX_WORKERS', '2'))
+    db_pool_size: int = int(os.getenv('DB_POOL_SIZE', '5'))
+    db_max_overflow: int = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+    db_pool_timeout: float = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    db_pool_recycle: int = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    db_pool_pre_ping: bool = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    user_cache_size: int = int(os.getenv('USER_CACHE_SIZE', '1024'))
+    user_cache_ttl: float = float(os.getenv('USER_CACHE_TTL', '60'))
+    password_hash_rounds: int = int(os.getenv('PASSWORD_HASH_ROUNDS', '12'))
+    password_hash_workers: int = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    archive_idle_days: int = int(os.getenv('ARCHIVE_IDLE_DAYS', '90'))
+    archive_compression_level: int = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', '10'))
+    content_blob_threshold: int = int(os.getenv('CONTENT_BLOB_THRESHOLD', '16384'))
+    database_replica_urls: list[str] = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    replica_read_your_writes_seconds: float = float(os.getenv('REPLICA_READ_YOUR_WRITES_SECONDS', '5'))
+    history_cache_size: int = int(os.getenv('HISTORY_CACHE_SIZE', '256'))
+    backfill_pause_seconds: float = float(os.getenv('BACKFILL_PAUSE_SECONDS', '0.05'))
 
 config = Config()
\ No newline at end of file
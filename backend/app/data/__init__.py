@@ -1,4 +1,6 @@
-from .database import SessionLocal, engine
+from .database import SessionLocal, engine, AsyncSession, AsyncSessionLocal, async_engine, ReadSessionLocal, AsyncReadSessionLocal, recent_writes, mark_written, get_pool_stats
 from .crud import *
+from .history_cache import history_cache
+from . import async_crud
 from . import models
 from . import auth
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""store model configs by hash
+
+Revision ID: 4b8d1e6f2a93
+Revises: 5d2e9a7c4b18
+Create Date: 2024-11-27 14:02:18.934127
+
+This is the first of two steps. It adds the `model_config` table and the `config_hash` references, and moves
+the existing inline configs into the table in small batches, without locking `chat` or `message` for long.
+The inline `config` columns are kept, so the previous release keeps working while the new one is rolled out.
+Once it is, upgrade to a7c3f9e1d5b2, which moves any configs written in the meantime and drops the inline columns.
+
+"""
+from typing import Sequence, Union
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.data.backfill import Backfill, run_backfill, reset_backfills
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8d1e6f2a93'
+down_revision: Union[str, None] = '5d2e9a7c4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def config_hash(config: dict) -> str:
+    # must match app.data.crud.model_config_hash
+    payload = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def backfill_config_hashes(backfill: Backfill, table_name: str) -> None:
+    """Move the inline configs of a table into `model_config`, a batch at a time.
+    Rows that already have a hash are skipped, so a batch that is run again does nothing.
+    """
+    model_config = sa.table('model_config', sa.column('hash', sa.String()), sa.column('config', sa.JSON()))
+    table = sa.table(table_name, sa.column('id', sa.UUID()), sa.column('config', sa.JSON()), sa.column('config_hash', sa.String()))
+    insert = (postgresql.insert if backfill.conn.dialect.name == 'postgresql' else sqlite.insert)(model_config).on_conflict_do_nothing()
+    stmt = sa.select(table.c.id, table.c.config).where(table.c.config_hash.is_(None), table.c.config.isnot(None))
+    for rows in backfill.batches(stmt, BATCH_SIZE):
+        ids_by_hash = {}
+        configs = {}
+        for row in rows:
+            # JSON null is not SQL NULL, so rows without a config can still get here
+            if row.config is None:
+                continue
+            h = config_hash(row.config)
+            configs[h] = row.config
+            ids_by_hash.setdefault(h, []).append(row.id)
+        if configs:
+            backfill.conn.execute(insert, [{'hash': h, 'config': c} for h, c in configs.items()])
+        # configs repeat a lot, so one update per distinct config is only a handful of statements per batch
+        for h, ids in ids_by_hash.items():
+            backfill.conn.execute(sa.update(table).where(table.c.id.in_(ids)).values(config_hash=h))
+
+
+def restore_inline_configs(table_name: str) -> None:
+    op.execute(
+        f'UPDATE {table_name} SET config = model_config.config FROM model_config '
+        f'WHERE {table_name}.config_hash = model_config.hash AND {table_name}.config IS NULL'
+    )
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('model_config',
+    sa.Column('hash', sa.String(), nullable=False),
+    sa.Column('config', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('hash')
+    )
+    op.add_column('chat', sa.Column('config_hash', sa.String(), nullable=True))
+    op.create_foreign_key('chat_config_hash_fkey', 'chat', 'model_config', ['config_hash'], ['hash'])
+    op.add_column('message', sa.Column('config_hash', sa.String(), nullable=True))
+    op.create_foreign_key('message_config_hash_fkey', 'message', 'model_config', ['config_hash'], ['hash'])
+    # ### end Alembic commands ###
+    run_backfill(revision, backfill_config_hashes, 'chat', deferrable=True)
+    run_backfill(revision, backfill_config_hashes, 'message', deferrable=True)
+
+
+def downgrade() -> None:
+    # configs written by the new release only exist in model_config
+    restore_inline_configs('message')
+    restore_inline_configs('chat')
+    reset_backfills(revision)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_constraint('message_config_hash_fkey', 'message', type_='foreignkey')
+    op.drop_column('message', 'config_hash')
+    op.drop_constraint('chat_config_hash_fkey', 'chat', type_='foreignkey')
+    op.drop_column('chat', 'config_hash')
+    op.drop_table('model_config')
+    # ### end Alembic commands ###
@@ -0,0 +1,93 @@
+"""index message text for search
+
+Revision ID: b2d6f8a1c3e5
+Revises: e7d2b4a9c3f6
+Create Date: 2024-12-16 10:12:40.518336
+
+Full-text search on PostgreSQL indexed the generated `message_content.search_document`, so messages dropped out of it
+when their chat was archived. Their text is now indexed in `message_search` instead, which archiving doesn't touch
+(the SQLite FTS tables have always kept their own copy of it). The old column is dropped by f4a8c2e6b9d1, on the
+`contract` branch, since the previous release still searches it.
+
+"""
+from collections import defaultdict
+from typing import Sequence, Union
+import json
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import zstandard
+
+from app.data.backfill import Backfill, run_backfill, reset_backfills
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d6f8a1c3e5'
+down_revision: Union[str, None] = 'e7d2b4a9c3f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 100
+
+
+def index_message_text(backfill: Backfill) -> None:
+    """Index the full text contents of every existing message other than system prompts, a batch of chats at a time,
+    including those stored out of line and those of archived chats. Messages indexed by the new release in the meantime are left as they are.
+    """
+    chat = sa.table('chat', sa.column('id', sa.UUID()))
+    message = sa.table('message', sa.column('id', sa.UUID()), sa.column('chat_id', sa.UUID()), sa.column('role', sa.String()))
+    message_content = sa.table('message_content', sa.column('id', sa.UUID()), sa.column('message_id', sa.UUID()), sa.column('order', sa.Integer()), sa.column('type', sa.String()), sa.column('content', sa.JSON()))
+    content_blob = sa.table('content_blob', sa.column('content_id', sa.UUID()), sa.column('content', sa.JSON()))
+    chat_archive = sa.table('chat_archive', sa.column('chat_id', sa.UUID()), sa.column('contents', sa.LargeBinary()))
+    message_search = sa.table('message_search', sa.column('message_id', sa.UUID()), sa.column('body', sa.Text()))
+    insert = postgresql.insert(message_search).on_conflict_do_nothing()
+    conn = backfill.conn
+    for chats in backfill.batches(sa.select(chat.c.id), BATCH_SIZE):
+        chat_ids = [row.id for row in chats]
+        message_ids = set(conn.scalars(sa.select(message.c.id).where(message.c.chat_id.in_(chat_ids), message.c.role != 'SYSTEM')))
+        # must match app.data.search.searchable_text
+        texts = defaultdict(list)
+        for row in conn.execute(
+            # contents stored out of line only keep a preview in message_content; their full text is in content_blob
+            sa.select(message_content.c.message_id, sa.func.coalesce(content_blob.c.content, message_content.c.content).label('content'))
+            .outerjoin(content_blob, content_blob.c.content_id == message_content.c.id)
+            .where(message_content.c.message_id.in_(message_ids), message_content.c.type == 'TEXT')
+            .order_by(message_content.c.message_id, message_content.c.order)
+        ):
+            if isinstance(row.content, str):
+                texts[row.message_id].append(row.content)
+        for row in conn.execute(sa.select(chat_archive.c.contents).where(chat_archive.c.chat_id.in_(chat_ids))):
+            archived = json.loads(zstandard.ZstdDecompressor().decompress(row.contents))
+            for content in sorted(archived, key=lambda content: (content['message_id'], content['order'])):
+                # archived types are enum values ('text'), rather than the names stored in message_content ('TEXT')
+                message_id = uuid.UUID(content['message_id'])
+                if content['type'] == 'text' and message_id in message_ids and isinstance(content['content'], str):
+                    texts[message_id].append(content['content'])
+        rows = [{'message_id': message_id, 'body': '\n\n'.join(bodies)} for message_id, bodies in texts.items() if bodies]
+        if rows:
+            conn.execute(insert, rows)
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('message_search',
+    sa.Column('message_id', sa.UUID(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('search_document', postgresql.TSVECTOR(), sa.Computed("to_tsvector('english', body)", persisted=True), nullable=True),
+    sa.ForeignKeyConstraint(['message_id'], ['message.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('message_id')
+    )
+    op.create_index('ix_message_search_search_document', 'message_search', ['search_document'], unique=False, postgresql_using='gin')
+    # ### end Alembic commands ###
+    # messages the backfill hasn't reached yet can't be found until it does
+    run_backfill(revision, index_message_text, deferrable=True)
+
+
+def downgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('ix_message_search_search_document', table_name='message_search', postgresql_using='gin')
+    op.drop_table('message_search')
+    # ### end Alembic commands ###
+    reset_backfills(revision)
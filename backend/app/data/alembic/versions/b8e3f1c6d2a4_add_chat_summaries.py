@@ -0,0 +1,136 @@
+"""add chat summaries
+
+Revision ID: b8e3f1c6d2a4
+Revises: a4c7e2d9f831
+Create Date: 2024-12-09 11:26:53.740218
+
+"""
+from collections import defaultdict
+from typing import Sequence, Union
+import json
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+import zstandard
+
+from app.data.backfill import Backfill, run_backfill, reset_backfills
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e3f1c6d2a4'
+down_revision: Union[str, None] = 'a4c7e2d9f831'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 100
+# must match app.data.crud.CHAT_PREVIEW_CHARS and TOKEN_CHARS
+CHAT_PREVIEW_CHARS = 200
+TOKEN_CHARS = 4
+
+
+def estimate_tokens(contents: list[dict]) -> int:
+    # must match app.data.crud.estimate_tokens; contents archived before they could be stored out of line have no content_size
+    size = 0
+    for content in contents:
+        if content['type'] in ('TEXT', 'TOOL_RESULT'):
+            size += content['content_size'] if content.get('content_size') is not None else len(json.dumps(content['content'], default=str).encode('utf-8'))
+    return (size + TOKEN_CHARS - 1) // TOKEN_CHARS
+
+
+def chat_preview(contents: list[dict]) -> str | None:
+    # must match app.data.crud.chat_preview
+    for content in contents:
+        if content['type'] == 'TEXT' and isinstance(content['content'], str):
+            text = ' '.join(content['content'].split())
+            if text:
+                return text[:CHAT_PREVIEW_CHARS]
+    return None
+
+
+def backfill_chat_summaries(backfill: Backfill) -> None:
+    """Compute the summary of every chat from its messages, a batch of chats at a time, including the contents of
+    archived chats. A chat is only updated if its version hasn't changed since its messages were read; chats
+    written to in the meantime by the new release (which keeps the summary up to date itself from then on) are
+    computed again.
+    """
+    chat = sa.table('chat', sa.column('id', sa.UUID()), sa.column('created_at', sa.DateTime()), sa.column('version', sa.Integer()),
+        sa.column('message_count', sa.Integer()), sa.column('last_message_at', sa.DateTime()), sa.column('last_preview', sa.String()), sa.column('total_tokens', sa.Integer()))
+    message = sa.table('message', sa.column('id', sa.UUID()), sa.column('chat_id', sa.UUID()), sa.column('role', sa.String()), sa.column('selected', sa.Boolean()), sa.column('created_at', sa.DateTime()))
+    message_content = sa.table('message_content', sa.column('message_id', sa.UUID()), sa.column('order', sa.Integer()), sa.column('type', sa.String()), sa.column('content', sa.JSON()), sa.column('content_size', sa.Integer()))
+    chat_archive = sa.table('chat_archive', sa.column('chat_id', sa.UUID()), sa.column('contents', sa.LargeBinary()))
+
+    def summarize(conn, chats: list) -> list:
+        """Update the summaries of the given chats, returning those that changed while being read."""
+        chat_ids = [row.id for row in chats]
+        messages = defaultdict(list)
+        for row in conn.execute(
+            sa.select(message.c.id, message.c.chat_id, message.c.selected, message.c.created_at)
+            .where(message.c.chat_id.in_(chat_ids), message.c.role != 'SYSTEM')
+            .order_by(message.c.created_at)
+        ):
+            messages[row.chat_id].append(row)
+        contents = defaultdict(list)
+        for row in conn.execute(
+            sa.select(message_content.c.message_id, message_content.c.type, message_content.c.content, message_content.c.content_size)
+            .join(message, message.c.id == message_content.c.message_id)
+            .where(message.c.chat_id.in_(chat_ids))
+            .order_by(message_content.c.message_id, message_content.c.order)
+        ):
+            contents[row.message_id].append(dict(row._mapping))
+        for row in conn.execute(sa.select(chat_archive.c.contents).where(chat_archive.c.chat_id.in_(chat_ids))):
+            archived = json.loads(zstandard.ZstdDecompressor().decompress(row.contents))
+            for content in sorted(archived, key=lambda content: (content['message_id'], content['order'])):
+                # archived types are enum values ('text'), rather than the names stored in message_content ('TEXT')
+                contents[uuid.UUID(content['message_id'])].append({**content, 'type': content['type'].upper()})
+        changed = []
+        for chat_row in chats:
+            chat_messages = messages[chat_row.id]
+            selected = [row for row in chat_messages if row.selected]
+            previews = (chat_preview(contents[row.id]) for row in reversed(selected))
+            result = conn.execute(
+                sa.update(chat).where(chat.c.id == chat_row.id, chat.c.version == chat_row.version).values(
+                    message_count=len(selected),
+                    last_message_at=chat_messages[-1].created_at if chat_messages else chat_row.created_at,
+                    last_preview=next((preview for preview in previews if preview is not None), None),
+                    total_tokens=sum(estimate_tokens(contents[row.id]) for row in chat_messages),
+                )
+            )
+            if result.rowcount == 0:
+                changed.append(chat_row)
+        return changed
+
+    conn = backfill.conn
+    for chats in backfill.batches(sa.select(chat.c.id, chat.c.created_at, chat.c.version), BATCH_SIZE):
+        changed = summarize(conn, chats)
+        while changed:
+            changed = summarize(conn, conn.execute(
+                sa.select(chat.c.id, chat.c.created_at, chat.c.version).where(chat.c.id.in_([row.id for row in changed]))
+            ).all())
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('chat', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chat', sa.Column('last_message_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+    op.add_column('chat', sa.Column('last_preview', sa.String(), nullable=True))
+    op.add_column('chat', sa.Column('total_tokens', sa.Integer(), server_default='0', nullable=False))
+    # ### end Alembic commands ###
+    # chats the backfill hasn't reached yet are listed as of the upgrade, with empty summaries, until it does
+    run_backfill(revision, backfill_chat_summaries, deferrable=True)
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_index('ix_chat_user_id_last_message_at_id', 'chat', ['user_id', 'last_message_at', 'id'], unique=False)
+    op.drop_index('ix_chat_user_id_created_at_id', table_name='chat')
+    # ### end Alembic commands ###
+
+
+def downgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_index('ix_chat_user_id_created_at_id', 'chat', ['user_id', 'created_at', 'id'], unique=False)
+    op.drop_index('ix_chat_user_id_last_message_at_id', table_name='chat')
+    op.drop_column('chat', 'total_tokens')
+    op.drop_column('chat', 'last_preview')
+    op.drop_column('chat', 'last_message_at')
+    op.drop_column('chat', 'message_count')
+    # ### end Alembic commands ###
+    reset_backfills(revision)
@@ -0,0 +1,75 @@
+"""add message parent id
+
+Revision ID: c5a9e3f7b2d1
+Revises: b8e3f1c6d2a4
+Create Date: 2024-12-11 10:37:22.615904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.data.backfill import Backfill, run_backfill, reset_backfills
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a9e3f7b2d1'
+down_revision: Union[str, None] = 'b8e3f1c6d2a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 100
+
+
+def link_messages(backfill: Backfill) -> None:
+    """Set the parent of every existing message, a batch of chats at a time: the newest message before it in its chat
+    that was part of the history, other than its own candidates. System prompts stay roots.
+    """
+    chat = sa.table('chat', sa.column('id', sa.UUID()), sa.column('version', sa.Integer()), sa.column('messages_linked', sa.Boolean()))
+    message = sa.table('message', sa.column('id', sa.UUID()), sa.column('chat_id', sa.UUID()), sa.column('role', sa.String()), sa.column('created_at', sa.DateTime()),
+        sa.column('parent_id', sa.UUID()), sa.column('candidate_group', sa.UUID()), sa.column('selected', sa.Boolean()))
+    parent = message.alias('parent')
+    # must match app.data.crud.link_messages, which links a chat the backfill hasn't reached yet before it is branched
+    newest_parent = (
+        sa.select(parent.c.id)
+        .where(
+            parent.c.chat_id == message.c.chat_id, parent.c.selected, parent.c.created_at < message.c.created_at,
+            sa.or_(message.c.candidate_group.is_(None), parent.c.candidate_group.is_(None), parent.c.candidate_group != message.c.candidate_group),
+        )
+        .order_by(parent.c.created_at.desc(), parent.c.id.desc()).limit(1).scalar_subquery()
+    )
+    stmt = sa.select(chat.c.id).where(~chat.c.messages_linked)
+    for rows in backfill.batches(stmt, BATCH_SIZE):
+        # chats linked by the app in the meantime may already have messages that are roots on purpose
+        unlinked = sa.select(chat.c.id).where(chat.c.id.in_([row.id for row in rows]), ~chat.c.messages_linked)
+        backfill.conn.execute(
+            sa.update(message).where(message.c.chat_id.in_(unlinked), message.c.parent_id.is_(None), message.c.role != 'SYSTEM').values(parent_id=newest_parent)
+        )
+        # the version is bumped so that cached histories pick up the parents
+        backfill.conn.execute(
+            sa.update(chat).where(chat.c.id.in_([row.id for row in rows]), ~chat.c.messages_linked).values(messages_linked=True, version=chat.c.version + 1)
+        )
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.add_column('message', sa.Column('parent_id', sa.UUID(), nullable=True))
+    op.create_index('ix_message_parent_id', 'message', ['parent_id'], unique=False)
+    op.create_foreign_key('message_parent_id_fkey', 'message', 'message', ['parent_id'], ['id'], ondelete='CASCADE')
+    op.add_column('chat', sa.Column('messages_linked', sa.Boolean(), server_default='false', nullable=False))
+    # ### end Alembic commands ###
+    # existing chats are unlinked, chats created from now on are linked as they are written
+    op.alter_column('chat', 'messages_linked', server_default='true')
+    # messages are linked on demand before their chat is branched, so this can run after the deploy
+    run_backfill(revision, link_messages, deferrable=True)
+
+
+def downgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_column('chat', 'messages_linked')
+    op.drop_constraint('message_parent_id_fkey', 'message', type_='foreignkey')
+    op.drop_index('ix_message_parent_id', table_name='message')
+    op.drop_column('message', 'parent_id')
+    # ### end Alembic commands ###
+    reset_backfills(revision)
@@ -0,0 +1,108 @@
+"""store large contents out of line
+
+Revision ID: f2b9d5e3a7c1
+Revises: e6a1c4b8d2f7
+Create Date: 2024-12-04 16:05:39.274410
+
+"""
+from typing import Sequence, Union
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.data.backfill import Backfill, run_backfill, reset_backfills
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b9d5e3a7c1'
+down_revision: Union[str, None] = 'e6a1c4b8d2f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+# must match the defaults of app.config.content_blob_threshold and app.data.crud.CONTENT_PREVIEW_CHARS
+CONTENT_BLOB_THRESHOLD = 16384
+CONTENT_PREVIEW_CHARS = 1000
+
+
+def move_large_contents_out_of_line(backfill: Backfill) -> None:
+    """Move existing large text and tool result contents into `content_blob`, a batch at a time, the same way
+    `crud.insert_contents` does for new ones. Contents that were already moved are skipped.
+
+    This runs next to the app, which may rewrite a content in place (e.g. a system prompt) at any point. A content
+    is only replaced by its preview if it is still inline and still equal to the blob copied from it, and the
+    preview is made from that blob, so a rewrite is never lost; a content rewritten in the meantime stays inline.
+    """
+    message_content = sa.table('message_content', sa.column('id', sa.UUID()), sa.column('type', sa.String()), sa.column('content', sa.JSON()), sa.column('content_size', sa.Integer()))
+    content_blob = sa.table('content_blob', sa.column('content_id', sa.UUID()), sa.column('content', sa.JSON()))
+    insert = postgresql.insert if backfill.conn.dialect.name == 'postgresql' else sqlite.insert
+    conn = backfill.conn
+    stmt = sa.select(message_content.c.id, message_content.c.content).where(
+        message_content.c.type.in_(['TEXT', 'TOOL_RESULT']), message_content.c.content_size.is_(None)
+    )
+
+    def remove_inline_blobs(content_ids: list):
+        # blobs of contents that are still inline are left over from an interrupted batch, or from a content
+        # that was rewritten while it was being moved
+        inline_ids = sa.select(message_content.c.id).where(message_content.c.id.in_(content_ids), message_content.c.content_size.is_(None))
+        conn.execute(sa.delete(content_blob).where(content_blob.c.content_id.in_(inline_ids)))
+
+    for rows in backfill.batches(stmt, BATCH_SIZE):
+        large_ids = [row.id for row in rows if len(json.dumps(row.content, default=str).encode('utf-8')) > CONTENT_BLOB_THRESHOLD]
+        if not large_ids:
+            continue
+        remove_inline_blobs(large_ids)
+        conn.execute(
+            insert(content_blob)
+            .from_select(['content_id', 'content'], sa.select(message_content.c.id, message_content.c.content).where(
+                message_content.c.id.in_(large_ids), message_content.c.content_size.is_(None)
+            ))
+            .on_conflict_do_nothing()
+        )
+        # json has no equality operator in postgres; the text of a blob is the text it was copied from
+        blob_text = sa.select(sa.cast(content_blob.c.content, sa.Text)).where(content_blob.c.content_id == message_content.c.id).scalar_subquery()
+        unchanged = [message_content.c.content_size.is_(None), sa.cast(message_content.c.content, sa.Text) == blob_text]
+        changed = []
+        for blob in conn.execute(sa.select(content_blob.c.content_id, content_blob.c.content).where(content_blob.c.content_id.in_(large_ids))):
+            serialized = json.dumps(blob.content, default=str)
+            size = len(serialized.encode('utf-8'))
+            if size <= CONTENT_BLOB_THRESHOLD:
+                changed.append(blob.content_id)
+                continue
+            preview = blob.content if isinstance(blob.content, str) else serialized
+            result = conn.execute(
+                sa.update(message_content).where(message_content.c.id == blob.content_id, *unchanged)
+                .values(content=preview[:CONTENT_PREVIEW_CHARS], content_size=size)
+            )
+            if result.rowcount == 0:
+                changed.append(blob.content_id)
+        if changed:
+            remove_inline_blobs(changed)
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('content_blob',
+    sa.Column('content_id', sa.UUID(), nullable=False),
+    sa.Column('content', sa.JSON(), nullable=False),
+    sa.ForeignKeyConstraint(['content_id'], ['message_content.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('content_id')
+    )
+    op.add_column('message_content', sa.Column('content_size', sa.Integer(), nullable=True))
+    # ### end Alembic commands ###
+    # contents that haven't been moved yet are still loaded inline, so this can run after the deploy
+    run_backfill(revision, move_large_contents_out_of_line, deferrable=True)
+
+
+def downgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.execute(
+        'UPDATE message_content SET content = content_blob.content FROM content_blob '
+        'WHERE message_content.id = content_blob.content_id'
+    )
+    reset_backfills(revision)
+    op.drop_column('message_content', 'content_size')
+    op.drop_table('content_blob')
+    # ### end Alembic commands ###
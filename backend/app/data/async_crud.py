@@ -0,0 +1,83 @@
+"""
+Async versions of the `crud` functions used while handling requests, for use with `AsyncSession` in async dependencies and routes.
+Statements and schema builders are shared with `crud`, so both versions always load the same data.
+"""
+import datetime
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import UUID4
+
+from app.data import models
+from app.data.history_cache import history_cache
+from app.data.crud import select_chat_messages, select_chat_view, select_chat_archive, select_content_blobs, select_model_configs, merge_archived_contents, build_messages
+from app import schemas
+
+async def get_user(db: AsyncSession, user_id: UUID4) -> models.User | None:
+    return (await db.execute(select(models.User).where(models.User.id == user_id))).scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str) -> models.User | None:
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
+    from app.data.auth import get_password_hash_async
+    db_user = models.User(email=user.email, hashed_password=await get_password_hash_async(user.password))
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def get_chat(db: AsyncSession, chat_id: UUID4) -> schemas.ChatView | None:
+    chat_row = (await db.execute(select_chat_view(chat_id))).first()
+    if chat_row is None:
+        return None
+    return schemas.ChatView.model_validate(dict(chat_row._mapping))
+
+async def get_chat_messages(db: AsyncSession, chat_id: UUID4, include_config: bool = True, load_blobs: bool = True) -> list[schemas.MessageView]:
+    messages_stmt, contents_stmt = select_chat_messages(chat_id, include_config)
+    message_rows = (await db.execute(messages_stmt)).all()
+    configs_stmt = select_model_configs(message_rows)
+    config_rows = (await db.execute(configs_stmt)).all() if configs_stmt is not None else []
+    content_rows = (await db.execute(contents_stmt)).all()
+    blobs_stmt = select_content_blobs(content_rows) if load_blobs else None
+    blob_rows = (await db.execute(blobs_stmt)).all() if blobs_stmt is not None else []
+    content_rows = merge_archived_contents(content_rows, (await db.execute(select_chat_archive(chat_id))).scalar(), load_blobs=load_blobs)
+    return build_messages(message_rows, content_rows, config_rows, blob_rows)
+
+async def get_chat_full(db: AsyncSession, chat_id: UUID4, include_message_config: bool = True, load_blobs: bool = True) -> schemas.ChatFull | None:
+    chat_row = (await db.execute(select_chat_view(chat_id))).first()
+    if chat_row is None:
+        return None
+    messages = await get_chat_messages(db, chat_id, include_config=include_message_config, load_blobs=load_blobs)
+    return schemas.ChatFull.model_validate({**chat_row._mapping, 'messages': messages})
+
+async def get_chat_history(db: AsyncSession, chat_id: UUID4) -> schemas.ChatFull | None:
+    chat_row = (await db.execute(select_chat_view(chat_id))).first()
+    if chat_row is None:
+        return None
+    messages = history_cache.get(chat_id, chat_row.version)
+    if messages is None:
+        messages = await get_chat_messages(db, chat_id, include_config=False)
+        history_cache.set(chat_id, chat_row.version, messages)
+    return schemas.ChatFull.model_validate({**chat_row._mapping, 'messages': messages})
+
+async def get_api_key_map(db: AsyncSession, user_id: UUID4) -> dict[str, str]:
+    return dict((await db.execute(select(models.APIKey.provider, models.APIKey.key).where(models.APIKey.user_id == user_id))).all())
+
+async def get_api_key(db: AsyncSession, user_id: UUID4, provider: schemas.ModelAPI | schemas.ToolAPI) -> models.APIKey | None:
+    return (await db.execute(select(models.APIKey).where(models.APIKey.user_id == user_id, models.APIKey.provider == provider))).scalars().first()
+
+async def get_tool_result(db: AsyncSession, key: str) -> models.ToolResultCacheEntry | None:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (await db.execute(select(models.ToolResultCacheEntry).where(models.ToolResultCacheEntry.key == key, models.ToolResultCacheEntry.expires_at > now))).scalars().first()
+
+async def set_tool_result(db: AsyncSession, key: str, tool_name: str, result: object, expires_at: datetime.datetime):
+    db_entry = models.ToolResultCacheEntry(key=key, tool_name=tool_name, result=result, expires_at=expires_at)
+    db_entry = await db.merge(db_entry)
+    await db.commit()
+    return db_entry
+
+async def delete_expired_tool_results(db: AsyncSession) -> int:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    result = await db.execute(delete(models.ToolResultCacheEntry).where(models.ToolResultCacheEntry.expires_at <= now))
+    await db.commit()
+    return result.rowcount
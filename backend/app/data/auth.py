@@ -1,8 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from app.data.crud import get_user_by_email
+from app.data import async_crud
+from app.config import config
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes made with any other cost are flagged by `verify_and_update`, so they are upgraded (or downgraded) on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=config.password_hash_rounds,
+    bcrypt__min_rounds=config.password_hash_rounds,
+    bcrypt__max_rounds=config.password_hash_rounds,
+)
+
+# bcrypt releases the GIL, so a few threads are enough to keep hashing off the event loop;
+# the pool is bounded so that a burst of logins queues up instead of starving every other request of CPU
+password_executor = ThreadPoolExecutor(max_workers=config.password_hash_workers, thread_name_prefix='password-hash')
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -10,10 +26,35 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def get_password_hash_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verify a password in the password executor.
+
+    Returns:
+        tuple[bool, str | None]: Whether the password is correct, and a new hash for it if the stored one uses a different cost
+    """
+    return await asyncio.get_running_loop().run_in_executor(password_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
         return False
-    return user
\ No newline at end of file
+    return user
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    """Authenticate a user without blocking the event loop, rehashing their password if the configured cost has changed.
+    """
+    user = await async_crud.get_user_by_email(db, email)
+    if not user:
+        return False
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
+        return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
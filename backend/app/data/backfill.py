@@ -0,0 +1,220 @@
+"""
+Batched, resumable data backfills for alembic migrations.
+
+A backfill is a function in a revision file that walks a table in keyset order with `Backfill.batches`, updating
+one batch at a time. Every batch commits on its own, so no lock is held for longer than a batch takes, and batches
+are spaced out by `config.backfill_pause_seconds` to leave room for the app's own queries. The last key done is kept
+in `backfill_progress`, so an interrupted backfill resumes where it stopped rather than starting over. Batches must
+be idempotent: one that committed just before the process died is run again.
+
+Revisions make their schema changes and then hand their backfills to `run_backfill`. Deferrable backfills (those
+the new release works without, only less well until they finish) are recorded rather than run when migrating with
+`alembic -x defer_backfills=true upgrade expand@head`, so a deploy only waits for the schema changes. The deferred ones
+are then run next to the app with `python -m app.data.backfill`. A later revision that changes what a deferred
+backfill reads has to finish it first, with `finish_backfills`.
+"""
+from collections.abc import Callable, Iterator, Sequence
+import argparse
+import datetime
+import logging
+import sys
+import time
+
+from alembic import context, op
+from alembic.config import Config as AlembicConfig
+from alembic.script import ScriptDirectory
+import sqlalchemy as sa
+
+from app.config import config
+
+# kept apart from the app's models, since it only exists once a backfill has run
+metadata = sa.MetaData()
+backfill_progress = sa.Table('backfill_progress', metadata,
+    sa.Column('name', sa.String(), primary_key=True),
+    sa.Column('revision', sa.String(), nullable=False),
+    sa.Column('function', sa.String(), nullable=False),
+    sa.Column('arguments', sa.JSON(), nullable=False),
+    sa.Column('deferred', sa.Boolean(), nullable=False),
+    sa.Column('last_key', sa.String(), nullable=True),
+    sa.Column('rows', sa.Integer(), nullable=False),
+    sa.Column('batches', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+)
+
+# progress is logged at most this often, and when a backfill finishes
+REPORT_SECONDS = 10
+
+logger = logging.getLogger('alembic.backfill')
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class Backfill:
+    """A run of one backfill, given to its function along with its arguments.
+
+    Args:
+        conn (sa.Connection): A connection in autocommit mode, for the backfill's statements
+        name (str): The name progress is recorded under
+        pause (float): Seconds to wait between batches
+    """
+
+    def __init__(self, conn: sa.Connection, name: str, pause: float):
+        self.conn = conn
+        self.name = name
+        self.pause = pause
+        progress = conn.execute(sa.select(backfill_progress).where(backfill_progress.c.name == name)).one()
+        self.last_key = progress.last_key
+        self.rows = progress.rows
+        self.batches_done = progress.batches
+
+    def batches(self, stmt: sa.Select, batch_size: int = 1000) -> Iterator[Sequence[sa.Row]]:
+        """Select rows a batch at a time, in order of the statement's first column, which must be a unique UUID,
+        integer or string key. After the caller is done with a batch, its last key is saved, so the next run of
+        the backfill starts after it. A backfill should only walk one statement.
+        """
+        key = stmt.selected_columns[0]
+        last_key = key.type.python_type(self.last_key) if self.last_key is not None else None
+        started = time.monotonic()
+        rows_before = self.rows
+        reported = started
+        while True:
+            batch_stmt = stmt.where(key > last_key) if last_key is not None else stmt
+            rows = self.conn.execute(batch_stmt.order_by(key).limit(batch_size)).all()
+            if not rows:
+                break
+            yield rows
+            last_key = rows[-1][0]
+            self.last_key = str(last_key)
+            self.rows += len(rows)
+            self.batches_done += 1
+            self.conn.execute(sa.update(backfill_progress).where(backfill_progress.c.name == self.name).values(
+                last_key=self.last_key, rows=self.rows, batches=self.batches_done, updated_at=utcnow(),
+            ))
+            if time.monotonic() - reported >= REPORT_SECONDS:
+                self.report(started, rows_before)
+                reported = time.monotonic()
+            if self.pause > 0:
+                time.sleep(self.pause)
+        self.report(started, rows_before)
+
+    def report(self, started: float, rows_before: int):
+        elapsed = time.monotonic() - started
+        rows = self.rows - rows_before
+        logger.info(f'{self.name}: {self.rows} rows in {self.batches_done} batches, {rows / elapsed if elapsed else 0:.0f} rows/s, last key {self.last_key}')
+
+
+BackfillFunction = Callable[..., None]
+
+
+def backfill_name(revision: str, function: BackfillFunction, args: Sequence) -> str:
+    return f'{revision}:{function.__name__}' + (f'({", ".join(str(arg) for arg in args)})' if args else '')
+
+
+def run(conn: sa.Connection, name: str, function: BackfillFunction, args: Sequence):
+    logger.info(f'Running backfill {name}')
+    function(Backfill(conn, name, config.backfill_pause_seconds), *args)
+    conn.execute(sa.update(backfill_progress).where(backfill_progress.c.name == name).values(completed_at=utcnow(), updated_at=utcnow()))
+
+
+def run_pending(conn: sa.Connection, script: ScriptDirectory, revisions: Sequence[str] | None = None) -> int:
+    """Run the deferred backfills that haven't finished, oldest first, resuming each one where it stopped.
+    Only those of the given revisions are run, if any are given.
+
+    Returns:
+        int: The number of backfills run
+    """
+    backfill_progress.create(conn, checkfirst=True)
+    stmt = sa.select(backfill_progress.c.name, backfill_progress.c.revision, backfill_progress.c.function, backfill_progress.c.arguments).where(
+        backfill_progress.c.deferred, backfill_progress.c.completed_at.is_(None)
+    )
+    if revisions is not None:
+        stmt = stmt.where(backfill_progress.c.revision.in_(revisions))
+    pending = conn.execute(stmt.order_by(backfill_progress.c.created_at)).all()
+    for row in pending:
+        # revision files are not importable by name, so their functions are found through alembic
+        function = getattr(script.get_revision(row.revision).module, row.function)
+        run(conn, row.name, function, row.arguments)
+    return len(pending)
+
+
+def run_backfill(revision: str, function: BackfillFunction, *args: str | int, deferrable: bool = False):
+    """Run a backfill from a revision's `upgrade`, outside of the migration's transaction.
+    A backfill that already finished under the same name is skipped.
+
+    Args:
+        revision (str): The revision running it
+        function (BackfillFunction): Called with a `Backfill` and `args`. Deferrable ones must be defined in the
+            revision's own file, where `python -m app.data.backfill` looks them up.
+        *args (str | int): Arguments for the function, which are part of the name progress is recorded under
+        deferrable (bool, optional): Whether the new release works while the backfill hasn't finished, so it can
+            be deferred with `-x defer_backfills=true`. Defaults to False.
+    """
+    name = backfill_name(revision, function, args)
+    defer = deferrable and context.get_x_argument(as_dictionary=True).get('defer_backfills', 'false').lower() == 'true'
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        backfill_progress.create(conn, checkfirst=True)
+        progress = conn.execute(sa.select(backfill_progress.c.completed_at).where(backfill_progress.c.name == name)).first()
+        if progress is not None and progress.completed_at is not None:
+            logger.info(f'Backfill {name} already finished')
+            return
+        if progress is None:
+            conn.execute(sa.insert(backfill_progress).values(
+                name=name, revision=revision, function=function.__name__, arguments=list(args), deferred=defer,
+                rows=0, batches=0, created_at=utcnow(), updated_at=utcnow(),
+            ))
+        elif defer:
+            conn.execute(sa.update(backfill_progress).where(backfill_progress.c.name == name).values(deferred=True))
+        if defer:
+            logger.info(f'Deferred backfill {name}; run it with python -m app.data.backfill')
+            return
+        run(conn, name, function, args)
+
+
+def finish_backfills(*revisions: str):
+    """Run the deferred backfills of earlier revisions that haven't finished yet, from the `upgrade` of a revision
+    that changes what they read.
+    """
+    with op.get_context().autocommit_block():
+        run_pending(op.get_bind(), context.script, revisions)
+
+
+def reset_backfills(revision: str):
+    """Forget the progress of a revision's backfills, from its `downgrade`, so upgrading again runs them again.
+    """
+    conn = op.get_bind()
+    if sa.inspect(conn).has_table('backfill_progress'):
+        conn.execute(sa.delete(backfill_progress).where(backfill_progress.c.revision == revision))
+
+
+def print_status(conn: sa.Connection):
+    backfill_progress.create(conn, checkfirst=True)
+    for row in conn.execute(sa.select(backfill_progress).order_by(backfill_progress.c.created_at)):
+        state = 'done' if row.completed_at is not None else 'pending' if row.deferred else 'interrupted'
+        print(f'{row.name}: {state}, {row.rows} rows in {row.batches} batches, last key {row.last_key}, updated {row.updated_at}')
+
+
+if __name__ == '__main__':
+    from app.data.database import engine
+
+    parser = argparse.ArgumentParser(description='Run the data backfills deferred by alembic -x defer_backfills=true.')
+    parser.add_argument('--status', action='store_true', help='list backfills and their progress instead')
+    parser.add_argument('--alembic-config', default='alembic.ini')
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT')
+        if options.status:
+            print_status(conn)
+        else:
+            try:
+                count = run_pending(conn, ScriptDirectory.from_config(AlembicConfig(options.alembic_config)))
+            except Exception:
+                # progress is kept, so running this again resumes where it stopped
+                logger.exception('A deferred backfill failed; run python -m app.data.backfill again to resume, or --status to see progress')
+                sys.exit(1)
+            logger.info(f'Ran {count} deferred backfills')
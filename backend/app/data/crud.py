@@ -1,9 +1,42 @@
-from sqlalchemy.orm import Session
-from pydantic import UUID4
+from sqlalchemy import CTE, Insert, Row, Select, and_, delete, exists, func, insert, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+from collections import defaultdict
+from collections.abc import Iterator, Sequence
+import datetime
+import hashlib
+import json
+import uuid
+import zstandard
+from pydantic import BaseModel, TypeAdapter, UUID4
 
+from app.config import config
 from app.data import models
+from app.data.database import mark_written
+from app.data.history_cache import history_cache, record_chat_write
+from app.data.search import get_search_index, render_snippet, searchable_text
 from app import schemas
-from app.util import Role
+from app.util import MessageContentType, Role
+
+CONTENT_PREVIEW_CHARS = 1000
+# only contents whose preview (a plain string) is still a valid content can be stored out of line
+BLOB_CONTENT_TYPES = {MessageContentType.TEXT, MessageContentType.TOOL_RESULT}
+# content fields that are only set on contents loaded from the database
+VIEW_CONTENT_FIELDS = {'id', 'content_size'}
+
+message_content_adapter = TypeAdapter(schemas.message_content_type)
+
+# how much of a chat's latest message is kept in `Chat.last_preview`
+CHAT_PREVIEW_CHARS = 200
+# how many of the newest messages are searched for one with text when a chat's preview has to be found again
+CHAT_PREVIEW_LOOKBACK = 20
+# a rough rule of thumb for English text and JSON, used to estimate `Chat.total_tokens`
+TOKEN_CHARS = 4
+# how many rows an export fetches from its server-side cursor at a time
+EXPORT_BATCH_SIZE = 500
+# the usage rollup of each granularity, and the columns they total
+USAGE_ROLLUPS = {'hour': models.UsageHourly, 'day': models.UsageDaily}
+USAGE_TOTALS = ['responses', 'streamed_responses', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms', 'time_to_first_token_ms']
 
 def get_user(db: Session, user_id: UUID4) -> models.User | None:
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -15,7 +48,7 @@ def get_users(db: Session, skip: int = 0, limit: int = 100) -> list[models.User]
     return db.query(models.User).offset(skip).limit(limit).all()
 
 def create_user(db: Session, user: schemas.UserCreate):
-    from data.auth import get_password_hash
+    from app.data.auth import get_password_hash
     hashed_password = get_password_hash(user.password)
     db_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
@@ -26,17 +59,594 @@ def create_user(db: Session, user: schemas.UserCreate):
 def get_chat(db: Session, chat_id: UUID4) -> models.Chat | None:
     return db.query(models.Chat).filter(models.Chat.id == chat_id).first()
 
-def get_chats(db: Session, user_id: UUID4, skip: int = 0, limit: int = 100):
-    return db.query(models.Chat).filter(models.Chat.user_id == user_id).order_by(models.Chat.created_at.desc()).offset(skip).limit(limit).all()
+def _message_columns(include_config: bool) -> list:
+    columns = [
+        models.Message.id,
+        models.Message.role,
+        models.Message.model,
+        models.Message.user_id,
+        models.Message.chat_id,
+        models.Message.created_at,
+        models.Message.parent_id,
+        models.Message.candidate_group,
+        models.Message.candidate_index,
+        models.Message.selected,
+    ]
+    if include_config:
+        columns.append(models.Message.config_hash)
+    return columns
+
+def _content_columns() -> list:
+    return [
+        models.MessageContent.id,
+        models.MessageContent.message_id,
+        models.MessageContent.type,
+        models.MessageContent.content,
+        models.MessageContent.image_type,
+        models.MessageContent.tool_call_id,
+        models.MessageContent.result_metadata,
+        models.MessageContent.compact_content,
+        models.MessageContent.content_size,
+    ]
+
+def _archived_content_columns() -> list:
+    return [models.MessageContent.order, *_content_columns()]
+
+def _on_active_branch(chat_id: UUID4):
+    """The condition for a message of a chat to be loaded with it: being on the active branch, or being another candidate
+    of a response on it (so the candidates can still be picked from).
+    """
+    selected = aliased(models.Message)
+    return and_(models.Message.chat_id == chat_id, or_(
+        models.Message.selected,
+        models.Message.candidate_group.in_(select(selected.candidate_group).where(selected.chat_id == chat_id, selected.selected, selected.candidate_group.is_not(None))),
+    ))
+
+def select_chat_messages(chat_id: UUID4, include_config: bool = True) -> tuple[Select, Select]:
+    """Build the two statements that load the messages on a chat's active branch (and the other candidates of its
+    responses): one for the message rows, one for all of their contents. Messages on other branches aren't read at all.
+    Only the columns needed to build the schemas are selected. Shared by the sync and async loaders.
+    """
+    messages_stmt = select(*_message_columns(include_config)).where(_on_active_branch(chat_id)).order_by(models.Message.created_at)
+    contents_stmt = select(*_content_columns()).join(models.Message, models.Message.id == models.MessageContent.message_id).where(_on_active_branch(chat_id)).order_by(models.MessageContent.message_id, models.MessageContent.order)
+    return messages_stmt, contents_stmt
+
+def select_message_page(chat_id: UUID4, limit: int, before: tuple[datetime.datetime, UUID4] | None = None, include_config: bool = True) -> Select:
+    """Build the statement that loads up to `limit` messages of a chat's active branch (and the other candidates of its
+    responses) older than `before`, newest first.
+    """
+    stmt = select(*_message_columns(include_config)).where(_on_active_branch(chat_id))
+    if before is not None:
+        stmt = stmt.where(tuple_(models.Message.created_at, models.Message.id) < tuple_(*before))
+    return stmt.order_by(models.Message.created_at.desc(), models.Message.id.desc()).limit(limit)
+
+def select_message_contents(message_ids: Sequence[UUID4]) -> Select:
+    return select(*_content_columns()).where(models.MessageContent.message_id.in_(message_ids)).order_by(models.MessageContent.message_id, models.MessageContent.order)
+
+def select_ancestors(message_id: UUID4) -> CTE:
+    """Build a recursive CTE of a message and the messages it follows, up to the root of its chat.
+    """
+    anchor = aliased(models.Message)
+    parent = aliased(models.Message)
+    path = select(anchor.id, anchor.parent_id, anchor.created_at).where(anchor.id == message_id).cte('ancestors', recursive=True)
+    return path.union_all(select(parent.id, parent.parent_id, parent.created_at).where(parent.id == path.c.parent_id))
+
+def select_descendants(message_id: UUID4) -> CTE:
+    """Build a recursive CTE of a message and every message that follows it, on any branch.
+    """
+    anchor = aliased(models.Message)
+    child = aliased(models.Message)
+    tree = select(anchor.id, anchor.created_at).where(anchor.id == message_id).cte('descendants', recursive=True)
+    return tree.union_all(select(child.id, child.created_at).where(child.parent_id == tree.c.id))
+
+def select_chat_archive(chat_id: UUID4) -> Select:
+    return select(models.ChatArchive.contents).where(models.ChatArchive.chat_id == chat_id)
+
+def pack_contents(content_rows: Sequence[dict]) -> tuple[bytes, int]:
+    """Serialize message content rows (with the columns of `_archived_content_columns`) and compress them with zstd.
+
+    Returns:
+        tuple[bytes, int]: The compressed blob, and the size of the uncompressed JSON
+    """
+    payload = json.dumps(content_rows, separators=(',', ':'), default=str).encode('utf-8')
+    return zstandard.ZstdCompressor(level=config.archive_compression_level).compress(payload), len(payload)
+
+def unpack_contents(data: bytes) -> list[dict]:
+    rows = json.loads(zstandard.ZstdDecompressor().decompress(data))
+    for row in rows:
+        row['id'] = uuid.UUID(row['id'])
+        row['message_id'] = uuid.UUID(row['message_id'])
+    return rows
+
+def merge_archived_contents(content_rows: Sequence[Row], archived: bytes | None, message_ids: set[UUID4] | None = None, load_blobs: bool = True) -> list[Row | dict]:
+    """Add a chat's archived contents (if it has any) to the content rows loaded from `message_content`,
+    optionally only those of the given messages. A message's contents are either all archived or all not.
+    Archived contents are always stored in full; unless `load_blobs` is set, large ones are cut down to previews,
+    just like contents stored out of line.
+    """
+    if archived is None:
+        return list(content_rows)
+    archived_rows = []
+    for row in unpack_contents(archived):
+        if message_ids is not None and row['message_id'] not in message_ids:
+            continue
+        row.pop('order', None)
+        if not load_blobs:
+            preview = preview_content(row['type'], row['content'])
+            if preview is not None:
+                row['content'], row['content_size'] = preview
+        archived_rows.append(row)
+    return [*content_rows, *archived_rows]
+
+def preview_content(content_type: MessageContentType, content: object) -> tuple[str, int] | None:
+    """Get the preview that replaces a content stored out of line, and the content's size in bytes of JSON,
+    or None if the content is small enough (or of a type) to be stored inline.
+    """
+    if content_type not in BLOB_CONTENT_TYPES:
+        return None
+    serialized = json.dumps(content, default=str)
+    size = len(serialized.encode('utf-8'))
+    if size <= config.content_blob_threshold:
+        return None
+    preview = content if isinstance(content, str) else serialized
+    return preview[:CONTENT_PREVIEW_CHARS], size
+
+def utcnow() -> datetime.datetime:
+    """The current time as a naive UTC datetime, as every timestamp the app writes is stored, so that timestamps of
+    chats and messages order together.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def estimate_tokens(contents: Sequence) -> int:
+    """Estimate the tokens of a message's text and tool result contents from their size in bytes of JSON,
+    at `TOKEN_CHARS` bytes per token. Contents stored out of line count at their full size.
+    """
+    size = 0
+    for content in contents:
+        if content.type in (MessageContentType.TEXT, MessageContentType.TOOL_RESULT):
+            size += content.content_size if content.content_size is not None else len(json.dumps(content.content, default=str).encode('utf-8'))
+    return (size + TOKEN_CHARS - 1) // TOKEN_CHARS
+
+def chat_preview(contents: Sequence) -> str | None:
+    """Get the preview of a message shown in the chat list: the start of its first text content, on one line.
+    """
+    for content in contents:
+        if content.type == MessageContentType.TEXT and isinstance(content.content, str):
+            text = ' '.join(content.content.split())
+            if text:
+                return text[:CHAT_PREVIEW_CHARS]
+    return None
+
+def find_chat_activity(db: Session, chat_id: UUID4) -> dict:
+    """Find a chat's `last_message_at` and `last_preview` again from its newest messages, after one of them changed.
+    System prompts don't count as activity, so a chat with no other messages falls back to its creation time.
+    """
+    db.flush()
+    messages, _ = get_message_page(db, chat_id, CHAT_PREVIEW_LOOKBACK, load_blobs=False)
+    messages = [message for message in messages if message.role != Role.SYSTEM]
+    previews = (chat_preview(message.contents) for message in reversed(messages) if message.selected)
+    return {
+        'last_message_at': messages[-1].created_at if messages else select(models.Chat.created_at).where(models.Chat.id == chat_id).scalar_subquery(),
+        'last_preview': next((preview for preview in previews if preview is not None), None),
+    }
+
+def select_content_blobs(content_rows: Sequence[Row]) -> Select | None:
+    """Build the statement that loads the full contents of the given content rows that are stored out of line,
+    or None if none of them are.
+    """
+    content_ids = [row.id for row in content_rows if row.content_size is not None]
+    if not content_ids:
+        return None
+    return select(models.ContentBlob.content_id, models.ContentBlob.content).where(models.ContentBlob.content_id.in_(content_ids))
+
+def select_model_configs(message_rows: Sequence[Row]) -> Select | None:
+    """Build the statement that loads each distinct config referenced by the given message rows,
+    or None if they reference none (or were loaded without configs).
+    """
+    hashes = {row.config_hash for row in message_rows if getattr(row, 'config_hash', None) is not None}
+    if not hashes:
+        return None
+    return select(models.ModelConfig.hash, models.ModelConfig.config).where(models.ModelConfig.hash.in_(hashes))
+
+def select_chat_view(chat_id: UUID4) -> Select:
+    return select(
+        models.Chat.id,
+        models.Chat.title,
+        models.Chat.user_id,
+        models.Chat.default_model,
+        models.ModelConfig.config,
+        models.Chat.created_at,
+        models.Chat.version,
+        models.Chat.message_count,
+        models.Chat.last_message_at,
+        models.Chat.last_preview,
+        models.Chat.total_tokens,
+    ).outerjoin(models.ModelConfig, models.ModelConfig.hash == models.Chat.config_hash).where(models.Chat.id == chat_id)
+
+def build_messages(message_rows: Sequence[Row], content_rows: Sequence[Row | dict], config_rows: Sequence[Row] = (), blob_rows: Sequence[Row] = ()) -> list[schemas.MessageView]:
+    """Build message schemas from the rows loaded by the statements of `select_chat_messages`, `select_model_configs`
+    and `select_content_blobs` (plus any archived contents, see `merge_archived_contents`), without going through ORM objects.
+    Contents stored out of line whose blob wasn't loaded are left as previews, with their `content_size` set.
+    """
+    blobs = {row.content_id: row.content for row in blob_rows}
+    contents = defaultdict(list)
+    for row in content_rows:
+        content = dict(row._mapping) if isinstance(row, Row) else dict(row)
+        if content['id'] in blobs:
+            content['content'] = blobs[content['id']]
+            content['content_size'] = None
+        contents[content.pop('message_id')].append(content)
+    configs = {row.hash: row.config for row in config_rows}
+    messages = []
+    for row in message_rows:
+        message = dict(row._mapping)
+        config_hash = message.pop('config_hash', None)
+        if config_hash is not None:
+            message['config'] = configs[config_hash]
+        messages.append(schemas.MessageView.model_validate({**message, 'contents': contents[row.id]}))
+    return messages
+
+def get_chat_messages(db: Session, chat_id: UUID4, include_config: bool = True, load_blobs: bool = True) -> list[schemas.MessageView]:
+    """Load the messages on a chat's active branch, with their contents, using at most five queries.
+
+    Args:
+        db (Session): The database session
+        chat_id (UUID4): The chat whose messages to load
+        include_config (bool, optional): Whether to load each message's model config. Defaults to True. Model history does not need it.
+        load_blobs (bool, optional): Whether to load the full contents stored out of line. Defaults to True. Views only need their previews.
+
+    Returns:
+        list[schemas.MessageView]: The messages, oldest first
+    """
+    messages_stmt, contents_stmt = select_chat_messages(chat_id, include_config)
+    message_rows = db.execute(messages_stmt).all()
+    configs_stmt = select_model_configs(message_rows)
+    config_rows = db.execute(configs_stmt).all() if configs_stmt is not None else []
+    content_rows = db.execute(contents_stmt).all()
+    blobs_stmt = select_content_blobs(content_rows) if load_blobs else None
+    blob_rows = db.execute(blobs_stmt).all() if blobs_stmt is not None else []
+    content_rows = merge_archived_contents(content_rows, db.execute(select_chat_archive(chat_id)).scalar(), load_blobs=load_blobs)
+    return build_messages(message_rows, content_rows, config_rows, blob_rows)
+
+def get_message_page(db: Session, chat_id: UUID4, limit: int, before: tuple[datetime.datetime, UUID4] | None = None, load_blobs: bool = True) -> tuple[list[schemas.MessageView], bool]:
+    """Load a page of a chat's history, walking backwards from the newest message.
+
+    Args:
+        db (Session): The database session
+        chat_id (UUID4): The chat whose messages to load
+        limit (int): The maximum number of messages to load
+        before (tuple[datetime.datetime, UUID4] | None, optional): The (created_at, id) of the oldest message of the previous page. Defaults to None, i.e. start at the newest message.
+        load_blobs (bool, optional): Whether to load the full contents stored out of line. Defaults to True.
+
+    Returns:
+        tuple[list[schemas.MessageView], bool]: The messages, oldest first, and whether there are older messages
+    """
+    message_rows = db.execute(select_message_page(chat_id, limit + 1, before)).all()
+    has_more = len(message_rows) > limit
+    return load_messages(db, chat_id, message_rows[:limit][::-1], load_blobs), has_more
+
+def load_messages(db: Session, chat_id: UUID4, message_rows: Sequence[Row], load_blobs: bool = True) -> list[schemas.MessageView]:
+    """Build message schemas from already loaded message rows (with the columns of `_message_columns`) of a chat,
+    loading their contents and configs.
+    """
+    content_rows = []
+    blob_rows = []
+    if message_rows:
+        message_ids = [row.id for row in message_rows]
+        content_rows = db.execute(select_message_contents(message_ids)).all()
+        blobs_stmt = select_content_blobs(content_rows) if load_blobs else None
+        blob_rows = db.execute(blobs_stmt).all() if blobs_stmt is not None else []
+        content_rows = merge_archived_contents(content_rows, db.execute(select_chat_archive(chat_id)).scalar(), set(message_ids), load_blobs)
+    configs_stmt = select_model_configs(message_rows)
+    config_rows = db.execute(configs_stmt).all() if configs_stmt is not None else []
+    return build_messages(message_rows, content_rows, config_rows, blob_rows)
+
+def get_chat_full(db: Session, chat_id: UUID4, include_message_config: bool = True, load_blobs: bool = True) -> schemas.ChatFull | None:
+    """Load a chat with all of its messages using a fixed number of queries (see `get_chat_messages`).
+    """
+    chat_row = db.execute(select_chat_view(chat_id)).first()
+    if chat_row is None:
+        return None
+    messages = get_chat_messages(db, chat_id, include_config=include_message_config, load_blobs=load_blobs)
+    return schemas.ChatFull.model_validate({**chat_row._mapping, 'messages': messages})
+
+def get_chat_history(db: Session, chat_id: UUID4) -> schemas.ChatFull | None:
+    """Load a chat with the messages to send to a model (without per-message configs), from `history_cache` if it
+    holds the chat's current version, in which case only the chat itself is queried.
+    """
+    chat_row = db.execute(select_chat_view(chat_id)).first()
+    if chat_row is None:
+        return None
+    messages = history_cache.get(chat_id, chat_row.version)
+    if messages is None:
+        messages = get_chat_messages(db, chat_id, include_config=False)
+        history_cache.set(chat_id, chat_row.version, messages)
+    return schemas.ChatFull.model_validate({**chat_row._mapping, 'messages': messages})
+
+def get_branch_head(db: Session, chat_id: UUID4) -> UUID4 | None:
+    """Get the newest message on a chat's active branch, which new messages are added after.
+    """
+    return db.scalar(
+        select(models.Message.id).where(models.Message.chat_id == chat_id, models.Message.selected)
+        .order_by(models.Message.created_at.desc(), models.Message.id.desc()).limit(1)
+    )
+
+def get_branch_history(db: Session, chat_id: UUID4, message_id: UUID4) -> list[schemas.MessageView] | None:
+    """Load the messages to send to a model to continue a chat from any of its messages, on any branch: the message
+    and the ones it follows, without per-message configs. Only that path is read, by walking up the tree.
+
+    Returns:
+        list[schemas.MessageView] | None: The messages, oldest first, or None if the message isn't in the chat
+    """
+    ensure_messages_linked(db, chat_id)
+    path = select_ancestors(message_id)
+    message_rows = db.execute(
+        select(*_message_columns(include_config=False))
+        .where(models.Message.id.in_(select(path.c.id)), models.Message.chat_id == chat_id)
+        .order_by(models.Message.created_at)
+    ).all()
+    if not message_rows or message_rows[-1].id != message_id:
+        return None
+    return load_messages(db, chat_id, message_rows)
+
+def get_branches(db: Session, chat_id: UUID4) -> list[schemas.Branch]:
+    """Get the branches of a chat, newest first, each with a preview of its head.
+    """
+    ensure_messages_linked(db, chat_id)
+    child = aliased(models.Message)
+    head_rows = db.execute(
+        select(*_message_columns(include_config=False))
+        .where(models.Message.chat_id == chat_id, ~exists().where(child.parent_id == models.Message.id))
+        .order_by(models.Message.created_at.desc(), models.Message.id.desc())
+    ).all()
+    return [
+        schemas.Branch(head_id=head.id, parent_id=head.parent_id, role=head.role, created_at=head.created_at, active=head.selected, preview=chat_preview(head.contents))
+        for head in load_messages(db, chat_id, head_rows, load_blobs=False)
+    ]
+
+def get_chats(db: Session, user_id: UUID4, skip: int = 0, limit: int = 100, before: tuple[datetime.datetime, UUID4] | None = None):
+    """Get a page of a user's chats, most recently active first.
+    `before` is the (last_message_at, id) of the last chat of the previous page; seeking past it uses the
+    (user_id, last_message_at, id) index, so unlike `skip` its cost doesn't grow with the page depth.
+    """
+    query = db.query(models.Chat).filter(models.Chat.user_id == user_id)
+    if before is not None:
+        query = query.filter(tuple_(models.Chat.last_message_at, models.Chat.id) < tuple_(*before))
+    return query.order_by(models.Chat.last_message_at.desc(), models.Chat.id.desc()).offset(skip).limit(limit).all()
+
+def delete_chat(db: Session, chat_id: UUID4):
+    """Delete a chat with a single statement; its messages and their contents are removed by ON DELETE CASCADE,
+    without ever being loaded.
+    """
+    user_id = db.execute(delete(models.Chat).where(models.Chat.id == chat_id).returning(models.Chat.user_id)).scalar()
+    if user_id is None:
+        db.rollback()
+        raise ValueError('Chat not found')
+    get_search_index(db).remove_chat(db, chat_id)
+    mark_written(db, chat_id, user_id)
+    record_chat_write(db, chat_id, None)
+    db.commit()
+
+def get_existing_chat_ids(db: Session, chat_ids: Sequence[UUID4]) -> set[UUID4]:
+    return set(db.scalars(select(models.Chat.id).where(models.Chat.id.in_(chat_ids))))
+
+def iter_chat_exports(db: Session, user_id: UUID4) -> Iterator[dict]:
+    """Stream a user's chats for an export, oldest first, from a server-side cursor.
+    """
+    stmt = (
+        select(models.Chat.id, models.Chat.title, models.Chat.default_model, models.ModelConfig.config, models.Chat.created_at)
+        .outerjoin(models.ModelConfig, models.ModelConfig.hash == models.Chat.config_hash)
+        .where(models.Chat.user_id == user_id)
+        .order_by(models.Chat.created_at, models.Chat.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for row in db.execute(stmt):
+        yield dict(row._mapping)
+
+def iter_message_exports(db: Session, user_id: UUID4) -> Iterator[dict]:
+    """Stream all messages of a user's chats for an export, chat by chat and oldest first, each with its config and
+    all of its contents in full. Messages and their contents come from a single server-side cursor, so memory use
+    doesn't grow with the number of messages; only the archive of the chat being streamed is held in memory.
+    """
+    archived_chat_ids = set(db.scalars(
+        select(models.ChatArchive.chat_id).join(models.Chat, models.Chat.id == models.ChatArchive.chat_id).where(models.Chat.user_id == user_id)
+    ))
+    stmt = (
+        select(
+            *_message_columns(include_config=False),
+            models.ModelConfig.config,
+            models.MessageContent.id.label('content_id'),
+            models.MessageContent.type.label('content_type'),
+            models.MessageContent.content,
+            models.MessageContent.image_type,
+            models.MessageContent.tool_call_id,
+            models.MessageContent.result_metadata,
+            models.MessageContent.compact_content,
+            models.ContentBlob.content.label('blob'),
+        )
+        .join(models.Chat, models.Chat.id == models.Message.chat_id)
+        .outerjoin(models.ModelConfig, models.ModelConfig.hash == models.Message.config_hash)
+        .outerjoin(models.MessageContent, models.MessageContent.message_id == models.Message.id)
+        .outerjoin(models.ContentBlob, models.ContentBlob.content_id == models.MessageContent.id)
+        .where(models.Chat.user_id == user_id)
+        .order_by(models.Message.chat_id, models.Message.created_at, models.Message.id, models.MessageContent.order)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    # senders aren't exported; an import attributes messages by their role
+    message_keys = [column.key for column in _message_columns(include_config=False) if column.key != 'user_id'] + ['config']
+    archived_chat_id = None
+    archived = {}
+    message = None
+    for row in db.execute(stmt):
+        if message is not None and message['id'] != row.id:
+            yield message
+            message = None
+        if message is None:
+            if row.chat_id in archived_chat_ids and row.chat_id != archived_chat_id:
+                archived_chat_id = row.chat_id
+                archived = defaultdict(list)
+                for content in sorted(unpack_contents(db.execute(select_chat_archive(row.chat_id)).scalar()), key=lambda content: content['order']):
+                    archived[content.pop('message_id')].append(content)
+            message = {key: row._mapping[key] for key in message_keys}
+            message['contents'] = [
+                {key: content[key] for key in ('type', 'content', 'image_type', 'tool_call_id', 'result_metadata', 'compact_content')}
+                for content in archived.get(row.id, ())
+            ]
+        if row.content_id is not None:
+            message['contents'].append({
+                'type': row.content_type,
+                'content': row.blob if row.blob is not None else row.content,
+                'image_type': row.image_type,
+                'tool_call_id': row.tool_call_id,
+                'result_metadata': row.result_metadata,
+                'compact_content': row.compact_content,
+            })
+    if message is not None:
+        yield message
+
+def import_chats(db: Session, user_id: UUID4, chats: Sequence[schemas.ExportedChat], messages_linked: bool = True) -> list[UUID4]:
+    """Insert chats read from an export under new ids, without committing. Their messages are added by `insert_messages`.
+    Chats of exports from before messages had parents are imported as not linked (see `Chat.messages_linked`).
+
+    Returns:
+        list[UUID4]: The new ids of the chats, in the same order
+    """
+    if not chats:
+        return []
+    config_hashes = store_model_configs(db, [chat.config for chat in chats])
+    rows = [
+        {
+            'id': uuid.uuid4(), 'user_id': user_id, 'title': chat.title, 'default_model': chat.default_model,
+            'config_hash': config_hash, 'created_at': chat.created_at, 'last_message_at': chat.created_at,
+            'messages_linked': messages_linked,
+        }
+        for chat, config_hash in zip(chats, config_hashes)
+    ]
+    db.execute(insert(models.Chat), rows)
+    search_index = get_search_index(db)
+    for row in rows:
+        search_index.index_chat(db, row['id'], row['title'])
+    mark_written(db, user_id, *(row['id'] for row in rows))
+    return [row['id'] for row in rows]
+
+def search_chats(db: Session, user_id: UUID4, query: str, limit: int, offset: int = 0) -> tuple[list[schemas.SearchHit], bool]:
+    """Full-text search a user's chat titles and messages, best match first.
+
+    Returns:
+        tuple[list[schemas.SearchHit], bool]: The page of hits, and whether there are more after it
+    """
+    rows = get_search_index(db).search(db, user_id, query, limit + 1, offset)
+    hits = [schemas.SearchHit.model_validate({**row._mapping, 'snippet': render_snippet(row.snippet)}) for row in rows[:limit]]
+    return hits, len(rows) > limit
+
+def get_message_content(db: Session, chat_id: UUID4, content_id: UUID4) -> schemas.message_content_type | None:
+    """Load a single content of a chat's messages in full, whether it is stored inline, out of line or archived.
+    """
+    row = db.execute(
+        select(*_content_columns(), models.ContentBlob.content.label('blob'))
+        .join(models.Message, models.Message.id == models.MessageContent.message_id)
+        .outerjoin(models.ContentBlob, models.ContentBlob.content_id == models.MessageContent.id)
+        .where(models.MessageContent.id == content_id, models.Message.chat_id == chat_id)
+    ).first()
+    if row is not None:
+        content = dict(row._mapping)
+        blob = content.pop('blob')
+        if blob is not None:
+            content['content'] = blob
+            content['content_size'] = None
+    else:
+        archived = db.execute(select_chat_archive(chat_id)).scalar()
+        content = next((row for row in unpack_contents(archived) if row['id'] == content_id), None) if archived is not None else None
+        if content is None:
+            return None
+    return message_content_adapter.validate_python(content)
 
 def get_message(db: Session, message_id: UUID4):
     return db.query(models.Message).filter(models.Message.id == message_id).first()
 
+def model_config_hash(config: dict) -> str:
+    """Hash the canonical JSON of a model config, so that equal configs always get the same key.
+    """
+    payload = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _insert_ignoring_conflicts(db: Session, model: type[models.Base]) -> Insert:
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    raise NotImplementedError(f'Unsupported database: {dialect}')
+
+def _insert_adding_on_conflict(db: Session, model: type[models.Base], key_columns: Sequence[str], total_columns: Sequence[str]) -> Insert:
+    """Build an upsert that adds the inserted values of `total_columns` to those of an existing row with the same key,
+    in the same statement, so concurrent writers add up rather than overwrite each other.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(model)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(model)
+    else:
+        raise NotImplementedError(f'Unsupported database: {dialect}')
+    return stmt.on_conflict_do_update(index_elements=key_columns, set_={column: getattr(model, column) + stmt.excluded[column] for column in total_columns})
+
+def store_model_configs(db: Session, configs: Sequence[dict | BaseModel | None]) -> list[str | None]:
+    """Store model configs that aren't stored yet, without committing, and get the hash each one is stored under.
+    Configs are immutable, so configs that already exist (including ones written concurrently) are left as they are.
+
+    Returns:
+        list[str | None]: The hash of each config, or None where the config is None
+    """
+    by_hash = {}
+    hashes = []
+    for model_config in configs:
+        if model_config is None:
+            hashes.append(None)
+            continue
+        if isinstance(model_config, BaseModel):
+            model_config = model_config.model_dump(mode='json')
+        config_hash = model_config_hash(model_config)
+        by_hash[config_hash] = model_config
+        hashes.append(config_hash)
+    if by_hash:
+        db.execute(_insert_ignoring_conflicts(db, models.ModelConfig), [{'hash': h, 'config': c} for h, c in by_hash.items()])
+    return hashes
+
+def bump_chat_version(db: Session, chat_id: UUID4, appended: Sequence[schemas.MessageView] | None = None, **values) -> int | None:
+    """Increment a chat's version, without committing, and record the write for `history_cache`.
+    Every write that changes what loading the chat returns calls this. The chat and its owner's list of chats
+    (which shows its version and summary) are marked as written, so that reads of either go to the primary for a while.
+
+    Args:
+        db (Session): The database session
+        chat_id (UUID4): The chat being written to
+        appended (Sequence[schemas.MessageView] | None, optional): The messages added, if that is all the write does,
+            so that a cached history can be extended rather than reloaded. Defaults to None.
+        **values: Other columns of the chat to set in the same statement, e.g. its summary
+
+    Returns:
+        int | None: The chat's new version, or None if it doesn't exist
+    """
+    row = db.execute(update(models.Chat).where(models.Chat.id == chat_id).values(version=models.Chat.version + 1, **values).returning(models.Chat.version, models.Chat.user_id)).first()
+    if row is None:
+        return None
+    mark_written(db, chat_id, row.user_id)
+    record_chat_write(db, chat_id, row.version, appended)
+    return row.version
+
 def create_chat(db: Session, chat: schemas.ChatCreate, user_id: UUID4):
     chat_dict = chat.model_dump()
     chat_dict.pop('system_prompt', None)
-    db_chat = models.Chat(**chat_dict, user_id=user_id)
+    chat_dict.pop('config', None)
+    chat_dict['config_hash'] = store_model_configs(db, [chat.config])[0]
+    # stamped here rather than by the database, like the chat's messages (see `create_messages`)
+    now = utcnow()
+    db_chat = models.Chat(**chat_dict, user_id=user_id, created_at=now, last_message_at=now)
     db.add(db_chat)
+    db.flush()
+    get_search_index(db).index_chat(db, db_chat.id, db_chat.title)
+    mark_written(db, db_chat.id, user_id)
     db.commit()
     db.refresh(db_chat)
     return db_chat
@@ -45,63 +655,455 @@ def update_chat(db: Session, chat_id: UUID4, chat: schemas.ChatCreate):
     db_chat: models.Chat | None = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
     if db_chat is None:
         raise ValueError('Chat not found')
+    restore_chat_contents(db, chat_id)
     db_chat.title = chat.title
     db_chat.default_model = chat.default_model
     if chat.config is not None:
-        db_chat.config = chat.config
+        db_chat.config_hash = store_model_configs(db, [chat.config])[0]
     db_system_msg = db.query(models.Message).filter(models.Message.chat_id == chat_id, models.Message.role == Role.SYSTEM).first()
     if db_system_msg is not None:
-        db_system_msg.contents[0].content = chat.system_prompt
+        system_content = db_system_msg.contents[0]
+        # the content may be moved out of line concurrently (by the backfill of revision f2b9d5e3a7c1), so it is
+        # rewritten by one statement that also clears `content_size`, whatever it was when it was loaded
+        db.execute(delete(models.ContentBlob).where(models.ContentBlob.content_id == system_content.id))
+        db.execute(
+            update(models.MessageContent).where(models.MessageContent.id == system_content.id)
+            .values(content=chat.system_prompt, content_size=None).execution_options(synchronize_session=False)
+        )
+    get_search_index(db).index_chat(db, chat_id, chat.title)
+    mark_written(db, chat_id, db_chat.user_id)
+    bump_chat_version(db, chat_id)
     db.commit()
     db.refresh(db_chat)
     return db_chat
 
-def create_message(db: Session, message: schemas.Message, user_id: UUID4, chat_id: UUID4):
-    contents = message.contents
-    message_dict = message.model_dump()
-    message_dict.pop('contents', None)
-    db_message = models.Message(**message_dict, user_id=user_id, chat_id=chat_id)
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+def insert_contents(db: Session, content_rows: Sequence[dict]):
+    """Insert message content rows, without committing.
+    Text and tool result contents whose JSON is longer than `CONTENT_BLOB_THRESHOLD` bytes are stored out of line
+    in `content_blob`, leaving only a preview of the first `CONTENT_PREVIEW_CHARS` characters in `message_content`.
+    """
+    if not content_rows:
+        return
+    rows = []
+    blob_rows = []
+    for content_row in content_rows:
+        row = {**content_row, 'id': content_row.get('id') or uuid.uuid4(), 'content_size': None}
+        preview = preview_content(row['type'], row['content'])
+        if preview is not None:
+            blob_rows.append({'content_id': row['id'], 'content': row['content']})
+            row['content'], row['content_size'] = preview
+        rows.append(row)
+    db.execute(insert(models.MessageContent), rows)
+    if blob_rows:
+        db.execute(insert(models.ContentBlob), blob_rows)
+
+def insert_messages(db: Session, messages: Sequence[tuple[schemas.Message, UUID4, UUID4, datetime.datetime]], ids: Sequence[UUID4] | None = None) -> list[schemas.MessageView]:
+    """Insert messages, of one chat or several, with all of their contents, without committing.
+    Messages are inserted with one multi-row INSERT ... RETURNING and their contents with one more; the search index,
+    and the summary and version of each chat, are kept up to date in the same transaction.
+    Messages are linked to the ones they follow by their `parent_id` as given; see `create_messages`.
+
+    Args:
+        db (Session): The database session
+        messages (Sequence[tuple[schemas.Message, UUID4, UUID4, datetime.datetime]]): The messages to write, oldest first
+            within each chat, each with the id of its sender, the id of its chat and its creation time
+        ids (Sequence[UUID4] | None, optional): The ids to write the messages under, so that messages written together
+            can follow each other. Defaults to None, i.e. new ones.
+
+    Returns:
+        list[schemas.MessageView]: The written messages, in the same order
+    """
+    if not messages:
+        return []
+    if ids is None:
+        ids = [uuid.uuid4() for _ in messages]
+    message_fields = set(schemas.Message.model_fields) - {'contents', 'config', 'usage'}
+    message_rows = [
+        {**message.model_dump(include=message_fields), 'id': id, 'user_id': user_id, 'chat_id': chat_id, 'created_at': created_at}
+        for (message, user_id, chat_id, created_at), id in zip(messages, ids)
+    ]
+    config_hashes = store_model_configs(db, [message.config for message, *_ in messages])
+    for message_row, config_hash in zip(message_rows, config_hashes):
+        message_row['config_hash'] = config_hash
+    written = db.execute(
+        insert(models.Message).returning(models.Message.id, models.Message.created_at, sort_by_parameter_order=True),
+        message_rows
+    ).all()
+    # contents get their ids here, so the written messages can be returned (and cached) exactly as they will load
+    contents = [[content.model_copy(update={'id': uuid.uuid4()}) for content in message.contents] for message, *_ in messages]
+    insert_contents(db, [
+        {**content.model_dump(exclude=VIEW_CONTENT_FIELDS), 'id': content.id, 'message_id': row.id, 'order': i}
+        for message_contents, row in zip(contents, written)
+        for i, content in enumerate(message_contents)
+    ])
+    get_search_index(db).index_messages(db, [
+        (row.id, chat_id, searchable_text(message.role, message.contents))
+        for (message, _, chat_id, _), row in zip(messages, written)
+    ])
+    views = [
+        schemas.MessageView.model_validate({**message_row, 'id': row.id, 'created_at': row.created_at, 'config': message.config, 'contents': message_contents})
+        for (message, *_), message_row, row, message_contents in zip(messages, message_rows, written, contents)
+    ]
+    views_by_chat = defaultdict(list)
+    for view in views:
+        views_by_chat[view.chat_id].append(view)
+    for chat_id, chat_views in views_by_chat.items():
+        mark_written(db, chat_id)
+        bump_chat_version(db, chat_id, appended=[view.model_copy(update={'config': None}) for view in chat_views], **summarize_new_messages(chat_views))
+    return views
+
+def create_messages(db: Session, messages: Sequence[tuple[schemas.Message, UUID4]], chat_id: UUID4, parent_id: UUID4 | None = None, root: bool = False) -> list[schemas.MessageView]:
+    """Write several messages of a chat, with all of their contents, in a single transaction (see `insert_messages`),
+    so either all of them are written or none are.
+    Each message follows the one before it, except that candidates of the same group all follow the same message;
+    the first one follows `parent_id`. Adding messages after any other message than the head of the active branch
+    starts a new branch, which becomes the active one. The usage of assistant messages that have one is recorded with them.
+
+    Args:
+        db (Session): The database session
+        messages (Sequence[tuple[schemas.Message, UUID4]]): The messages to write, oldest first, each with the id of its sender
+        chat_id (UUID4): The chat the messages belong to
+        parent_id (UUID4 | None, optional): The message to add them after. Defaults to None, i.e. the head of the active branch.
+        root (bool, optional): Whether to add them after no message instead, on a new branch (e.g. to edit the first message
+            of a chat without a system prompt). Defaults to False.
+
+    Returns:
+        list[schemas.MessageView]: The written messages, in the same order
+    """
+    if not messages:
+        return []
+    # every statement of a transaction sees the same now(), so the server default can't order messages written together;
+    # stamp them here instead, a microsecond apart
+    now = utcnow()
     try:
-        for i, content in enumerate(contents):
-            db_content = models.MessageContent(**content.model_dump(), message_id=db_message.id, order=i)
-            db.add(db_content)
-        db.commit()
-        db.refresh(db_message)
-        return db_message
-    except Exception as e:
-        db.delete(db_message)
+        head_id = get_branch_head(db, chat_id)
+        if root:
+            parent_id = None
+            link_messages(db, chat_id)
+            activate_branch(db, chat_id, None)
+        elif parent_id is None:
+            parent_id = head_id
+        elif parent_id != head_id:
+            link_messages(db, chat_id)
+            activate_branch(db, chat_id, parent_id)
+        ids = [uuid.uuid4() for _ in messages]
+        linked = []
+        group_parents = {}
+        for (message, _), id in zip(messages, ids):
+            parent = group_parents.setdefault(message.candidate_group, parent_id) if message.candidate_group is not None else parent_id
+            linked.append(message.model_copy(update={'parent_id': parent}))
+            if message.selected:
+                parent_id = id
+        views = insert_messages(db, [
+            (message, user_id, chat_id, now + datetime.timedelta(microseconds=i))
+            for i, (message, (_, user_id)) in enumerate(zip(linked, messages))
+        ], ids)
+        # only responses of a model have a usage to record; anything else can't be trusted to have one
+        record_usage(db, chat_id, [(view, message.usage) for view, message in zip(views, linked) if message.role == Role.ASSISTANT and message.usage is not None])
         db.commit()
-        raise e
+    except Exception:
+        db.rollback()
+        raise
+    return views
+
+def usage_period_start(timestamp: datetime.datetime, granularity: str) -> datetime.datetime:
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0) if granularity == 'day' else timestamp
+
+def record_usage(db: Session, chat_id: UUID4, usages: Sequence[tuple[schemas.MessageView, schemas.Usage]]):
+    """Write the usage of new responses to `message_usage`, and add it to the chat owner's hourly and daily rollups,
+    without committing. Each rollup row is only written once per call, by an upsert that adds to it.
+    """
+    if not usages:
+        return
+    db.execute(insert(models.MessageUsage), [{'message_id': view.id, **usage.model_dump()} for view, usage in usages])
+    user_id = db.scalar(select(models.Chat.user_id).where(models.Chat.id == chat_id))
+    for granularity, rollup in USAGE_ROLLUPS.items():
+        totals = defaultdict(lambda: dict.fromkeys(USAGE_TOTALS, 0))
+        for view, usage in usages:
+            row = totals[(usage_period_start(view.created_at, granularity), view.model or '')]
+            row['responses'] += 1
+            row['streamed_responses'] += usage.time_to_first_token_ms is not None
+            for column in schemas.Usage.model_fields:
+                row[column] += getattr(usage, column) or 0
+        # rows are written in key order, so concurrent writers lock them in the same order
+        db.execute(_insert_adding_on_conflict(db, rollup, ['user_id', 'period_start', 'model'], USAGE_TOTALS), [
+            {'user_id': user_id, 'period_start': period_start, 'model': model, **row}
+            for (period_start, model), row in sorted(totals.items())
+        ])
+
+def get_usage(db: Session, user_id: UUID4, granularity: str, start: datetime.datetime | None = None, end: datetime.datetime | None = None, model: str | None = None) -> list[models.UsageHourly | models.UsageDaily]:
+    """Get a user's usage rollups, by hour or by day, of the periods starting in [`start`, `end`), oldest first.
+    """
+    rollup = USAGE_ROLLUPS[granularity]
+    query = db.query(rollup).filter(rollup.user_id == user_id)
+    if start is not None:
+        query = query.filter(rollup.period_start >= usage_period_start(start, granularity))
+    if end is not None:
+        query = query.filter(rollup.period_start < end)
+    if model is not None:
+        query = query.filter(rollup.model == model)
+    return query.order_by(rollup.period_start, rollup.model).all()
+
+def summarize_new_messages(messages: Sequence[schemas.MessageView]) -> dict:
+    """Get the changes to a chat's summary columns for messages being added to it, oldest first.
+    System prompts and unselected candidates don't count as messages, but the tokens of every candidate do.
+    """
+    messages = [message for message in messages if message.role != Role.SYSTEM]
+    if not messages:
+        return {}
+    summary = {
+        'message_count': models.Chat.message_count + sum(1 for message in messages if message.selected),
+        'total_tokens': models.Chat.total_tokens + sum(estimate_tokens(message.contents) for message in messages),
+        'last_message_at': messages[-1].created_at,
+    }
+    previews = (chat_preview(message.contents) for message in reversed(messages) if message.selected)
+    preview = next((preview for preview in previews if preview is not None), None)
+    if preview is not None:
+        summary['last_preview'] = preview
+    return summary
+
+def create_message(db: Session, message: schemas.Message, user_id: UUID4, chat_id: UUID4) -> schemas.MessageView:
+    return create_messages(db, [(message, user_id)], chat_id)[0]
 
 def update_message(db: Session, message_id: UUID4, message: schemas.Message):
     db_message = db.query(models.Message).filter(models.Message.id == message_id).first()
     if db_message is None:
         raise ValueError('Message not found')
+    if restore_chat_contents(db, db_message.chat_id):
+        db.expire(db_message, ['contents'])
+    tokens = estimate_tokens(message.contents) - estimate_tokens(db_message.contents)
     db_message.role = message.role
     # db_message.contents = message.contents
     for content in db_message.contents:
         db.delete(content)
-    for i, content in enumerate(message.contents):
-        db_content = models.MessageContent(**content.model_dump(), message_id=message_id, order=i)
-        db.add(db_content)
+    insert_contents(db, [
+        {**content.model_dump(exclude=VIEW_CONTENT_FIELDS), 'message_id': message_id, 'order': i}
+        for i, content in enumerate(message.contents)
+    ])
     db_message.model = message.model
     if message.config is not None:
-        db_message.config = message.config
+        db_message.config_hash = store_model_configs(db, [message.config])[0]
+    search_index = get_search_index(db)
+    search_index.remove_messages(db, [message_id])
+    search_index.index_messages(db, [(message_id, db_message.chat_id, searchable_text(message.role, message.contents))])
+    mark_written(db, db_message.chat_id)
+    summary = find_chat_activity(db, db_message.chat_id)
+    if message.role != Role.SYSTEM:
+        summary['total_tokens'] = models.Chat.total_tokens + tokens
+    bump_chat_version(db, db_message.chat_id, **summary)
     db.commit()
     db.refresh(db_message)
     return db_message
 
 def delete_message(db: Session, message_id: UUID4):
+    """Delete a message, along with every message that follows it (by ON DELETE CASCADE), on any branch.
+    If it was on the active branch, the newest remaining branch through the message it followed becomes the active one.
+    """
     db_message = db.query(models.Message).filter(models.Message.id == message_id).first()
     if db_message is None:
         raise ValueError('Message not found')
+    subtree_ids = list(db.scalars(select(select_descendants(message_id).c.id)))
+    # loaded like any other messages, rather than through `db_message.contents`, so archived contents count too
+    deleted = load_messages(db, db_message.chat_id, db.execute(select(*_message_columns(include_config=False)).where(models.Message.id.in_(subtree_ids))).all(), load_blobs=False)
+    deleted = [message for message in deleted if message.role != Role.SYSTEM]
+    summary = {}
+    if deleted:
+        summary['message_count'] = models.Chat.message_count - sum(1 for message in deleted if message.selected)
+        summary['total_tokens'] = models.Chat.total_tokens - sum(estimate_tokens(message.contents) for message in deleted)
     db.delete(db_message)
+    get_search_index(db).remove_messages(db, subtree_ids)
+    mark_written(db, db_message.chat_id)
+    bump_chat_version(db, db_message.chat_id, **summary, **find_chat_activity(db, db_message.chat_id))
+    if db_message.selected and db_message.parent_id is not None:
+        db.flush()
+        tree = select_descendants(db_message.parent_id)
+        head_id = db.scalar(select(tree.c.id).order_by(tree.c.created_at.desc(), tree.c.id.desc()).limit(1))
+        if head_id is not None:
+            activate_branch(db, db_message.chat_id, head_id)
     db.commit()
     return db_message
 
+def get_idle_chat_ids(db: Session, idle_since: datetime.datetime, limit: int, exclude: Sequence[UUID4] = ()) -> list[UUID4]:
+    """Get chats that have contents in `message_content`, but no message newer than `idle_since`.
+    Chats whose contents are all archived already have nothing left to move, so they aren't returned; chats that got
+    new messages after being archived are, once those are idle too, and their contents are added to the archive.
+    """
+    stmt = select(models.Message.chat_id).join(models.MessageContent, models.MessageContent.message_id == models.Message.id)
+    if exclude:
+        stmt = stmt.where(models.Message.chat_id.not_in(exclude))
+    return list(db.scalars(stmt.group_by(models.Message.chat_id).having(func.max(models.Message.created_at) < idle_since).limit(limit)))
+
+def archive_chat_contents(db: Session, chat_id: UUID4) -> tuple[int, int, int] | None:
+    """Move the contents of a chat's messages out of `message_content` into its archive, and commit.
+    Contents archived earlier stay archived; the new ones are added to the same blob.
+
+    Returns:
+        tuple[int, int, int] | None: The number of contents moved, their uncompressed size, and how much the archive grew by,
+        or None if the chat's contents changed while they were being archived (nothing is moved then)
+    """
+    content_rows = [
+        dict(row._mapping) for row in db.execute(
+            select(*_archived_content_columns())
+            .join(models.Message, models.Message.id == models.MessageContent.message_id)
+            .where(models.Message.chat_id == chat_id)
+            .order_by(models.MessageContent.message_id, models.MessageContent.order)
+        )
+    ]
+    if not content_rows:
+        return 0, 0, 0
+    blob_ids = [row['id'] for row in content_rows if row['content_size'] is not None]
+    if blob_ids:
+        # archived contents are compressed as a whole, so blobs are folded back in (and deleted by ON DELETE CASCADE)
+        blobs = dict(db.execute(select(models.ContentBlob.content_id, models.ContentBlob.content).where(models.ContentBlob.content_id.in_(blob_ids))).all())
+        for row in content_rows:
+            if row['id'] in blobs:
+                row['content'] = blobs[row['id']]
+                row['content_size'] = None
+    try:
+        archive = db.get(models.ChatArchive, chat_id, with_for_update=True)
+        previous_rows = unpack_contents(archive.contents) if archive is not None else []
+        previous_raw_size, previous_size = (archive.raw_size, len(archive.contents)) if archive is not None else (0, 0)
+        data, raw_size = pack_contents(previous_rows + content_rows)
+        # deleting by id, rather than by chat, means contents written or replaced since they were read are never lost:
+        # they either stay behind (and are archived by a later run), or make the row count come up short
+        result = db.execute(delete(models.MessageContent).where(models.MessageContent.id.in_([row['id'] for row in content_rows])))
+        if result.rowcount != len(content_rows):
+            db.rollback()
+            return None
+        if archive is None:
+            db.add(models.ChatArchive(chat_id=chat_id, contents=data, content_count=len(content_rows), raw_size=raw_size))
+        else:
+            archive.contents = data
+            archive.content_count += len(content_rows)
+            archive.raw_size = raw_size
+            archive.archived_at = func.now()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(content_rows), raw_size - previous_raw_size, len(data) - previous_size
+
+def restore_chat_contents(db: Session, chat_id: UUID4) -> bool:
+    """Move a chat's archived contents back into `message_content`, without committing, so they can be changed in place.
+    Contents of messages deleted since they were archived are dropped.
+
+    Returns:
+        bool: Whether the chat had archived contents
+    """
+    archive = db.get(models.ChatArchive, chat_id, with_for_update=True)
+    if archive is None:
+        return False
+    message_ids = set(db.scalars(select(models.Message.id).where(models.Message.chat_id == chat_id)))
+    insert_contents(db, [
+        {**row, 'type': MessageContentType(row['type'])}
+        for row in unpack_contents(archive.contents)
+        if row['message_id'] in message_ids
+    ])
+    db.delete(archive)
+    db.flush()
+    return True
+
+def link_messages(db: Session, chat_id: UUID4) -> bool:
+    """Set the `parent_id` of a chat's messages that were written before messages had one, without committing.
+    Each of them follows the newest message before it that was part of the history, other than its own candidates;
+    the system prompt stays the root. Only chats that aren't marked as linked (see `Chat.messages_linked`) are linked,
+    once, so messages that are roots on purpose are never given a parent.
+
+    Returns:
+        bool: Whether the chat was linked now
+    """
+    marked = db.execute(update(models.Chat).where(models.Chat.id == chat_id, ~models.Chat.messages_linked).values(messages_linked=True))
+    if marked.rowcount == 0:
+        return False
+    parent = aliased(models.Message)
+    # must match the backfill of revision c5a9e3f7b2d1
+    newest_parent = (
+        select(parent.id)
+        .where(
+            parent.chat_id == models.Message.chat_id, parent.selected, parent.created_at < models.Message.created_at,
+            or_(models.Message.candidate_group.is_(None), parent.candidate_group.is_(None), parent.candidate_group != models.Message.candidate_group),
+        )
+        .order_by(parent.created_at.desc(), parent.id.desc()).limit(1).scalar_subquery()
+    )
+    db.execute(
+        update(models.Message)
+        .where(models.Message.chat_id == chat_id, models.Message.parent_id.is_(None), models.Message.role != Role.SYSTEM)
+        .values(parent_id=newest_parent)
+        .execution_options(synchronize_session=False)
+    )
+    mark_written(db, chat_id)
+    bump_chat_version(db, chat_id)
+    return True
+
+def ensure_messages_linked(db: Session, chat_id: UUID4):
+    """Link a chat's messages if it was written before messages had parents (see `link_messages`), in a transaction
+    of its own that is committed right away, so that the reads and model calls that follow don't hold its locks.
+    Chats that are already linked are only read.
+    """
+    if db.scalar(select(models.Chat.messages_linked).where(models.Chat.id == chat_id)) is not False:
+        return
+    try:
+        link_messages(db, chat_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def activate_branch(db: Session, chat_id: UUID4, head_id: UUID4 | None):
+    """Make the branch ending at a message the chat's active one, without committing: the message and those it
+    follows become the history, and every other message leaves it. Only the messages that change are written.
+    With no message, the history is emptied, to start a new tree.
+    """
+    path_ids = list(db.scalars(select(select_ancestors(head_id).c.id))) if head_id is not None else []
+    db.execute(
+        update(models.Message).where(models.Message.chat_id == chat_id, models.Message.selected, models.Message.id.not_in(path_ids))
+        .values(selected=False).execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(models.Message).where(models.Message.chat_id == chat_id, ~models.Message.selected, models.Message.id.in_(path_ids))
+        .values(selected=True).execution_options(synchronize_session=False)
+    )
+    message_count = (
+        select(func.count()).select_from(models.Message)
+        .where(models.Message.chat_id == chat_id, models.Message.selected, models.Message.role != Role.SYSTEM)
+        .scalar_subquery()
+    )
+    mark_written(db, chat_id)
+    bump_chat_version(db, chat_id, message_count=message_count, **find_chat_activity(db, chat_id))
+
+def switch_branch(db: Session, chat_id: UUID4, message_id: UUID4) -> UUID4:
+    """Make the newest branch through a message the chat's active one, and commit.
+
+    Returns:
+        UUID4: The head of the branch
+    """
+    try:
+        link_messages(db, chat_id)
+        tree = select_descendants(message_id)
+        head_id = db.scalar(select(tree.c.id).order_by(tree.c.created_at.desc(), tree.c.id.desc()).limit(1))
+        if head_id is None:
+            raise ValueError('Message not found')
+        activate_branch(db, chat_id, head_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return head_id
+
+def select_candidate(db: Session, message_id: UUID4) -> schemas.MessageView:
+    """Make a candidate response part of the history, by switching to the newest branch through it.
+    The message is loaded again afterwards like any other, so the contents of an archived chat are included.
+    """
+    db_message = db.query(models.Message).filter(models.Message.id == message_id).first()
+    if db_message is None:
+        raise ValueError('Message not found')
+    if db_message.candidate_group is None:
+        raise ValueError('Message is not a candidate response')
+    switch_branch(db, db_message.chat_id, message_id)
+    message_rows = db.execute(select(*_message_columns(include_config=True)).where(models.Message.id == message_id)).all()
+    return load_messages(db, db_message.chat_id, message_rows, load_blobs=False)[0]
+
 def create_api_key(db: Session, api_key: schemas.APIKeyCreate, user_id: UUID4):
     existing_provider_key = db.query(models.APIKey).filter(models.APIKey.user_id == user_id, models.APIKey.provider == api_key.provider).first()
     if existing_provider_key is not None:
@@ -110,6 +1112,7 @@ def create_api_key(db: Session, api_key: schemas.APIKeyCreate, user_id: UUID4):
     else:
         db_api_key = models.APIKey(**api_key.model_dump(), user_id=user_id)
         db.add(db_api_key)
+    mark_written(db, user_id)
     db.commit()
     db.refresh(db_api_key)
     return db_api_key
@@ -122,6 +1125,7 @@ def update_api_key(db: Session, user_id: UUID4, api_key: schemas.APIKeyCreate):
     if db_api_key is None:
         raise ValueError('API key not found')
     db_api_key.key = api_key.key
+    mark_written(db, user_id)
     db.commit()
     db.refresh(db_api_key)
     return db_api_key
@@ -131,8 +1135,14 @@ def delete_api_key(db: Session, user_id: UUID4, provider: schemas.ModelAPI):
     if db_api_key is None:
         raise ValueError('API key not found')
     db.delete(db_api_key)
+    mark_written(db, user_id)
     db.commit()
     return db_api_key
 
+def get_api_key_map(db: Session, user_id: UUID4) -> dict[str, str]:
+    """Get all of a user's API keys with one query, by provider.
+    """
+    return dict(db.execute(select(models.APIKey.provider, models.APIKey.key).where(models.APIKey.user_id == user_id)).all())
+
 def get_user_api_providers(db: Session, user_id: UUID4) -> list[schemas.ModelAPI]:
     return db.query(models.APIKey.provider).filter(models.APIKey.user_id == user_id).all()
\ No newline at end of file
@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+import itertools
 import json
 from pydantic import BaseModel
 
@@ -11,6 +13,7 @@ here = os.path.dirname(__file__)
 sys.path.append(os.path.join(here, '..'))
 
 from app.config import config
+from app.tool_cache import LRUCache
 
 SQLALCHEMY_DATABASE_URL = config.database_url
 
@@ -19,7 +22,137 @@ def json_serialize(obj):
         return obj.model_dump_json()
     return json.dumps(obj)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, json_serializer=json_serialize)
+def get_async_database_url(url: str) -> str:
+    """Get the URL of the async driver for the same database (asyncpg for PostgreSQL, aiosqlite for SQLite).
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'postgresql':
+        parsed = parsed.set(drivername='postgresql+asyncpg')
+    elif parsed.get_backend_name() == 'sqlite':
+        parsed = parsed.set(drivername='sqlite+aiosqlite')
+    return parsed.render_as_string(hide_password=False)
+
+def get_pool_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': config.db_pool_size,
+        'max_overflow': config.db_max_overflow,
+        'pool_timeout': config.db_pool_timeout,
+        'pool_recycle': config.db_pool_recycle,
+        'pool_pre_ping': config.db_pool_pre_ping,
+    }
+
+SQLALCHEMY_ASYNC_DATABASE_URL = get_async_database_url(SQLALCHEMY_DATABASE_URL)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, json_serializer=json_serialize, **get_pool_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# used by async request handlers (e.g. dependencies), so that database I/O does not block the event loop
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, json_serializer=json_serialize, **get_pool_options(SQLALCHEMY_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# read replicas, if any: read-only routes are spread over them (see `ReadSessionLocal`), everything else uses the primary
+replica_engines = [
+    create_engine(url, json_serializer=json_serialize, **get_pool_options(url))
+    for url in config.database_replica_urls
+]
+async_replica_engines = [
+    create_async_engine(get_async_database_url(url), json_serializer=json_serialize, **get_pool_options(url))
+    for url in config.database_replica_urls
+]
+
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite only enforces foreign keys (and so ON DELETE CASCADE) on connections that ask for it
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+for url, sync_engine in [
+    (SQLALCHEMY_DATABASE_URL, engine),
+    (SQLALCHEMY_DATABASE_URL, async_engine.sync_engine),
+    *zip(config.database_replica_urls, replica_engines),
+    *zip(config.database_replica_urls, [replica.sync_engine for replica in async_replica_engines]),
+]:
+    if make_url(url).get_backend_name() == 'sqlite':
+        event.listen(sync_engine, 'connect', enable_sqlite_foreign_keys)
+
+_next_replica = itertools.count()
+
+def ReadSessionLocal() -> Session:
+    """Create a session for reads only, on the next read replica in turn, or on the primary if there are none.
+    """
+    if not replica_engines:
+        return SessionLocal()
+    return SessionLocal(bind=replica_engines[next(_next_replica) % len(replica_engines)])
+
+def AsyncReadSessionLocal() -> AsyncSession:
+    """Create an async session for reads only, on the next read replica in turn, or on the primary if there are none.
+    """
+    if not async_replica_engines:
+        return AsyncSessionLocal()
+    return AsyncSessionLocal(bind=async_replica_engines[next(_next_replica) % len(async_replica_engines)])
+
+
+class RecentWrites:
+    """Remembers which chats (by chat id) and which users' lists of chats and API keys (by user id) were written to
+    in the last `window` seconds, so that reads of them can go to the primary until the replicas have caught up
+    with the write, and a user always sees their own changes.
+    Writes are recorded with `mark_written` and only take effect once the session commits.
+    This is kept per process, so it only covers requests served by the process that made the write.
+
+    Args:
+        max_size (int): The maximum number of recent writes to remember. The oldest are forgotten first.
+        window (float): How long reads go to the primary after a write, in seconds. It should exceed the replicas' lag.
+    """
+
+    def __init__(self, max_size: int = 10000, window: float = 5):
+        self.window = window
+        self._writes = LRUCache(max_size)
+
+    def mark(self, key):
+        self._writes.set(str(key), True, ttl=self.window)
+
+    def is_recent(self, key) -> bool:
+        found, _ = self._writes.get(str(key))
+        return found
+
+
+recent_writes = RecentWrites(window=config.replica_read_your_writes_seconds)
+
+def mark_written(db: Session, *keys):
+    """Record that a session is writing to the given chats or users, to be remembered by `recent_writes` once it commits.
+    """
+    db.info.setdefault('written', set()).update(str(key) for key in keys)
+
+@event.listens_for(Session, 'after_commit')
+def remember_writes(session: Session):
+    for key in session.info.pop('written', ()):
+        recent_writes.mark(key)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_writes(session: Session):
+    session.info.pop('written', None)
+
+def get_pool_stats() -> dict:
+    """Get the connection pool statistics of the sync and async engines, and of those of each read replica.
+    """
+    def pool_stats(pool) -> dict:
+        if isinstance(pool, QueuePool):
+            return {
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            }
+        return {'status': pool.status()}
+    return {
+        'sync': pool_stats(engine.pool),
+        'async': pool_stats(async_engine.pool),
+        'replicas': [
+            {'sync': pool_stats(replica.pool), 'async': pool_stats(async_replica.pool)}
+            for replica, async_replica in zip(replica_engines, async_replica_engines)
+        ],
+    }
+
 Base = declarative_base()
\ No newline at end of file
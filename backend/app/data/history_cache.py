@@ -0,0 +1,126 @@
+"""
+An in-process cache of hydrated chat histories (the messages sent to a model), keyed by chat id and `Chat.version`.
+
+Every write through `crud` that changes what loading a chat returns bumps its version in the same transaction
+(see `crud.bump_chat_version`), so a history cached at an older version is never served. Writes that only add
+messages extend the cached history once they commit, so the next turn of a conversation is served from the cache
+without reloading the rest of it. Since every lookup checks the version read from the database, entries can't go
+stale even when another process writes to the chat.
+Cached messages are shared between requests, so they must not be changed in place.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections.abc import Sequence
+from pydantic import UUID4
+
+from app.config import config
+from app.tool_cache import LRUCache
+from app import schemas
+
+
+class HistoryCache:
+    """A bounded LRU cache of chat histories, holding at most one version of each chat.
+
+    Args:
+        max_size (int): The maximum number of chats to keep. 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: UUID4, version: int) -> list[schemas.MessageView] | None:
+        found, entry = self._entries.get(str(chat_id))
+        if not found or entry[0] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, chat_id: UUID4, version: int, messages: Sequence[schemas.MessageView]):
+        if self.max_size <= 0:
+            return
+        found, entry = self._entries.get(str(chat_id))
+        if found and entry[0] > version:
+            # a slower request loaded an older version; keep the newer one
+            return
+        messages = list(messages)
+        self._entries.set(str(chat_id), (version, messages, sum(estimate_size(message) for message in messages)))
+
+    def append(self, chat_id: UUID4, from_version: int, to_version: int, messages: Sequence[schemas.MessageView]):
+        """Extend a chat's cached history at `from_version` with new messages, caching it as `to_version`.
+        Messages the cached history already has (because it was loaded after they were written) are skipped.
+        If the chat isn't cached at `from_version`, it is dropped instead, and reloaded on the next lookup.
+        """
+        found, entry = self._entries.get(str(chat_id))
+        if not found or entry[0] != from_version:
+            self.invalidate(chat_id)
+            return
+        _, cached, size = entry
+        cached_ids = {message.id for message in cached}
+        new_messages = [message for message in messages if message.id not in cached_ids]
+        # cached lists are never changed in place, since requests may still be using them
+        self._entries.set(str(chat_id), (to_version, cached + new_messages, size + sum(estimate_size(message) for message in new_messages)))
+
+    def invalidate(self, chat_id: UUID4):
+        self._entries.delete(str(chat_id))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """Get the number of cached chats and messages, their approximate size in bytes (as JSON), and the hit rate.
+        """
+        entries = self._entries.values()
+        lookups = self.hits + self.misses
+        return {
+            'chats': len(entries),
+            'max_chats': self.max_size,
+            'messages': sum(len(messages) for _, messages, _ in entries),
+            'approx_bytes': sum(size for _, _, size in entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def estimate_size(message: schemas.MessageView) -> int:
+    return len(message.model_dump_json())
+
+
+history_cache = HistoryCache(max_size=config.history_cache_size)
+
+def record_chat_write(db: Session, chat_id: UUID4, version: int | None, appended: Sequence[schemas.MessageView] | None = None):
+    """Record that a session changed a chat, to be applied to `history_cache` once it commits.
+
+    Args:
+        db (Session): The session making the write
+        chat_id (UUID4): The chat written to
+        version (int | None): The chat's version after the write, or None if the chat was deleted
+        appended (Sequence[schemas.MessageView] | None, optional): The messages added, as they would be loaded for a model,
+            if that is all the write did. Defaults to None, i.e. the cached history has to be reloaded.
+    """
+    writes = db.info.setdefault('chat_writes', {})
+    if chat_id in writes:
+        from_version, _, previous = writes[chat_id]
+        appended = previous + list(appended) if previous is not None and appended is not None else None
+    else:
+        from_version = version - 1 if version is not None else None
+        appended = list(appended) if appended is not None else None
+    writes[chat_id] = (from_version, version, appended)
+
+@event.listens_for(Session, 'after_commit')
+def apply_chat_writes(session: Session):
+    for chat_id, (from_version, version, appended) in session.info.pop('chat_writes', {}).items():
+        if version is None or appended is None:
+            history_cache.invalidate(chat_id)
+        else:
+            history_cache.append(chat_id, from_version, version, appended)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_chat_writes(session: Session):
+    session.info.pop('chat_writes', None)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Enum, DateTime, JSON
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Index, Integer, LargeBinary, String, Enum, DateTime, JSON, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -14,21 +14,43 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     
-    chats = relationship('Chat', back_populates='user', cascade='all, delete-orphan')
-    api_keys = relationship('APIKey', back_populates='user', cascade='all, delete-orphan')
+    # children are removed by ON DELETE CASCADE in the database, so the ORM never has to load them to delete them
+    chats = relationship('Chat', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    api_keys = relationship('APIKey', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
     
 class Chat(Base):
     __tablename__ = 'chat'
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     title = Column(String, nullable=False)
-    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id'), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     default_model = Column(String, nullable=False)
-    config = Column(JSON, nullable=True)
+    config_hash = Column(String, ForeignKey('model_config.hash'), nullable=True)
     created_at = Column(DateTime, nullable=False, server_default='now()')
+    # bumped by every write through `crud` that changes what loading the chat returns; see `history_cache`
+    version = Column(Integer, nullable=False, server_default='0')
+    # a summary for the chat list, kept up to date by `crud` in the same transaction as each message write;
+    # system prompts and unselected candidates aren't counted, and the tokens are an estimate
+    message_count = Column(Integer, nullable=False, server_default='0')
+    last_message_at = Column(DateTime, nullable=False, server_default=func.now())
+    last_preview = Column(String, nullable=True)
+    total_tokens = Column(Integer, nullable=False, server_default='0')
+    # false for chats whose messages were written before messages had a `parent_id`, until `crud.link_messages`
+    # (or the backfill of revision c5a9e3f7b2d1) links them
+    messages_linked = Column(Boolean, nullable=False, server_default='true')
     
     user = relationship('User', back_populates='chats')
-    messages = relationship('Message', back_populates='chat', order_by='Message.created_at', cascade='all, delete-orphan')
+    messages = relationship('Message', back_populates='chat', order_by='Message.created_at', cascade='all, delete-orphan', passive_deletes=True)
+    stored_config = relationship('ModelConfig', lazy='joined')
+    
+    @property
+    def config(self) -> dict | None:
+        return self.stored_config.config if self.stored_config is not None else None
+    
+    __table_args__ = (
+        # serves the keyset pagination of a user's chats, most recently active first
+        Index('ix_chat_user_id_last_message_at_id', 'user_id', 'last_message_at', 'id'),
+    )
     
 class MessageContent(Base):
     __tablename__ = 'message_content'
@@ -37,11 +59,28 @@ class MessageContent(Base):
     type = Column(Enum(MessageContentType), nullable=False)
     content = Column(JSON, nullable=False)
     image_type = Column(String, nullable=True)
-    message_id = Column(UUID(as_uuid=True), ForeignKey('message.id'), nullable=False)
+    message_id = Column(UUID(as_uuid=True), ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
     order = Column(Integer, nullable=False)
     tool_call_id = Column(String, nullable=True)
+    result_metadata = Column(JSON, nullable=True)
+    compact_content = Column(JSON, nullable=True)
+    # set when the content is stored out of line in `content_blob`; `content` then only holds a preview
+    content_size = Column(Integer, nullable=True)
     
     message = relationship('Message', back_populates='contents')
+    
+    __table_args__ = (
+        Index('ix_message_content_message_id_order', 'message_id', 'order'),
+    )
+
+class ContentBlob(Base):
+    """The full content of a large message content (see `crud.insert_contents`), kept out of `message_content`
+    so that loading a chat doesn't read it unless it is needed.
+    """
+    __tablename__ = 'content_blob'
+    
+    content_id = Column(UUID(as_uuid=True), ForeignKey('message_content.id', ondelete='CASCADE'), primary_key=True)
+    content = Column(JSON, nullable=False)
 
 class Message(Base):
     __tablename__ = 'message'
@@ -49,14 +88,85 @@ class Message(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     role = Column(Enum(Role), nullable=False)
     model = Column(String, nullable=True)
-    config = Column(JSON, nullable=True)
+    config_hash = Column(String, ForeignKey('model_config.hash'), nullable=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey('user.id'), nullable=False)
-    chat_id = Column(UUID(as_uuid=True), ForeignKey('chat.id'), nullable=False)
+    chat_id = Column(UUID(as_uuid=True), ForeignKey('chat.id', ondelete='CASCADE'), nullable=False)
     created_at = Column(DateTime, nullable=False, server_default='now()')
+    # the message this one follows; a chat's messages form a tree rooted at its system prompt, so branches share their
+    # common prefix, and deleting a message deletes the messages that follow it
+    parent_id = Column(UUID(as_uuid=True), ForeignKey('message.id', ondelete='CASCADE'), nullable=True)
+    candidate_group = Column(UUID(as_uuid=True), nullable=True)
+    candidate_index = Column(Integer, nullable=True)
+    # whether the message is on the chat's active branch, i.e. part of its history; kept up to date by `crud`
+    # in the same transaction as each write, so loading a chat never has to walk the tree
+    selected = Column(Boolean, nullable=False, server_default='true')
     
     user = relationship('User')
     chat = relationship('Chat', back_populates='messages')
-    contents = relationship('MessageContent', back_populates='message', cascade='all, delete-orphan', order_by='MessageContent.order', lazy='joined')
+    contents = relationship('MessageContent', back_populates='message', cascade='all, delete-orphan', order_by='MessageContent.order', lazy='joined', passive_deletes=True)
+    # many-to-one loads check the identity map first, so messages sharing a config only load it once per session
+    stored_config = relationship('ModelConfig')
+    
+    @property
+    def config(self) -> dict | None:
+        return self.stored_config.config if self.stored_config is not None else None
+    
+    __table_args__ = (
+        Index('ix_message_chat_id_created_at', 'chat_id', 'created_at'),
+        Index('ix_message_parent_id', 'parent_id'),
+    )
+    
+class MessageUsage(Base):
+    """The token counts and timings of the model call that produced an assistant message (see `schemas.Usage`),
+    kept out of `message` since only accounting reads them.
+    """
+    __tablename__ = 'message_usage'
+
+    message_id = Column(UUID(as_uuid=True), ForeignKey('message.id', ondelete='CASCADE'), primary_key=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)
+    time_to_first_token_ms = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+
+class UsageRollup:
+    """The usage of a model by a user over a period, added to by `crud.record_usage` in the same transaction as
+    each response, so usage reports never read `message` or `message_usage`. Rows are kept when the messages they
+    count are deleted; what was spent stays spent.
+    """
+    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    # UTC, truncated to the period
+    period_start = Column(DateTime, primary_key=True)
+    model = Column(String, primary_key=True)
+    responses = Column(Integer, nullable=False)
+    # responses whose time to the first token was measured
+    streamed_responses = Column(Integer, nullable=False)
+    prompt_tokens = Column(BigInteger, nullable=False)
+    completion_tokens = Column(BigInteger, nullable=False)
+    cached_tokens = Column(BigInteger, nullable=False)
+    # totals over the responses
+    latency_ms = Column(BigInteger, nullable=False)
+    time_to_first_token_ms = Column(BigInteger, nullable=False)
+
+class UsageHourly(UsageRollup, Base):
+    __tablename__ = 'usage_hourly'
+
+class UsageDaily(UsageRollup, Base):
+    __tablename__ = 'usage_daily'
+
+class ChatArchive(Base):
+    """The contents of an idle chat's messages, moved out of `message_content` into a single zstd-compressed JSON blob.
+    Loaders merge them back in transparently (see `crud.unpack_contents`); writes that change existing contents
+    restore them to `message_content` first (see `crud.restore_chat_contents`).
+    """
+    __tablename__ = 'chat_archive'
+    
+    chat_id = Column(UUID(as_uuid=True), ForeignKey('chat.id', ondelete='CASCADE'), primary_key=True)
+    contents = Column(LargeBinary, nullable=False)
+    content_count = Column(Integer, nullable=False)
+    # the size of the uncompressed JSON, for reporting
+    raw_size = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
     
 class APIKey(Base):
     __tablename__ = 'api_key'
@@ -64,6 +174,25 @@ class APIKey(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     key = Column(String, nullable=False, unique=True)
     provider = Column(String, nullable=False)
-    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id'), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    
+    user = relationship('User', back_populates='api_keys')
+    
+class ModelConfig(Base):
+    """A model config, stored once and shared by every chat and message that uses it.
+    Configs are immutable and keyed by the hash of their canonical JSON (see `crud.model_config_hash`).
+    """
+    __tablename__ = 'model_config'
+    
+    hash = Column(String, primary_key=True)
+    config = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    
+class ToolResultCacheEntry(Base):
+    __tablename__ = 'tool_result_cache'
     
-    user = relationship('User', back_populates='api_keys')
\ No newline at end of file
+    key = Column(String, primary_key=True)
+    tool_name = Column(String, nullable=False)
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+Full-text search over a user's chat titles and the text contents of their messages.
+
+On PostgreSQL the index is a generated `tsvector` column of chat titles (`chat.title_search`) and a `message_search`
+table holding each message's searchable text with a generated `tsvector` of it, both with GIN indexes and created by
+migrations. On SQLite (used for local testing) it is a pair of FTS5 tables, created alongside the rest of the schema.
+Message text is kept by `crud` in the same transaction as each write on both backends. It is a copy of its own, rather
+than derived from `message_content`, so messages stay searchable once their chat is archived, and contents stored out
+of line are indexed in full rather than by their preview.
+Neither index is part of the ORM models, since neither can be expressed portably.
+"""
+from abc import ABC, abstractmethod
+from sqlalchemy import DDL, Row, bindparam, column, delete, event, insert, table, text
+from sqlalchemy.orm import Session
+from collections.abc import Sequence
+import html
+import re
+from pydantic import UUID4
+
+from app.data import models
+from app.data.database import Base
+from app.util import MessageContentType, Role
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+# the backends delimit matches with these (private use) characters, which `render_snippet` turns into the tags above
+# once the text around them is escaped
+MATCH_START = '\ue000'
+MATCH_END = '\ue001'
+
+# a matching title says more about a chat than a matching message; both backends weigh title hits up by this much
+TITLE_WEIGHT = 2.0
+
+chat_fts = table('chat_fts', column('title'), column('chat_id', models.Chat.id.type))
+message_fts = table('message_fts', column('body'), column('message_id', models.Message.id.type), column('chat_id', models.Chat.id.type))
+message_search = table('message_search', column('message_id', models.Message.id.type), column('body'))
+
+for statement in [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(title, chat_id UNINDEXED, tokenize='porter unicode61')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(body, message_id UNINDEXED, chat_id UNINDEXED, tokenize='porter unicode61')",
+]:
+    event.listen(Base.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in ['DROP TABLE IF EXISTS chat_fts', 'DROP TABLE IF EXISTS message_fts']:
+    event.listen(Base.metadata, 'before_drop', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def searchable_text(role: Role, contents: Sequence) -> list[str]:
+    """Get the text of a message that should be searchable: its text contents, unless it is a system prompt.
+    """
+    if role == Role.SYSTEM:
+        return []
+    return [content.content for content in contents if content.type == MessageContentType.TEXT and isinstance(content.content, str)]
+
+
+def render_snippet(snippet: str) -> str:
+    """Turn a snippet from a backend into HTML: the text is escaped, and only the matches are wrapped in <mark> tags.
+    """
+    return html.escape(snippet).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+class SearchIndex(ABC):
+    """Maintains and queries the full-text index of one database backend.
+    The `index_*` and `remove_*` methods are called by `crud` before it commits, so the index always matches the data.
+    """
+
+    @abstractmethod
+    def index_chat(self, db: Session, chat_id: UUID4, title: str):
+        pass
+
+    @abstractmethod
+    def remove_chat(self, db: Session, chat_id: UUID4):
+        pass
+
+    @abstractmethod
+    def index_messages(self, db: Session, messages: Sequence[tuple[UUID4, UUID4, Sequence[str]]]):
+        """Index new messages, given as (message id, chat id, searchable texts).
+        """
+        pass
+
+    @abstractmethod
+    def remove_messages(self, db: Session, message_ids: Sequence[UUID4]):
+        pass
+
+    @abstractmethod
+    def search(self, db: Session, user_id: UUID4, query: str, limit: int, offset: int = 0) -> list[Row]:
+        """Get a page of a user's matching chat titles and messages, best match first.
+
+        Returns:
+            list[Row]: Rows of (chat_id, chat_title, message_id, snippet, rank, created_at); message_id is None for title matches,
+                and the snippet is plain text with its matches between `MATCH_START` and `MATCH_END`
+        """
+        pass
+
+
+class PostgresSearchIndex(SearchIndex):
+    """Searches the generated `tsvector` columns. Titles are indexed by the database; the text of a message is indexed
+    as a single document, so a message ranks once however many text contents it has.
+    Queries are parsed with `websearch_to_tsquery`, so user input can't cause a syntax error.
+    Snippets are only computed for the page being returned, since `ts_headline` is far more expensive than matching.
+    """
+
+    statement = text(f'''
+        WITH query AS (SELECT websearch_to_tsquery('english', :query) AS tsquery),
+        hits AS (
+            SELECT chat.id AS chat_id, NULL::uuid AS message_id, chat.title AS body,
+                ts_rank(chat.title_search, query.tsquery) * {TITLE_WEIGHT} AS rank, chat.created_at
+            FROM chat, query
+            WHERE chat.user_id = :user_id AND chat.title_search @@ query.tsquery
+            UNION ALL
+            SELECT message.chat_id, message.id, message_search.body,
+                ts_rank(message_search.search_document, query.tsquery), message.created_at
+            FROM message_search
+            JOIN message ON message.id = message_search.message_id
+            JOIN chat ON chat.id = message.chat_id, query
+            WHERE chat.user_id = :user_id AND message.role != 'SYSTEM' AND message_search.search_document @@ query.tsquery
+            ORDER BY rank DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT hits.chat_id, chat.title AS chat_title, hits.message_id,
+            ts_headline('english', hits.body, query.tsquery,
+                'StartSel="{MATCH_START}", StopSel="{MATCH_END}", MaxFragments=2, MaxWords=24, MinWords=8') AS snippet,
+            hits.rank, hits.created_at
+        FROM hits JOIN chat ON chat.id = hits.chat_id, query
+        ORDER BY hits.rank DESC, hits.created_at DESC
+    ''').bindparams(bindparam('user_id', type_=models.Chat.user_id.type)).columns(
+        chat_id=models.Chat.id.type, message_id=models.Message.id.type
+    )
+
+    def index_chat(self, db: Session, chat_id: UUID4, title: str):
+        # `chat.title_search` is generated from the title by the database
+        pass
+
+    def remove_chat(self, db: Session, chat_id: UUID4):
+        # the chat's row, and so its `title_search`, is already gone; its messages' rows go by ON DELETE CASCADE
+        pass
+
+    def index_messages(self, db: Session, messages: Sequence[tuple[UUID4, UUID4, Sequence[str]]]):
+        rows = [{'message_id': message_id, 'body': '\n\n'.join(bodies)} for message_id, _, bodies in messages if bodies]
+        if rows:
+            db.execute(insert(message_search), rows)
+
+    def remove_messages(self, db: Session, message_ids: Sequence[UUID4]):
+        db.execute(delete(message_search).where(message_search.c.message_id.in_(message_ids)))
+
+    def search(self, db: Session, user_id: UUID4, query: str, limit: int, offset: int = 0) -> list[Row]:
+        return list(db.execute(self.statement, {'query': query, 'user_id': user_id, 'limit': limit, 'offset': offset}).all())
+
+
+class SQLiteSearchIndex(SearchIndex):
+    """Searches the FTS5 tables, ranked by bm25. Entries of deleted chats are removed by `remove_chat`,
+    since virtual tables can't take part in ON DELETE CASCADE.
+    """
+
+    statement = text(f'''
+        WITH hits AS (
+            SELECT chat_id, NULL AS message_id,
+                snippet(chat_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 24) AS snippet,
+                bm25(chat_fts) * {TITLE_WEIGHT} AS score
+            FROM chat_fts WHERE chat_fts MATCH :query
+            UNION ALL
+            SELECT chat_id, message_id,
+                snippet(message_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 24),
+                bm25(message_fts)
+            FROM message_fts WHERE message_fts MATCH :query
+        )
+        SELECT hits.chat_id, chat.title AS chat_title, hits.message_id, hits.snippet,
+            -hits.score AS rank, COALESCE(message.created_at, chat.created_at) AS created_at
+        FROM hits
+        JOIN chat ON chat.id = hits.chat_id
+        LEFT JOIN message ON message.id = hits.message_id
+        WHERE chat.user_id = :user_id
+        ORDER BY hits.score, created_at DESC
+        LIMIT :limit OFFSET :offset
+    ''').bindparams(bindparam('user_id', type_=models.Chat.user_id.type)).columns(
+        chat_id=models.Chat.id.type, message_id=models.Message.id.type, created_at=models.Message.created_at.type
+    )
+
+    @staticmethod
+    def to_match_expression(query: str) -> str:
+        """Turn free text into an FTS5 query that matches every word, so user input can't cause a syntax error.
+        """
+        return ' '.join('"' + word + '"' for word in re.findall(r'\w+', query))
+
+    def index_chat(self, db: Session, chat_id: UUID4, title: str):
+        db.execute(delete(chat_fts).where(chat_fts.c.chat_id == chat_id))
+        db.execute(insert(chat_fts).values(chat_id=chat_id, title=title))
+
+    def remove_chat(self, db: Session, chat_id: UUID4):
+        db.execute(delete(chat_fts).where(chat_fts.c.chat_id == chat_id))
+        db.execute(delete(message_fts).where(message_fts.c.chat_id == chat_id))
+
+    def index_messages(self, db: Session, messages: Sequence[tuple[UUID4, UUID4, Sequence[str]]]):
+        rows = [
+            {'message_id': message_id, 'chat_id': chat_id, 'body': body}
+            for message_id, chat_id, bodies in messages
+            for body in bodies
+        ]
+        if rows:
+            db.execute(insert(message_fts), rows)
+
+    def remove_messages(self, db: Session, message_ids: Sequence[UUID4]):
+        db.execute(delete(message_fts).where(message_fts.c.message_id.in_(message_ids)))
+
+    def search(self, db: Session, user_id: UUID4, query: str, limit: int, offset: int = 0) -> list[Row]:
+        match = self.to_match_expression(query)
+        if not match:
+            return []
+        return list(db.execute(self.statement, {'query': match, 'user_id': user_id, 'limit': limit, 'offset': offset}).all())
+
+
+search_indexes: dict[str, SearchIndex] = {
+    'postgresql': PostgresSearchIndex(),
+    'sqlite': SQLiteSearchIndex(),
+}
+
+def get_search_index(db: Session) -> SearchIndex:
+    dialect = db.get_bind().dialect.name
+    if dialect not in search_indexes:
+        raise NotImplementedError(f'Unsupported database: {dialect}')
+    return search_indexes[dialect]
@@ -1,11 +1,14 @@
 import os
 import uuid
-from fastapi import Depends, Form, HTTPException, UploadFile, WebSocketException, status
+from fastapi import Depends, Form, HTTPException, Request, UploadFile, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from pydantic import UUID4
 from app import data, schemas, chat_models, tools
 from app.config import config
+from app.user_cache import user_cache, api_key_cache, get_service_user
+from types import MappingProxyType
+from collections.abc import Mapping
 from typing import cast
 
 def get_db():
@@ -15,9 +18,16 @@ def get_db():
     finally:
         db.close()
         
+async def get_async_db():
+    """Get an async database session. Async dependencies and routes should use this rather than `get_db`,
+    so that their queries do not block the event loop.
+    """
+    async with data.AsyncSessionLocal() as db:
+        yield db
+        
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/users/token')
         
-async def get_current_user(token: str = Depends(oauth2_scheme), db: data.Session = Depends(get_db), req_type: str = 'http') -> schemas.user.User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: data.AsyncSession = Depends(get_async_db), req_type: str = 'http') -> schemas.user.User:
     """Get the current user from the JWT token
 
     Args:
@@ -27,7 +37,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: data.Session
         credentials_exception: If the token is invalid or the user does not exist
 
     Returns:
-        schemas.User: The user associated with the token
+        schemas.User: The user associated with the token. Recently seen users are served from `user_cache`.
     """
     if req_type == 'http':
         credentials_exception = HTTPException(
@@ -46,56 +56,136 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: data.Session
             raise credentials_exception
     except jwt.InvalidTokenError:
         raise credentials_exception
-    db_user = data.crud.get_user(db, user_id)
+    # the token is still decoded (and so checked for expiry) every time; only the user lookup is cached
+    user = user_cache.get(str(user_id))
+    if user is not None:
+        return user
+    db_user = await data.async_crud.get_user(db, user_id)
     if db_user is None:
         raise credentials_exception
-    return db_user
+    user = schemas.User(id=db_user.id, email=db_user.email)
+    user_cache.set(str(user_id), user)
+    return user
+
+def reads_need_primary(request: Request, current_user: schemas.User) -> bool:
+    """Whether a read-only route should read from the primary rather than a replica, so that users see their own writes:
+    true if the chat in its path (or, for routes that aren't about one chat, the current user's chats or API keys)
+    was written to within the last `REPLICA_READ_YOUR_WRITES_SECONDS`.
+    """
+    chat_id = request.path_params.get('chat_id')
+    return data.recent_writes.is_recent(chat_id if chat_id is not None else current_user.id)
 
-async def get_chat(chat_id: UUID4, db: data.Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user), req_type: str = 'http') -> data.models.Chat:
-    db_chat = data.crud.get_chat(db, chat_id=chat_id)
-    if db_chat is None:
+def get_read_db(request: Request, current_user: schemas.User = Depends(get_current_user)):
+    """Get a database session for a read-only route: on a read replica if any are configured (see `reads_need_primary`).
+    """
+    db = data.SessionLocal() if reads_need_primary(request, current_user) else data.ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request, current_user: schemas.User = Depends(get_current_user)):
+    """Async version of `get_read_db`.
+    """
+    async with (data.AsyncSessionLocal() if reads_need_primary(request, current_user) else data.AsyncReadSessionLocal()) as db:
+        yield db
+
+def check_chat_access(chat: schemas.ChatView | None, current_user: schemas.User, req_type: str = 'http'):
+    if chat is None:
         raise HTTPException(status_code=404, detail='Chat not found') if req_type == 'http' else WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason='Chat not found')
-    if db_chat.user_id != current_user.id:
+    if chat.user_id != current_user.id:
         raise HTTPException(status_code=403, detail='Not authorized to access chat') if req_type == 'http' else WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason='Not authorized to access chat')
-    return db_chat
+
+async def get_chat(chat_id: UUID4, db: data.AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user), req_type: str = 'http') -> schemas.ChatView:
+    chat = await data.async_crud.get_chat(db, chat_id=chat_id)
+    check_chat_access(chat, current_user, req_type)
+    return cast(schemas.ChatView, chat)
+
+async def get_chat_full(chat_id: UUID4, db: data.AsyncSession = Depends(get_async_read_db), current_user: schemas.User = Depends(get_current_user)) -> schemas.ChatFull:
+    """Get a chat with all of its messages, for display. Contents stored out of line are only previewed.
+    """
+    chat = await data.async_crud.get_chat_full(db, chat_id=chat_id, load_blobs=False)
+    check_chat_access(chat, current_user)
+    return cast(schemas.ChatFull, chat)
+
+async def get_chat_history(chat_id: UUID4, db: data.AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)) -> schemas.ChatFull:
+    """Get a chat with all of its messages, for sending to a model. Per-message model configs are not loaded.
+    The messages are served from `history_cache` when it holds the chat's current version.
+    Always read from the primary: new messages are written after this history, so a replica that lags behind
+    (even one that `reads_need_primary` thinks is current, after a write by another process) would branch the chat.
+    """
+    chat = await data.async_crud.get_chat_history(db, chat_id=chat_id)
+    check_chat_access(chat, current_user)
+    return cast(schemas.ChatFull, chat)
+
+async def get_api_keys(db: data.AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)) -> Mapping[str, str]:
+    """Get the current user's API keys, by provider.
+    All keys are loaded with one query and cached in `api_key_cache`, so most requests don't query them at all.
+    The cache is filled from the primary, since a replica that lags behind would cache keys that were just changed.
+    """
+    api_keys = api_key_cache.get(current_user.id)
+    if api_keys is None:
+        api_keys = MappingProxyType(await data.async_crud.get_api_key_map(db, current_user.id))
+        api_key_cache.set(current_user.id, api_keys)
+    return api_keys
 
 def get_message(message: str = Form()) -> schemas.Message:
-    return schemas.Message.model_validate_json(message)
+    message = schemas.Message.model_validate_json(message)
+    # where a message sits in the tree, and its usage, are only ever set by the server, never taken from a client
+    message.parent_id = None
+    message.candidate_group = None
+    message.candidate_index = None
+    message.selected = True
+    message.usage = None
+    return message
 
-async def get_model(message: schemas.Message = Depends(get_message), chat: data.models.Chat = Depends(get_chat), db: data.Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    if message.model is not None:
+def build_model(model_name: str | None, model_config: schemas.ModelConfig | None, chat: schemas.ChatView, api_keys: Mapping[str, str]):
+    if model_name is not None:
         # user can select a model for a single message
-        model_type = chat_models.get_chat_model(message.model)
+        model_type = chat_models.get_chat_model(model_name)
     else:
         # otherwise use the default model for the chat
-        model_type = chat_models.get_chat_model(cast(str, chat.default_model))
+        model_type = chat_models.get_chat_model(chat.default_model)
     key = None
     if model_type.requires_key:
-        db_key = data.crud.get_api_key(db, current_user.id, model_type.api_provider)
-        if db_key is None:
+        key = api_keys.get(model_type.api_provider)
+        if key is None:
             raise HTTPException(status_code=400, detail='No API key registered for model for this user')
-        key = db_key.key
-    if message.config is not None:
-        config = message.config
-    else:
-        config = cast(dict, chat.config)
-    model = model_type(api_key=cast(str, key), config=config) # construct model instance, using API key if required
+    if model_config is None:
+        model_config = chat.config.model_dump()
+    model = model_type(api_key=key, config=model_config) # construct model instance, using API key if required
+    return model, model_config
+
+async def get_model(message: schemas.Message = Depends(get_message), chat: schemas.ChatFull = Depends(get_chat_history), api_keys: Mapping[str, str] = Depends(get_api_keys)):
+    model_with_config = build_model(message.model, message.config, chat, api_keys)
     message.model = None # user messages should not have a model; this was just for the model selection
-    return model, config
+    return model_with_config
+
+async def get_edit_model(message: schemas.Message = Depends(get_message), chat: schemas.ChatView = Depends(get_chat), api_keys: Mapping[str, str] = Depends(get_api_keys)):
+    """`get_model` for a new version of a message, whose history is loaded by the route (see `crud.get_branch_history`)
+    rather than from the chat's active branch.
+    """
+    model_with_config = build_model(message.model, message.config, chat, api_keys)
+    message.model = None
+    return model_with_config
+
+async def get_response_model(model: str | None = None, chat: schemas.ChatView = Depends(get_chat), api_keys: Mapping[str, str] = Depends(get_api_keys)):
+    """Get the model for a response that isn't to a new message (e.g. a regenerated one): the chat's default model,
+    or the one named by the `model` query parameter.
+    """
+    return build_model(model, None, chat, api_keys)
 
-async def get_tools(db: data.Session = Depends(get_db), current_user = Depends(get_current_user)) -> dict[str, schemas.ToolConfig]:
+async def get_tools(api_keys: Mapping[str, str] = Depends(get_api_keys)) -> dict[str, schemas.ToolConfig]:
     res = {}
-    for tool_name in tools.get_tools():
-        tool = tools.get_tools()[tool_name]
+    for tool_name, tool in tools.get_tools().items():
         if not tool.requires_api_key:
             res[tool_name] = tool
         elif tool.api_provider is None:
             raise ValueError(f'Tool {tool_name} requires an API key but no provider is specified')
         else:
-            api_key = data.crud.get_api_key(db, current_user.id, tool.api_provider)
+            api_key = api_keys.get(tool.api_provider)
             if api_key is not None:
-                tool.set_api_key(cast(str, api_key.key))
-                res[tool_name] = tool
+                res[tool_name] = tool.bind(api_key)
     return res
 
 def save_files(chat_id: UUID4, files: list[UploadFile] | None = None, message: schemas.Message = Depends(get_message)) -> schemas.Message:
@@ -131,31 +221,18 @@ def save_files(chat_id: UUID4, files: list[UploadFile] | None = None, message: s
             c.image_type = file.content_type
     return message
 
-def get_system_user(db: data.Session = Depends(get_db)) -> data.models.User:
-    """Get the system user from the database
-
-    Args:
-        db (data.Session, optional): The database session. Defaults to Depends(get_db).
+def get_system_user() -> schemas.User:
+    """Get the system user, which owns system prompts. It is looked up once, usually at startup.
 
     Returns:
-        data.models.User: The system user
+        schemas.User: The system user
     """
-    
-    system_user = data.crud.get_user_by_email(db, email=config.system_email)
-    if system_user is None:
-        system_user = data.crud.create_user(db, user=schemas.UserCreate(email=config.system_email, password='password'))
-    return system_user
-
-def get_assistant_user(db: data.Session = Depends(get_db)) -> schemas.User:
-    """Get the assistant user from the database
+    return get_service_user(config.system_email)
 
-    Args:
-        db (data.Session, optional): The database session. Defaults to Depends(get_db).
+def get_assistant_user() -> schemas.User:
+    """Get the assistant user, which owns model responses. It is looked up once, usually at startup.
 
     Returns:
-        data.models.User: The assistant user
+        schemas.User: The assistant user
     """
-    assistant_user = data.crud.get_user_by_email(db, email=config.assistant_email)
-    if assistant_user is None:
-        assistant_user = data.crud.create_user(db, user=schemas.UserCreate(email=config.assistant_email, password='password'))
-    return schemas.User.model_validate(assistant_user, from_attributes=True)
\ No newline at end of file
+    return get_service_user(config.assistant_email)
\ No newline at end of file
@@ -1,9 +1,45 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from fastapi import Depends, FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import config
-from app.routers import chat, models, users, tools
+from app.dependencies import get_current_user
+from app.data import get_pool_stats, history_cache
+from app.routers import chat, models, users, tools, search, transfer, usage
+from app.tools import get_tools
+from app.tool_cache import tool_result_cache
+from app.tool_sandbox import tool_sandbox
+from app.user_cache import load_service_users
 
-app = FastAPI()
+async def purge_expired_tool_results():
+    """Periodically delete the expired entries of the shared tool result cache, which would otherwise never be removed.
+    """
+    while True:
+        await asyncio.sleep(config.tool_cache_purge_seconds)
+        try:
+            await tool_result_cache.purge_expired()
+        except Exception:
+            # the next run will try again
+            logging.exception('Failed to purge expired tool results')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # resolve the system and assistant users once, rather than on every chat creation and assistant message
+    await run_in_threadpool(load_service_users)
+    # compile the tool registry once, and pre-fork the sandbox workers if any tool needs them
+    sandboxed = any(tool.sandbox is not None for tool in get_tools().values())
+    if sandboxed:
+        await run_in_threadpool(tool_sandbox.start)
+    purge_task = asyncio.create_task(purge_expired_tool_results()) if tool_result_cache.shared else None
+    yield
+    if purge_task is not None:
+        purge_task.cancel()
+    if sandboxed:
+        await run_in_threadpool(tool_sandbox.shutdown)
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,8 +53,20 @@ app.include_router(users.router)
 app.include_router(chat.router)
 app.include_router(models.router)
 app.include_router(tools.router)
+app.include_router(search.router)
+app.include_router(transfer.router)
+app.include_router(usage.router)
 
 
 @app.get('/')
 async def root():
-    return {'message': 'Hello, World!'}
\ No newline at end of file
+    return {'message': 'Hello, World!'}
+
+# operational stats are only served to signed-in users
+@app.get('/stats/db_pool', dependencies=[Depends(get_current_user)])
+async def read_db_pool_stats():
+    return get_pool_stats()
+
+@app.get('/stats/history_cache', dependencies=[Depends(get_current_user)])
+async def read_history_cache_stats():
+    return history_cache.stats()
\ No newline at end of file
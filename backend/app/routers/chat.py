@@ -1,15 +1,20 @@
-import os
-import shutil
+import datetime
 import uuid
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse
 from pydantic import UUID4
 from app import data, schemas, dependencies, chat_models
 from app.schemas.model_config import ModelConfigWithTools
-from app.util import Role
+from app.util import Role, encode_cursor, decode_cursor
 from typing import cast
+from app.chat_models.chat_model import StreamResult
 from app.chat_stream import ChatStreamManager
+from app.uploads import remove_chat_uploads
+import anyio
 import asyncio
+import functools
+import logging
+import time
 
 router = APIRouter(
     prefix="/chat",
@@ -17,9 +22,26 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-@router.get('/', response_model=list[schemas.ChatView])
-def read_chats(skip: int = 0, limit: int = 100, db: data.Session = Depends(dependencies.get_db), current_user: schemas.User = Depends(dependencies.get_current_user)):
-    return data.crud.get_chats(db, user_id=current_user.id, skip=skip, limit=limit)
+def parse_cursor(cursor: str | None) -> tuple[datetime.datetime, uuid.UUID] | None:
+    """Decode a (timestamp, id) pagination cursor, as returned by the list endpoints.
+    """
+    if cursor is None:
+        return None
+    try:
+        timestamp, id = decode_cursor(cursor, 2)
+        return datetime.datetime.fromisoformat(timestamp), uuid.UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+@router.get('/', response_model=schemas.ChatPage)
+def read_chats(skip: int = 0, limit: int = 100, cursor: str | None = None, db: data.Session = Depends(dependencies.get_read_db), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """List the user's chats, most recently active first.
+    Pass the `next_cursor` of a page as `cursor` to get the next page, instead of increasing `skip`.
+    """
+    before = parse_cursor(cursor)
+    chats = data.crud.get_chats(db, user_id=current_user.id, skip=skip, limit=limit, before=before)
+    next_cursor = encode_cursor(chats[-1].last_message_at.isoformat(), str(chats[-1].id)) if limit > 0 and len(chats) == limit else None
+    return schemas.ChatPage(chats=[schemas.ChatView.model_validate(chat, from_attributes=True) for chat in chats], next_cursor=next_cursor)
 
 @router.post('/', response_model=schemas.ChatView)
 def create_chat(chat: schemas.ChatCreate, db: data.Session = Depends(dependencies.get_db), current_user: schemas.User = Depends(dependencies.get_current_user), system_user = Depends(dependencies.get_system_user)):
@@ -29,22 +51,46 @@ def create_chat(chat: schemas.ChatCreate, db: data.Session = Depends(dependencie
     return chat_db
 
 @router.get('/{chat_id}', response_model=schemas.ChatFull)
-def read_chat(chat: data.models.Chat = Depends(dependencies.get_chat)):
+def read_chat(chat: schemas.ChatFull = Depends(dependencies.get_chat_full)):
+    return chat
+
+@router.get('/{chat_id}/header', response_model=schemas.ChatView)
+def read_chat_header(chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """Get a chat without any of its messages.
+    """
     return chat
 
+@router.get('/{chat_id}/messages', response_model=schemas.MessagePage)
+def read_messages(limit: int = Query(50, ge=1, le=500), cursor: str | None = None, db: data.Session = Depends(dependencies.get_read_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """Get a chat's history a page at a time, starting from the newest messages.
+    Pass the `next_cursor` of a page as `cursor` to get the messages before it.
+    """
+    before = parse_cursor(cursor)
+    messages, has_more = data.crud.get_message_page(db, chat_id=chat.id, limit=limit, before=before, load_blobs=False)
+    next_cursor = encode_cursor(messages[0].created_at.isoformat(), str(messages[0].id)) if has_more else None
+    return schemas.MessagePage(messages=messages, next_cursor=next_cursor)
+
+@router.get('/{chat_id}/contents/{content_id}', response_model=schemas.message_content_type)
+def read_message_content(content_id: UUID4, db: data.Session = Depends(dependencies.get_read_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """Get a single message content in full, e.g. one that chat views only preview (see `content_size`).
+    """
+    content = data.crud.get_message_content(db, chat_id=chat.id, content_id=content_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail='Message content not found')
+    return content
+
 @router.get('/uploads/{chat_id}/{file_path}', response_class=FileResponse, dependencies=[Depends(dependencies.get_chat)])
 def read_upload(chat_id: UUID4, file_path: str):
     return f'uploads/{chat_id}/{file_path}'
 
 @router.put('/{chat_id}', response_model=schemas.ChatView)
-def update_chat(chat: schemas.ChatCreate, db_chat: data.models.Chat = Depends(dependencies.get_chat), db: data.Session = Depends(dependencies.get_db), tools = Depends(dependencies.get_tools)):
-    old_chat = schemas.ChatFull.model_validate(db_chat, from_attributes=True)
+def update_chat(chat: schemas.ChatCreate, old_chat: schemas.ChatView = Depends(dependencies.get_chat), db: data.Session = Depends(dependencies.get_db), tools = Depends(dependencies.get_tools)):
     if chat.default_model != old_chat.default_model:
         # if default model is changed, completely overwrite chat config
         default_model_config = chat_models.get_chat_model(chat.default_model).config_type()
         if chat.config is None:
             chat.config = default_model_config
-        return data.crud.update_chat(db=db, chat_id=cast(UUID4, db_chat.id), chat=chat)
+        return data.crud.update_chat(db=db, chat_id=old_chat.id, chat=chat)
     
     if isinstance(old_chat.config, ModelConfigWithTools) and isinstance(chat.config, ModelConfigWithTools) and [tool.name for tool in chat.config.tools] != chat.tools:
         kept_tools = []
@@ -59,16 +105,42 @@ def update_chat(chat: schemas.ChatCreate, db_chat: data.models.Chat = Depends(de
                 raise HTTPException(status_code=400, detail='Chat model does not support tools')
             chat.config.tools.append(tools[tool_name])
         assert [tool.name for tool in chat.config.tools] == chat.tools
-    return data.crud.update_chat(db=db, chat_id=cast(UUID4, db_chat.id), chat=chat)
+    return data.crud.update_chat(db=db, chat_id=old_chat.id, chat=chat)
 
 @router.delete('/{chat_id}')
-def delete_chat(db: data.Session = Depends(dependencies.get_db), db_chat: data.models.Chat = Depends(dependencies.get_chat)):
-    if os.path.exists(f'images/{db_chat.id}'):
-        shutil.rmtree(f'images/{db_chat.id}')
-    db.delete(db_chat)
-    db.commit()
+def delete_chat(background_tasks: BackgroundTasks, db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    data.crud.delete_chat(db=db, chat_id=chat.id)
+    background_tasks.add_task(remove_chat_uploads, chat.id)
     return {'message': 'Chat deleted', }
 
+@router.put('/{chat_id}/messages/{message_id}/select', response_model=schemas.MessageView)
+def select_candidate(message_id: UUID4, db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """Make a candidate response the one that is part of the chat history, switching to the newest branch through it.
+    """
+    db_message = data.crud.get_message(db, message_id=message_id)
+    if db_message is None or db_message.chat_id != chat.id:
+        raise HTTPException(status_code=404, detail='Message not found')
+    try:
+        return data.crud.select_candidate(db=db, message_id=message_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get('/{chat_id}/branches', response_model=list[schemas.Branch])
+def read_branches(db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """List the branches of a chat, newest first. Every edited or regenerated message starts one.
+    """
+    return data.crud.get_branches(db, chat_id=chat.id)
+
+@router.put('/{chat_id}/branches/{message_id}', response_model=schemas.ChatFull)
+def switch_branch(message_id: UUID4, db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat)):
+    """Make the newest branch through a message (e.g. a branch head) the active one, and get the chat as it is then.
+    """
+    db_message = data.crud.get_message(db, message_id=message_id)
+    if db_message is None or db_message.chat_id != chat.id:
+        raise HTTPException(status_code=404, detail='Message not found')
+    data.crud.switch_branch(db, chat_id=chat.id, message_id=message_id)
+    return data.crud.get_chat_full(db, chat_id=chat.id, load_blobs=False)
+
 def autogen_chat_title(db: data.Session, chat_id: UUID4, messages: list[schemas.Message], model: chat_models.chat_model.ChatModel) -> schemas.chat.Chat:
     db_chat = data.crud.get_chat(db, chat_id)
     if db_chat is None:
@@ -89,7 +161,21 @@ def autogen_chat_title(db: data.Session, chat_id: UUID4, messages: list[schemas.
     
     return schemas.chat.Chat.model_validate(db_chat, from_attributes=True)
 
-def handle_tool_calls(message: schemas.Message, user_id: UUID4, chat_id: UUID4, db: data.Session, tools: dict[str, schemas.ToolConfig]) -> data.models.Message:
+def mark_candidates(candidates: list[schemas.Message]):
+    """Group alternative responses to the same messages, selecting the first one.
+    """
+    if len(candidates) < 2:
+        return
+    group = uuid.uuid4()
+    for i, candidate in enumerate(candidates):
+        candidate.candidate_group = group
+        candidate.candidate_index = i
+        candidate.selected = i == 0
+
+def handle_tool_calls(message: schemas.Message, tools: dict[str, schemas.ToolConfig]) -> schemas.Message:
+    """Run a message's tool calls. Called from the threadpool by the sync routes that get a model's response;
+    each tool runs on the event loop, so its shared cache lookups don't hold a thread of their own.
+    """
     print('handling tool calls')
     tool_result_message = schemas.MessageBuilder(role=Role.TOOL)
     for content in message.contents:
@@ -99,50 +185,117 @@ def handle_tool_calls(message: schemas.Message, user_id: UUID4, chat_id: UUID4,
             tool = tools.get(tool_call.name)
             if tool is None:
                 raise HTTPException(status_code=400, detail=f'Tool {tool_call.name} not found')
-            tool_result = tool(**tool_call.args)
-            print('tool result', tool_result)
-            tool_result_message.add_tool_result(tool_result, tool_call_id=content.tool_call_id)
+            tool_result, result_metadata = anyio.from_thread.run(functools.partial(tool.run, **tool_call.args))
+            tool_result_message.add_tool_result(tool_result, tool_call_id=content.tool_call_id, result_metadata=result_metadata, compact_content=tool.compact(tool_result))
     
-    db_msg = data.crud.create_message(db=db, message=tool_result_message.build(), user_id=user_id, chat_id=chat_id)
-    
-    return db_msg
+    return tool_result_message.build()
+
+def elapsed_ms(started: float, ended: float | None = None) -> int:
+    return round(((ended if ended is not None else time.monotonic()) - started) * 1000)
+
+def get_response(messages: list[schemas.Message], model: chat_models.chat_model.ChatModel, tools: dict[str, schemas.ToolConfig], user_id: UUID4, assistant_id: UUID4) -> tuple[list[tuple[schemas.Message, UUID4]], int]:
+    """Get a model's response to a history, following its tool calls.
+
+    Returns:
+        tuple[list[tuple[schemas.Message, UUID4]], int]: The messages to write after the history, each with its sender:
+            any tool calls and their results, then the candidate responses. And the index of the (selected) response.
+    """
+    new_messages = []
+    messages = list(messages)
+    n = model.get_candidate_count()
+    while True:
+        started = time.monotonic()
+        candidates = model.chat_candidates(messages, n)
+        latency_ms = elapsed_ms(started)
+        for candidate in candidates:
+            candidate.usage = (candidate.usage or schemas.Usage()).model_copy(update={'latency_ms': latency_ms})
+        response_msg = candidates[0]
+        messages.append(response_msg)
+        if not response_msg.has_tool_calls():
+            # only the first candidate's tool calls are followed, so other candidates that call tools are dropped
+            candidates = [c for c in candidates if not c.has_tool_calls()]
+            mark_candidates(candidates)
+            response_index = len(new_messages)
+            new_messages.extend((candidate, assistant_id) for candidate in candidates)
+            return new_messages, response_index
+        new_messages.append((response_msg, assistant_id))
+        tool_msg = handle_tool_calls(response_msg, tools)
+        new_messages.append((tool_msg, user_id))
+        messages.append(tool_msg)
 
 @router.post('/{chat_id}/', response_model=schemas.MessageView)
-def send_message(chat_id: UUID4, current_user: schemas.User = Depends(dependencies.get_current_user), message: schemas.Message = Depends(dependencies.save_files), db: data.Session = Depends(dependencies.get_db), db_chat: data.models.Chat = Depends(dependencies.get_chat), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_model), assistant_user = Depends(dependencies.get_assistant_user), tools = Depends(dependencies.get_tools)):
-    chat: schemas.ChatFull = schemas.ChatFull.model_validate(db_chat, from_attributes=True)
+def send_message(chat_id: UUID4, current_user: schemas.User = Depends(dependencies.get_current_user), message: schemas.Message = Depends(dependencies.save_files), db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatFull = Depends(dependencies.get_chat_history), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_model), assistant_user = Depends(dependencies.get_assistant_user), tools = Depends(dependencies.get_tools)):
     
     model, _ = model_with_config
-    
-    db_msgs = []
+    history = chat.get_history()
     
     try:
-        db_msg = data.crud.create_message(db=db, message=message, user_id=current_user.id, chat_id=chat_id)
-        db_msgs.append(db_msg)
-        messages = chat.messages + [message]
-        while True:
-            response_msg = model.chat(messages)
-            messages.append(response_msg)
-            msg = data.crud.create_message(db=db, message=response_msg, user_id=cast(UUID4, assistant_user.id), chat_id=chat_id)
-            db_msgs.append(msg)
-            if not response_msg.has_tool_calls():
-                break
-            db_msg = handle_tool_calls(response_msg, current_user.id, chat_id, db, tools)
-            db_msgs.append(db_msg)
-            tool_msg = schemas.Message.model_validate(db_msg, from_attributes=True)
-            messages.append(tool_msg)
-        if chat.title == 'New Chat':
-            autogen_chat_title(db, chat_id, chat.messages + [message, response_msg], model)
-        return msg
+        # nothing is written until the model has responded, so a failure leaves no partial exchange behind
+        responses, response_index = get_response(history + [message], model, tools, current_user.id, cast(UUID4, assistant_user.id))
+        new_messages = [(message, current_user.id)] + responses
+        # appended after the history the model saw, even if another request added to the chat in the meantime
+        parent_id = history[-1].id if history else None
+        msg = data.crud.create_messages(db=db, messages=new_messages, chat_id=chat_id, parent_id=parent_id)[response_index + 1]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if chat.title == 'New Chat':
+        try:
+            autogen_chat_title(db, chat_id, history + [message, responses[response_index][0]], model)
+        except Exception:
+            # the exchange is already saved, so a failed title only leaves the default one
+            logging.exception('Failed to generate chat title')
+    return msg
+
+@router.post('/{chat_id}/messages/{message_id}/edit', response_model=schemas.MessageView)
+def edit_message(message_id: UUID4, current_user: schemas.User = Depends(dependencies.get_current_user), message: schemas.Message = Depends(dependencies.save_files), db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_edit_model), assistant_user = Depends(dependencies.get_assistant_user), tools = Depends(dependencies.get_tools)):
+    """Send a new version of one of the user's messages. It starts a new branch after the messages the original follows,
+    which becomes the active one, and gets a response there. The original stays on its own branch, along with everything
+    that followed it.
+    """
+    model, _ = model_with_config
+    history = data.crud.get_branch_history(db, chat_id=chat.id, message_id=message_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail='Message not found')
+    if history[-1].role != Role.USER:
+        raise HTTPException(status_code=400, detail='Only user messages can be edited')
+    history = history[:-1]
+    # ends the read, so no transaction is held through the model call
+    db.commit()
+    try:
+        responses, response_index = get_response(history + [message], model, tools, current_user.id, cast(UUID4, assistant_user.id))
+        new_messages = [(message, current_user.id)] + responses
+        # the first message of a chat without a system prompt is edited into a new root
+        parent_id = history[-1].id if history else None
+        return data.crud.create_messages(db=db, messages=new_messages, chat_id=chat.id, parent_id=parent_id, root=not history)[response_index + 1]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post('/{chat_id}/messages/{message_id}/regenerate', response_model=schemas.MessageView)
+def regenerate_message(message_id: UUID4, current_user: schemas.User = Depends(dependencies.get_current_user), db: data.Session = Depends(dependencies.get_db), chat: schemas.ChatView = Depends(dependencies.get_chat), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_response_model), assistant_user = Depends(dependencies.get_assistant_user), tools = Depends(dependencies.get_tools)):
+    """Get a new response from any point of a chat, on a new branch that becomes the active one. Regenerating an assistant
+    message responds again to the messages it follows, so the new response sits next to it; regenerating any other
+    message responds to it. Pass `model` to use another model than the chat's default.
+    """
+    model, _ = model_with_config
+    history = data.crud.get_branch_history(db, chat_id=chat.id, message_id=message_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail='Message not found')
+    if history[-1].role == Role.ASSISTANT:
+        history = history[:-1]
+    if not history or history[-1].role == Role.SYSTEM:
+        raise HTTPException(status_code=400, detail='There is no message to respond to')
+    # ends the read, so no transaction is held through the model call
+    db.commit()
+    try:
+        responses, response_index = get_response(history, model, tools, current_user.id, cast(UUID4, assistant_user.id))
+        return data.crud.create_messages(db=db, messages=responses, chat_id=chat.id, parent_id=history[-1].id)[response_index]
     except Exception as e:
-        # rollback messages
-        for db_msg in db_msgs:
-            data.crud.delete_message(db=db, message_id=cast(UUID4, db_msg.id))
         raise HTTPException(status_code=400, detail=str(e))
      
 stream_manager = ChatStreamManager()
    
 def handle_stream(chat_id: UUID4, message: schemas.Message, chat: schemas.ChatFull, model: chat_models.chat_model.StreamingChatModel, user_msg_id: UUID4):
-    """Process a stream of tokens from a chat model and update the message in the database when the stream ends
+    """Process a stream of tokens from a chat model and save the responses to the database when the stream ends
 
     Args:
 
@@ -151,66 +304,85 @@ def handle_stream(chat_id: UUID4, message: schemas.Message, chat: schemas.ChatFu
         str: The tokens from the stream
     """
     
-    stream_manager.reset_chat(chat_id)
+    n = model.get_candidate_count()
+    for i in range(n):
+        stream_manager.reset_chat(chat_id, i)
     
-    stream = model.chat_stream(chat.messages + [message])
+    # candidates are streamed in parallel, each to its own stream
+    started = time.monotonic()
+    first_token_at = {}
+    last_token_at = {}
+    stream = StreamResult(model.chat_stream_candidates(chat.get_history() + [message], n))
 
-    while True:
-        try:
-            token = next(stream)
-        except StopIteration:
-            break
+    for candidate, token in stream:
         if token is None:
-            break
-        asyncio.run(stream_manager.send_message(chat_id, token))
+            continue
+        last_token_at[candidate] = time.monotonic()
+        first_token_at.setdefault(candidate, last_token_at[candidate])
+        asyncio.run(stream_manager.send_message(chat_id, token, candidate))
+    ended = time.monotonic()
         
-    asyncio.run(stream_manager.end_message(chat_id))
-    message_txt = stream_manager.get_full_message(chat_id)
-    new_message = schemas.MessageBuilder(role=Role.ASSISTANT, model=model.api_name).add_text(message_txt).build()
+    for i in range(n):
+        asyncio.run(stream_manager.end_message(chat_id, i))
+    new_messages = [schemas.MessageBuilder(role=Role.ASSISTANT, model=model.api_name).add_text(stream_manager.get_full_message(chat_id, i)).build() for i in range(n)]
+    usages = stream.value or {}
+    for i, new_message in enumerate(new_messages):
+        new_message.usage = (usages.get(i) or schemas.Usage()).model_copy(update={
+            'time_to_first_token_ms': elapsed_ms(started, first_token_at[i]) if i in first_token_at else None,
+            'latency_ms': elapsed_ms(started, last_token_at.get(i, ended)),
+        })
+    mark_candidates(new_messages)
     db = next(dependencies.get_db())
     try:
-        assistant_user = dependencies.get_assistant_user(db=db)
-        data.crud.create_message(db=db, message=new_message, user_id=cast(UUID4, assistant_user.id), chat_id=chat_id)
+        assistant_user = dependencies.get_assistant_user()
+        try:
+            data.crud.create_messages(db=db, messages=[(new_message, cast(UUID4, assistant_user.id)) for new_message in new_messages], chat_id=chat_id)
+        except Exception as e:
+            # the user's message was saved by the request that started the stream, so it has to be removed separately;
+            # only when the responses weren't written, since deleting it also deletes the messages that follow it
+            data.crud.delete_message(db=db, message_id=user_msg_id)
+            for i in range(n):
+                stream_manager.reset_chat(chat_id, i)
+            raise HTTPException(status_code=400, detail=str(e))
         if chat.title == 'New Chat':
-            autogen_chat_title(db, chat_id, chat.messages + [new_message], model)
-    except Exception as e:
-        data.crud.delete_message(db=db, message_id=user_msg_id)
-        stream_manager.reset_chat(chat_id)
-        raise HTTPException(status_code=400, detail=str(e))
+            try:
+                autogen_chat_title(db, chat_id, chat.get_history() + [new_messages[0]], model)
+            except Exception:
+                # the exchange is already saved, so a failed title only leaves the default one
+                logging.exception('Failed to generate chat title')
     finally:
         print('finished streaming, closing db')
         db.close()
         return
 
 @router.post('/{chat_id}/stream/', response_model=dict)
-async def send_message_stream(background_tasks: BackgroundTasks, chat_id: UUID4, message = Depends(dependencies.save_files), db: data.Session = Depends(dependencies.get_db), db_chat: data.models.Chat = Depends(dependencies.get_chat), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_model)):
-    chat: schemas.ChatFull = schemas.ChatFull.model_validate(db_chat, from_attributes=True)
+def send_message_stream(background_tasks: BackgroundTasks, chat_id: UUID4, message = Depends(dependencies.save_files), db: data.Session = Depends(dependencies.get_db), current_user: schemas.User = Depends(dependencies.get_current_user), chat: schemas.ChatFull = Depends(dependencies.get_chat_history), model_with_config: tuple[chat_models.chat_model.ChatModel, schemas.ModelConfig] = Depends(dependencies.get_model)):
     model, _ = model_with_config
 
     if not isinstance(model, chat_models.StreamingChatModel):
         raise HTTPException(status_code=400, detail='Model does not support streaming')
     
-    db_msg = data.crud.create_message(db=db, message=message, user_id=uuid.UUID("c0aba09b-f57e-4998-bee6-86da8b796c5b"), chat_id=chat_id)
+    # a sync route, so that writing the message (a transaction of several statements) runs in the threadpool
+    db_msg = data.crud.create_message(db=db, message=message, user_id=current_user.id, chat_id=chat_id)
     
-    background_tasks.add_task(handle_stream, chat_id, message, chat, model, cast(UUID4, db_msg.id))
+    background_tasks.add_task(handle_stream, chat_id, message, chat, model, db_msg.id)
     
     return {'message': 'Stream started'}
     
 @router.websocket('/{chat_id}/stream')
-async def consume_chat_stream(websocket: WebSocket, chat_id: UUID4, token: str = Query()):
-    db = next(dependencies.get_db())
-    current_user = await dependencies.get_current_user(token=token, db=db, req_type='websocket')
-    await dependencies.get_chat(chat_id=chat_id, db=db, current_user=current_user)
-    db.close()
+async def consume_chat_stream(websocket: WebSocket, chat_id: UUID4, token: str = Query(), candidate: int = Query(0)):
+    async with data.AsyncSessionLocal() as db:
+        current_user = await dependencies.get_current_user(token=token, db=db, req_type='websocket')
+        await dependencies.get_chat(chat_id=chat_id, db=db, current_user=current_user, req_type='websocket')
     await websocket.accept()
     try:
-        await websocket.send_text(stream_manager.get_full_message(chat_id))
+        await websocket.send_text(stream_manager.get_full_message(chat_id, candidate))
         while True:
-            if stream_manager.chat_has_message(chat_id):
-                msg = await stream_manager.consume_message(chat_id)
+            if stream_manager.chat_has_message(chat_id, candidate):
+                msg = await stream_manager.consume_message(chat_id, candidate)
                 await websocket.send_text(msg)
                 if msg == 'END MESSAGE':
-                    stream_manager.reset_chat(chat_id)
+                    stream_manager.reset_chat(chat_id, candidate)
             else:
                 await asyncio.sleep(0.1)
     except WebSocketDisconnect:
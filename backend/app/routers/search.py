@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app import data, schemas, dependencies
+from app.util import encode_cursor, decode_cursor
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get('/', response_model=schemas.SearchResults)
+def search(q: str = Query(min_length=1, max_length=512), limit: int = Query(20, ge=1, le=100), cursor: str | None = None, db: data.Session = Depends(dependencies.get_read_db), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """Search the current user's chat titles and messages.
+    Pass the `next_cursor` of a page as `cursor` to get the next page.
+    """
+    offset = 0
+    if cursor is not None:
+        try:
+            offset = int(decode_cursor(cursor, 1)[0])
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        if offset < 0:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+    hits, has_more = data.crud.search_chats(db, current_user.id, q, limit, offset)
+    next_cursor = encode_cursor(str(offset + limit)) if has_more else None
+    return schemas.SearchResults(hits=hits, next_cursor=next_cursor)
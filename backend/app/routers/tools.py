@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app import dependencies
 from app.schemas.tools import ToolConfig
+from app.tool_sandbox import ToolResourceLimitError
 
 router = APIRouter(
     prefix="/tools",
@@ -20,8 +21,15 @@ def read_tool(tool_name: str, tools: dict[str, ToolConfig] = Depends(dependencie
     return tools[tool_name]
 
 @router.post('/{tool_name}', response_model=dict)
-def run_tool(tool_name: str, tool_input: dict, tools: dict[str, ToolConfig] = Depends(dependencies.get_tools)):
+async def run_tool(tool_name: str, tool_input: dict, tools: dict[str, ToolConfig] = Depends(dependencies.get_tools)):
+    """Run a tool with the given arguments, the same way a model's tool calls are run: with the user's API key,
+    through the result cache, and in the sandbox if the tool opts in to it.
+    """
     if tool_name not in tools:
         raise HTTPException(status_code=404, detail='Tool not found')
     tool = tools[tool_name]
-    return tool.func(tool_input)
\ No newline at end of file
+    try:
+        result, result_metadata = await tool.run(**tool_input)
+    except (TypeError, ValueError, ToolResourceLimitError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'result': result, 'result_metadata': result_metadata}
\ No newline at end of file
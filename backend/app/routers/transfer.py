@@ -0,0 +1,43 @@
+import io
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from app import data, schemas, dependencies, transfer
+
+router = APIRouter(
+    prefix="/transfer",
+    tags=["transfer"],
+    responses={404: {"description": "Not found"}},
+)
+
+def get_read_session_factory(request: Request, current_user: schemas.User = Depends(dependencies.get_current_user)):
+    # exports open their own session once the response starts streaming, rather than using one from `get_read_db`
+    return data.SessionLocal if dependencies.reads_need_primary(request, current_user) else data.ReadSessionLocal
+
+@router.get('/export')
+def export_chats(make_session = Depends(get_read_session_factory), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """Stream all of the user's chats, with their messages and contents, as NDJSON (see `app.transfer`).
+    """
+    return StreamingResponse(
+        transfer.export_chats(make_session, current_user.id),
+        media_type='application/x-ndjson',
+        headers={'Content-Disposition': 'attachment; filename="chats.ndjson"'},
+    )
+
+@router.get('/export/uploads')
+def export_uploads(make_session = Depends(get_read_session_factory), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """Stream the files uploaded to the user's chats as a tar archive.
+    """
+    return StreamingResponse(
+        transfer.export_uploads(make_session, current_user.id),
+        media_type='application/x-tar',
+        headers={'Content-Disposition': 'attachment; filename="uploads.tar"'},
+    )
+
+@router.post('/import', response_model=schemas.ImportReport)
+def import_chats(chats: UploadFile, uploads: UploadFile | None = None, db: data.Session = Depends(dependencies.get_db), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """Import an export made by `/transfer/export` (and optionally its uploads archive) into the user's account, as new chats.
+    """
+    try:
+        return transfer.import_chats(db, current_user.id, io.TextIOWrapper(chats.file, encoding='utf-8'), uploads.file if uploads is not None else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
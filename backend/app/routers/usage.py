@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+from typing import Literal
+import datetime
+from app import data, schemas, dependencies
+
+router = APIRouter(
+    prefix="/usage",
+    tags=["usage"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get('/', response_model=list[schemas.UsageRollup])
+def read_usage(granularity: Literal['hour', 'day'] = 'day', start: datetime.datetime | None = None, end: datetime.datetime | None = None, model: str | None = None, db: data.Session = Depends(dependencies.get_read_db), current_user: schemas.User = Depends(dependencies.get_current_user)):
+    """Get the current user's token usage and response latency per model, by hour or by day, oldest first.
+    Periods start at UTC hours or midnights; `start` and `end` (UTC) select the periods starting in [start, end).
+    Only the rollups are read, so the cost of this doesn't depend on the number of messages.
+    """
+    return data.crud.get_usage(db, current_user.id, granularity, start, end, model)
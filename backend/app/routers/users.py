@@ -13,7 +13,7 @@ router = APIRouter(
 )
 
 @router.post('/', response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: data.Session = Depends(dependencies.get_db)):
+async def create_user(user: schemas.UserCreate, db: data.AsyncSession = Depends(dependencies.get_async_db)):
     """Create a new user
 
     Args:
@@ -25,10 +25,11 @@ def create_user(user: schemas.UserCreate, db: data.Session = Depends(dependencie
     Returns:
         schemas.User: The newly created user
     """
-    db_user = data.crud.get_user_by_email(db, email=user.email)
+    db_user = await data.async_crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail='Email already registered')
-    return data.crud.create_user(db=db, user=user)
+    db_user = await data.async_crud.create_user(db=db, user=user)
+    return schemas.User(id=db_user.id, email=db_user.email)
 
 def create_access_token(data: dict, expires_delta: datetime.timedelta | None = None):
     """Create a JWT access token
@@ -56,9 +57,9 @@ class Token(BaseModel):
 
 @router.post("/token")
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: data.Session = Depends(dependencies.get_db)
+    form_data: OAuth2PasswordRequestForm = Depends(), db: data.AsyncSession = Depends(dependencies.get_async_db)
 ) -> Token:
-    user = data.auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await data.auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -3,4 +3,7 @@ from .user import *
 from .chat import *
 from .message import *
 from .api_key import *
-from .tools import *
\ No newline at end of file
+from .tools import *
+from .search import *
+from .transfer import *
+from .usage import *
\ No newline at end of file
@@ -26,13 +26,30 @@ class ChatView(Chat):
     id: UUID4
     user_id: UUID4
     created_at: datetime.datetime
+    version: int = 0
+    message_count: int = 0
+    last_message_at: datetime.datetime | None = None
+    last_preview: str | None = None
+    total_tokens: int = 0
     
     class Config:
         orm_mode = True
 
+class ChatPage(BaseModel):
+    """A page of a user's chats, most recently active first.
+    `next_cursor` points at the next page, or is None if there are no more chats.
+    """
+    chats: list[ChatView]
+    next_cursor: str | None = None
+
 class ChatFull(ChatView):
     messages: list[MessageView] = []
     
     class Config:
         orm_mode = True
         
+    def get_history(self) -> list[MessageView]:
+        """Get the messages to send to a model, i.e. those on the chat's active branch.
+        """
+        return [m for m in self.messages if m.selected]
+        
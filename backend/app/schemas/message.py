@@ -1,7 +1,8 @@
-from pydantic import BaseModel, UUID4, field_validator
+from pydantic import BaseModel, Field, UUID4, field_validator
 from util import MessageContentType, Role
 import datetime
 from app.chat_models.model_config import model_config_type
+from app.schemas.usage import Usage
 from app.schemas.message_content import MessageContent, ToolCall, message_content_type, TextMessageContent, ImageMessageContent, ToolCallMessageContent, ToolResultMessageContent
 
 
@@ -11,6 +12,16 @@ class Message(BaseModel):
     contents: list[message_content_type]
     model: str | None = None
     config: model_config_type | None = None
+    # the message this one follows; set when the message is written, to the head of the branch it is added to
+    parent_id: UUID4 | None = None
+    # alternative responses generated together share a candidate group, and a parent
+    candidate_group: UUID4 | None = None
+    candidate_index: int | None = None
+    # whether the message is on the chat's active branch; only those are part of the history
+    selected: bool = True
+    # set by the model (token counts) and the router (timings) on new responses; it is written to `message_usage`
+    # and the usage rollups, but never loaded or returned with the message
+    usage: Usage | None = Field(default=None, exclude=True)
     
     class Config:
         use_enum_values = True
@@ -33,6 +44,27 @@ class MessageFull(MessageView):
     class Config:
         orm_mode = True
 
+class MessagePage(BaseModel):
+    """A page of a chat's history, oldest first.
+    `next_cursor` points at the page of older messages, or is None if this page reaches the start of the chat.
+    """
+    messages: list[MessageView]
+    next_cursor: str | None = None
+
+class Branch(BaseModel):
+    """A branch of a chat, identified by its head: a message that no other message follows.
+    """
+    head_id: UUID4
+    parent_id: UUID4 | None
+    role: Role
+    created_at: datetime.datetime
+    # whether this is the chat's active branch
+    active: bool
+    preview: str | None = None
+    
+    class Config:
+        use_enum_values = True
+
 class MessageBuilder:
     """
     A helper class for building messages. This class makes it easier to create messages with multiple content items.
@@ -63,8 +95,8 @@ class MessageBuilder:
         self.contents.append(ImageMessageContent(content=content, image_type=file_type, type=MessageContentType.FILE))
         return self
     
-    def add_tool_result(self, content: dict, tool_call_id: str):
-        self.contents.append(ToolResultMessageContent(content=content, tool_call_id=tool_call_id))
+    def add_tool_result(self, content: dict, tool_call_id: str, result_metadata: dict | None = None, compact_content: object | None = None):
+        self.contents.append(ToolResultMessageContent(content=content, tool_call_id=tool_call_id, result_metadata=result_metadata, compact_content=compact_content))
         return self
     
     def add_tool_use(self, id: str, name: str, args: dict):
@@ -13,6 +13,11 @@ class MessageContent(BaseModel):
     """
     type: MessageContentType
     content: str | dict
+    # set on contents loaded from the database
+    id: UUID4 | None = None
+    # set when `content` is only a preview of a content this many bytes long, stored out of line;
+    # the full content is served by GET /chat/{chat_id}/contents/{id}
+    content_size: int | None = None
     
     class Config:
         use_enum_values = True
@@ -73,10 +78,16 @@ class ToolResultMessageContent(MessageContent):
     """
     A message content item that represents the result of a tool operation.
     Content should be a dictionary whose structure is defined by the tool.
+    If the tool compacts its results, compact_content holds the version that is sent to models, while content keeps the full result.
     """
     type: Literal[MessageContentType.TOOL_RESULT] = MessageContentType.TOOL_RESULT
     content: object
     tool_call_id: str
+    result_metadata: dict | None = None
+    compact_content: object | None = None
+    
+    def get_model_content(self):
+        return self.compact_content if self.compact_content is not None else self.content
     
 class ToolCall(BaseModel):
     name: str
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, UUID4
+import datetime
+
+class SearchHit(BaseModel):
+    chat_id: UUID4
+    chat_title: str
+    # None when the hit is the chat's title rather than one of its messages
+    message_id: UUID4 | None = None
+    # the matching text as HTML: escaped, with only the matched words wrapped in <mark> tags
+    snippet: str
+    rank: float
+    created_at: datetime.datetime
+
+class SearchResults(BaseModel):
+    """A page of search results, best match first.
+    `next_cursor` points at the next page, or is None if there are no more results.
+    """
+    hits: list[SearchHit]
+    next_cursor: str | None = None
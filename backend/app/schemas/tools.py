@@ -1,5 +1,6 @@
 from typing import Callable, Any
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, ValidatorFunctionWrapHandler, model_validator
+from fastapi.concurrency import run_in_threadpool
 from app.util import ToolAPI
 import inspect
 from enum import Enum
@@ -10,7 +11,95 @@ class ToolParameter(BaseModel):
     description: str
     enum: list[str] | None = None
     
+    class Config:
+        frozen = True
+    
+class ToolResultCompaction(BaseModel):
+    """
+    Describes how to shrink a tool result before it is injected into a model's context.
+    List results are ranked and cut down to the top items; dict items are projected onto the given fields;
+    long strings are truncated. With `summary`, the items that were cut are listed in a short summary instead,
+    each by its `summary_fields` (e.g. the title and URL of a search result), so the model knows what else was found.
+    The full result is still stored for the UI.
+    """
+    fields: list[str] | None = None
+    max_chars: int | None = None
+    top_k: int | None = None
+    score_field: str = 'score'
+    summary: bool = False
+    summary_fields: list[str] = ['title', 'url']
+    # the most dropped items named in the summary, and the most characters each one is named with
+    summary_max_items: int = 10
+    summary_item_chars: int = 120
+    
+    class Config:
+        frozen = True
+    
+    def apply(self, result: Any) -> Any:
+        """Compact a tool result.
+
+        Args:
+            result (Any): The raw tool result
+
+        Returns:
+            Any: The compacted result. If `summary` is set and items were dropped, a dict of the form {'results': list, 'summary': str}.
+        """
+        if not isinstance(result, list):
+            return self._compact_item(result)
+        items = result
+        dropped = []
+        if self.top_k is not None:
+            ranked = sorted(items, key=lambda item: (item.get(self.score_field) or 0) if isinstance(item, dict) else 0, reverse=True)
+            items, dropped = ranked[:self.top_k], ranked[self.top_k:]
+        items = [self._compact_item(item) for item in items]
+        if self.summary and dropped:
+            return {'results': items, 'summary': self._summarize(len(items), dropped)}
+        return items
+    
+    def _summarize(self, kept: int, dropped: list) -> str:
+        names = [self._name_item(item) for item in dropped[:self.summary_max_items]]
+        summary = f'Showing the top {kept} of {kept + len(dropped)} results. The others were: ' + '; '.join(names)
+        if len(dropped) > len(names):
+            summary += f'; and {len(dropped) - len(names)} more'
+        return summary
+    
+    def _name_item(self, item: Any) -> str:
+        if isinstance(item, dict):
+            parts = [str(item[field]) for field in self.summary_fields if item.get(field)]
+            name = ' - '.join(parts) if parts else str(item)
+        else:
+            name = str(item)
+        name = ' '.join(name.split())
+        return name[:self.summary_item_chars] + '...' if len(name) > self.summary_item_chars else name
+    
+    def _compact_item(self, item: Any) -> Any:
+        if isinstance(item, dict):
+            if self.fields is not None:
+                item = {k: v for k, v in item.items() if k in self.fields}
+            return {k: self._truncate(v) for k, v in item.items()}
+        return self._truncate(item)
+    
+    def _truncate(self, value: Any) -> Any:
+        if self.max_chars is not None and isinstance(value, str) and len(value) > self.max_chars:
+            return value[:self.max_chars] + '...'
+        return value
+    
+class SandboxLimits(BaseModel):
+    """
+    Resource limits for a tool that runs in the sandbox worker pool (see `app.tool_sandbox`).
+    """
+    cpu_seconds: float = 5
+    memory_mb: int = 512
+    
+    class Config:
+        frozen = True
+    
 class ToolConfig(BaseModel):
+    """
+    The schema and implementation of a tool. Instances are immutable: the registry in `app.tools` compiles
+    one instance per tool at startup, and requests get a lightweight copy bound to the user's API key via `bind`.
+    """
+
     name: str
     description: str
     parameters: dict[str, ToolParameter]
@@ -19,38 +108,94 @@ class ToolConfig(BaseModel):
     api_key: str | None = Field(exclude=True, default=None)
     api_provider: ToolAPI | None = None
     requires_api_key: bool = False
+    cacheable: bool = Field(exclude=True, default=False)
+    cache_ttl: float = Field(exclude=True, default=300)
+    cache_key: Callable[[str, dict], str] | None = Field(exclude=True, default=None)
+    compaction: ToolResultCompaction | None = Field(exclude=True, default=None)
+    sandbox: SandboxLimits | None = Field(exclude=True, default=None)
+    
+    class Config:
+        frozen = True
     
     def __call__(self, *args: Any, **kwds: Any) -> Any:
+        """Call the tool directly, bypassing the result cache. Async callers should use `run`.
+        """
+        if self.requires_api_key and self.api_key is None:
+            raise ValueError('This tool requires an API key')
+        return self._call_func(*args, **kwds)
+    
+    async def run(self, *args: Any, **kwds: Any) -> tuple[Any, dict]:
+        """Run the tool, using a cached result if the tool is cacheable and has been called with the same arguments recently.
+        The tool function itself blocks (on the network, or on the sandbox), so it runs in the threadpool.
+
+        Returns:
+            tuple[Any, dict]: The tool result, and metadata about how it was produced (e.g. whether it was a cache hit)
+        """
         if self.requires_api_key and self.api_key is None:
             raise ValueError('This tool requires an API key')
+        if not self.cacheable or len(args) > 0:
+            return await run_in_threadpool(self._call_func, *args, **kwds), {'cached': False}
+        from app.tool_cache import tool_result_cache, default_cache_key
+        key = (self.cache_key or default_cache_key)(self.name, kwds)
+        found, result, tier = await tool_result_cache.get(key)
+        if found:
+            return result, {'cached': True, 'cache_tier': tier}
+        result = await run_in_threadpool(self._call_func, **kwds)
+        await tool_result_cache.set(key, self.name, result, ttl=self.cache_ttl)
+        return result, {'cached': False}
+    
+    def _call_func(self, *args: Any, **kwds: Any) -> Any:
         if self.requires_api_key:
             kwds['api_key'] = self.api_key
+        if self.sandbox is not None:
+            from app.tool_sandbox import tool_sandbox
+            return tool_sandbox.run(self.func, args, kwds, cpu_seconds=self.sandbox.cpu_seconds, memory_mb=self.sandbox.memory_mb)
         return self.func.__call__(*args, **kwds)
     
-    def set_api_key(self, api_key: str):
-        self.api_key = api_key
+    def compact(self, result: Any) -> Any | None:
+        """Compact a result of this tool for use in a model's context.
+
+        Returns:
+            Any | None: The compacted result, or None if this tool does not define a compaction
+        """
+        if self.compaction is None:
+            return None
+        return self.compaction.apply(result)
+    
+    def bind(self, api_key: str) -> 'ToolConfig':
+        """Return a copy of this tool bound to the given API key. The compiled tool itself is never modified.
+        """
+        return self.model_copy(update={'api_key': api_key})
     
-    @model_validator(mode='before')
+    @model_validator(mode='wrap')
     @classmethod
-    def populate_func(cls, data: Any) -> Any:
-        from app.tools import get_tools
-        if 'func' not in data:
-            tool = get_tools().get(data['name'])
-            if tool is None:
-                raise ValueError(f'No tool found with name {data["name"]}')
-            data['func'] = tool.func
-        return data
+    def populate_func(cls, data: Any, handler: ValidatorFunctionWrapHandler) -> Any:
+        # tools deserialized from a stored config (which never includes the function) resolve
+        # to the compiled registry entry, so no schema introspection or re-validation is needed
+        if isinstance(data, dict) and 'func' not in data:
+            return cls.from_name(data['name'])
+        return handler(data)
     
     @classmethod
-    def from_name(cls, name):
+    def from_name(cls, name) -> 'ToolConfig':
         from app.tools import get_tools
         tool = get_tools().get(name)
         if tool is None:
             raise ValueError(f'No tool found with name {name}')
-        return cls(name=name, description=tool.description, parameters=tool.parameters, required=tool.required, func=tool.func)
+        return tool
     
     @classmethod
-    def from_func(cls, func):
+    def from_func(cls, func, cacheable: bool = False, cache_ttl: float = 300, cache_key: Callable[[str, dict], str] | None = None, compaction: ToolResultCompaction | None = None, sandbox: SandboxLimits | None = None):
+        """Build a tool config from a documented function.
+
+        Args:
+            func (Callable): The tool function. Each parameter must be documented in the `Args:` section of its docstring.
+            cacheable (bool, optional): Whether results can be reused for identical arguments. Only set this for idempotent tools. Defaults to False.
+            cache_ttl (float, optional): How long, in seconds, a cached result stays valid. Defaults to 300.
+            cache_key (Callable[[str, dict], str] | None, optional): Builds the cache key from the tool name and arguments. Defaults to None (hash of all arguments).
+            compaction (ToolResultCompaction | None, optional): How to compact results before they are sent to a model. Defaults to None (results are sent whole).
+            sandbox (SandboxLimits | None, optional): If set, the tool runs in the sandbox worker pool with these limits. The function must be picklable (i.e. defined at module level). Defaults to None (runs in-process).
+        """
         sig = inspect.signature(func)
         params = {}
         required = []
@@ -93,7 +238,12 @@ class ToolConfig(BaseModel):
             'description': description,
             'parameters': params,
             'required': required,
-            'func': func
+            'func': func,
+            'cacheable': cacheable,
+            'cache_ttl': cache_ttl,
+            'cache_key': cache_key,
+            'compaction': compaction,
+            'sandbox': sandbox
         }
         if 'api_key' in sig.parameters:
             kwargs['requires_api_key'] = True
@@ -0,0 +1,41 @@
+from pydantic import BaseModel, Field, TypeAdapter, UUID4
+from typing import Annotated, Literal, Union
+import datetime
+from app.chat_models.model_config import model_config_type
+from app.schemas.chat import Chat
+from app.schemas.message import Message
+
+# bumped whenever the export format changes in a way older imports can't read
+# 2: messages have a parent_id; chats of older exports are imported as not linked (see `Chat.messages_linked`)
+EXPORT_FORMAT_VERSION = 2
+
+class ExportHeader(BaseModel):
+    """The first line of an export."""
+    type: Literal['export'] = 'export'
+    version: int = EXPORT_FORMAT_VERSION
+    exported_at: datetime.datetime
+
+class ExportedChat(Chat):
+    """A chat in an export, followed (after all chats) by its messages."""
+    type: Literal['chat'] = 'chat'
+    id: UUID4
+    # None for chats stored without a config; they are imported with their model's default config
+    config: model_config_type | None = None
+    created_at: datetime.datetime
+
+class ExportedMessage(Message):
+    """A message in an export, with all of its contents in full. Messages of a chat are exported oldest first."""
+    type: Literal['message'] = 'message'
+    id: UUID4
+    chat_id: UUID4
+    created_at: datetime.datetime
+
+export_record_adapter = TypeAdapter(Annotated[Union[ExportHeader, ExportedChat, ExportedMessage], Field(discriminator='type')])
+
+class ImportReport(BaseModel):
+    """What an import added: chats and messages, and files extracted from an uploads archive.
+    `skipped` counts messages of chats that weren't in the export."""
+    chats: int = 0
+    messages: int = 0
+    uploads: int = 0
+    skipped: int = 0
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, Field
+import datetime
+
+class Usage(BaseModel):
+    """The token counts and timings of the model call that produced a response.
+    Token counts are None when the API doesn't report them.
+    """
+    prompt_tokens: int | None = Field(default=None, ge=0)
+    completion_tokens: int | None = Field(default=None, ge=0)
+    # of the prompt tokens, those read from the provider's prompt cache
+    cached_tokens: int | None = Field(default=None, ge=0)
+    # only measured for streamed responses
+    time_to_first_token_ms: int | None = Field(default=None, ge=0)
+    latency_ms: int | None = Field(default=None, ge=0)
+
+class UsageRollup(BaseModel):
+    """The usage of one model by the current user over an hour or a day, starting at `period_start` (UTC).
+    Latencies are totals; divide by `responses` (or `streamed_responses` for the time to the first token) for the mean.
+    """
+    model: str
+    period_start: datetime.datetime
+    responses: int
+    streamed_responses: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    latency_ms: int
+    time_to_first_token_ms: int
+
+    class Config:
+        orm_mode = True
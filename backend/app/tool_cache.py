@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from app.config import config
+
+
+class LRUCache:
+    """A thread-safe, bounded LRU cache whose entries can optionally expire after a TTL.
+
+    Args:
+        max_size (int): The maximum number of entries to keep. The least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float | None, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """Look up a key in the cache.
+
+        Returns:
+            tuple[bool, Any]: Whether the key was found, and the cached value if so
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: str, value: Any, ttl: float | None = None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def values(self) -> list[Any]:
+        """Get the values of all unexpired entries, without marking them as used.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [value for expires_at, value in self._entries.values() if expires_at is None or expires_at > now]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def default_cache_key(tool_name: str, args: dict) -> str:
+    """Build a cache key from the tool name and its (JSON-serializable) arguments.
+    The API key is never part of the arguments, so results can be shared between users.
+    """
+    payload = json.dumps(args, sort_keys=True, default=str)
+    return tool_name + ':' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ToolResultCache:
+    """A two-tier cache for the results of idempotent tools.
+    Results are first looked up in a per-process LRU, then (if enabled) in the shared `tool_result_cache` table,
+    which is read and written with async sessions so that the tool path never blocks on the database.
+
+    Args:
+        max_size (int): The size of the in-memory tier.
+        shared (bool): Whether to also use the database-backed tier, which is shared by all workers.
+    """
+
+    def __init__(self, max_size: int = 1024, shared: bool = False):
+        self.memory = LRUCache(max_size)
+        self.shared = shared
+
+    async def get(self, key: str) -> tuple[bool, Any, str | None]:
+        """Look up a tool result.
+
+        Returns:
+            tuple[bool, Any, str | None]: Whether the result was found, the result, and the tier it was found in ('memory' or 'shared')
+        """
+        found, value = self.memory.get(key)
+        if found:
+            return True, value, 'memory'
+        if not self.shared:
+            return False, None, None
+        from app import data
+        async with data.AsyncSessionLocal() as db:
+            entry = await data.async_crud.get_tool_result(db, key)
+            if entry is None:
+                return False, None, None
+            expires_at = entry.expires_at if entry.expires_at.tzinfo is not None else entry.expires_at.replace(tzinfo=datetime.timezone.utc)
+            remaining = (expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            self.memory.set(key, entry.result, ttl=remaining)
+            return True, entry.result, 'shared'
+
+    async def set(self, key: str, tool_name: str, value: Any, ttl: float):
+        self.memory.set(key, value, ttl=ttl)
+        if not self.shared:
+            return
+        from app import data
+        async with data.AsyncSessionLocal() as db:
+            expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+            await data.async_crud.set_tool_result(db, key=key, tool_name=tool_name, result=value, expires_at=expires_at)
+
+    async def purge_expired(self) -> int:
+        """Delete the expired entries of the shared tier (expired entries are never returned, but are otherwise kept).
+
+        Returns:
+            int: The number of entries deleted
+        """
+        if not self.shared:
+            return 0
+        from app import data
+        async with data.AsyncSessionLocal() as db:
+            return await data.async_crud.delete_expired_tool_results(db)
+
+
+class ClientPool:
+    """A bounded pool of reusable API clients, keyed by API key.
+    Tools that need an API key should get their client from a pool rather than constructing one per call,
+    so that connections are kept alive between calls.
+
+    Args:
+        factory (Callable[[str], Any]): Constructs a new client for the given API key.
+        max_size (int): The maximum number of clients to keep.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_size: int = 256):
+        self.factory = factory
+        self._clients = LRUCache(max_size)
+
+    def get(self, api_key: str) -> Any:
+        found, client = self._clients.get(api_key)
+        if not found:
+            client = self.factory(api_key)
+            self._clients.set(api_key, client)
+        return client
+
+
+tool_result_cache = ToolResultCache(max_size=config.tool_cache_size, shared=config.tool_cache_shared)
@@ -0,0 +1,115 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections.abc import Callable
+from typing import Any
+import math
+import multiprocessing
+import resource
+import signal
+import threading
+
+from app.config import config
+
+
+class ToolResourceLimitError(Exception):
+    """Raised when a sandboxed tool exceeds its CPU time or memory limit."""
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise ToolResourceLimitError('Tool exceeded its CPU time limit')
+
+def _init_worker():
+    # SIGXCPU would normally kill the worker; raising instead aborts only the current tool call,
+    # so the worker stays warm for the next one
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+def _noop():
+    return None
+
+def _run_in_worker(func: Callable, args: tuple, kwargs: dict, cpu_seconds: float, memory_bytes: int) -> Any:
+    """Run a tool function inside a pool worker with CPU time and address space limits.
+    RLIMIT_CPU counts the worker's total CPU time, so the limit is set relative to what the worker has used so far.
+    Both soft limits are restored afterwards; the hard limits are never touched, so they can always be restored.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    cpu_soft, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    as_soft, as_hard = resource.getrlimit(resource.RLIMIT_AS)
+    cpu_limit = math.ceil(used + cpu_seconds)
+    if cpu_hard != resource.RLIM_INFINITY:
+        cpu_limit = min(cpu_limit, cpu_hard)
+    if as_hard != resource.RLIM_INFINITY:
+        memory_bytes = min(memory_bytes, as_hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_hard))
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, as_hard))
+    try:
+        return func(*args, **kwargs)
+    except MemoryError:
+        raise ToolResourceLimitError('Tool exceeded its memory limit')
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (as_soft, as_hard))
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+
+
+class ToolSandbox:
+    """A pool of pre-forked worker processes for running tools outside of the API worker.
+    Tool functions, arguments and results are pickled to cross the process boundary,
+    so sandboxed tools must be module-level functions with picklable arguments and results.
+
+    Args:
+        max_workers (int): The number of worker processes to keep.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> ProcessPoolExecutor:
+        """Start the pool (if it is not running yet) and wait for every worker to be ready.
+
+        Returns:
+            ProcessPoolExecutor: The running pool
+        """
+        with self._lock:
+            if self._executor is None:
+                # forkserver avoids forking the API worker itself, along with its threads and open connections
+                executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_init_worker
+                )
+                for future in [executor.submit(_noop) for _ in range(self.max_workers)]:
+                    future.result()
+                self._executor = executor
+            return self._executor
+
+    def run(self, func: Callable, args: tuple, kwargs: dict, cpu_seconds: float, memory_mb: int) -> Any:
+        """Run a tool function in a worker process.
+
+        Raises:
+            ToolResourceLimitError: If the tool exceeds its limits, or its worker dies
+
+        Returns:
+            Any: The result of the tool function
+        """
+        executor = self.start()
+        try:
+            return executor.submit(_run_in_worker, func, args, kwargs, cpu_seconds, memory_mb * 1024 * 1024).result()
+        except BrokenProcessPool:
+            # a worker was killed outright (e.g. by the OOM killer); replace the pool so later calls still work
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise ToolResourceLimitError('Tool worker terminated unexpectedly')
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+tool_sandbox = ToolSandbox(max_workers=config.tool_sandbox_workers)
@@ -1,4 +1,17 @@
+from collections.abc import Mapping
+from types import MappingProxyType
 from app.util import ToolAPI
+from app.tool_cache import ClientPool
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from app.schemas.tools import ToolConfig
+
+def _tavily_client(api_key: str):
+    from tavily import TavilyClient
+    return TavilyClient(api_key=api_key)
+
+tavily_clients = ClientPool(_tavily_client)
 
 def test_tool(foo: str):
     """A test tool that returns the input string.
@@ -21,22 +34,42 @@ def web_search(query: str, api_key: str, api_provider = ToolAPI.TAVILY):
     Returns:
         list[dict]: The search results
     """
-    from tavily import TavilyClient
-    client = TavilyClient(api_key=api_key)
+    client = tavily_clients.get(api_key)
 
     response = client.search(query)
 
     return response['results']
     
 
-def get_tools():
-    from app.schemas.tools import ToolConfig
+def compile_tools() -> Mapping[str, 'ToolConfig']:
+    """Build the tool registry. This introspects every tool function, so it should only run once.
+
+    Returns:
+        Mapping[str, ToolConfig]: A read-only mapping of tool name to compiled tool config
+    """
+    from app.schemas.tools import ToolConfig, ToolResultCompaction
     test_tool_config = ToolConfig.from_func(test_tool)
-    web_search_tool_config = ToolConfig.from_func(web_search)
+    web_search_tool_config = ToolConfig.from_func(
+        web_search,
+        cacheable=True,
+        cache_ttl=600,
+        compaction=ToolResultCompaction(fields=['title', 'url', 'content'], max_chars=500, top_k=3, summary=True)
+    )
 
     tools = {
         'test_tool': test_tool_config,
         'web_search': web_search_tool_config
     }
     
-    return tools
\ No newline at end of file
+    return MappingProxyType(tools)
+
+_registry: Mapping[str, 'ToolConfig'] | None = None
+
+def get_tools() -> Mapping[str, 'ToolConfig']:
+    """Get the compiled tool registry, compiling it on first use.
+    The returned tools are shared between requests; use `ToolConfig.bind` to attach a user's API key.
+    """
+    global _registry
+    if _registry is None:
+        _registry = compile_tools()
+    return _registry
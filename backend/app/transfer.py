@@ -0,0 +1,233 @@
+"""Export and import of all of a user's chats, for backups and for moving users between deployments.
+
+An export is NDJSON: an `ExportHeader` line, then every chat (`ExportedChat`), then every message of those chats
+with its contents in full (`ExportedMessage`), chat by chat. It is streamed straight from server-side cursors, so
+memory use doesn't grow with the size of the export. Uploaded files are exported separately, as a tar stream
+of `uploads/{chat_id}/{filename}`.
+
+An import reads the same format, optionally with the uploads archive, and adds everything under new ids, committing
+every `IMPORT_BATCH_SIZE` messages. Upload paths, candidate groups and the messages each message follows are remapped
+to match the new chats.
+"""
+from collections.abc import Callable, Iterable, Iterator
+from typing import IO
+import datetime
+import itertools
+import json
+import os
+import re
+import shutil
+import tarfile
+import uuid
+
+from pydantic import UUID4, ValidationError
+
+from app import chat_models, data, schemas
+from app.config import config
+from app.uploads import get_upload_dir
+from app.user_cache import get_service_user
+from app.util import MessageContentType, Role
+
+IMPORT_BATCH_SIZE = 1000
+# exported lines are sent in chunks of about this many bytes, rather than one by one
+EXPORT_CHUNK_SIZE = 1 << 16
+UPLOAD_MEMBER = re.compile(r'uploads/([0-9a-fA-F-]{36})/([^/]+)')
+
+
+def is_upload_name(name: str) -> bool:
+    """Whether a name from an export can be the name of a file in an upload directory, i.e. can't lead out of it."""
+    return name not in ('', '.') and '/' not in name and '..' not in name
+
+
+def json_default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def export_chats(make_session: Callable[[], data.Session], user_id: UUID4) -> Iterator[bytes]:
+    """Stream a user's chats as NDJSON, in chunks. The session is only opened once streaming starts.
+    """
+    db = make_session()
+    try:
+        if db.get_bind().dialect.name == 'postgresql':
+            # chats and messages are read by separate queries; one snapshot keeps them consistent with each other
+            db.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+        header = schemas.ExportHeader(exported_at=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+        records = itertools.chain(
+            [header.model_dump(mode='json')],
+            ({'type': 'chat', **chat} for chat in data.crud.iter_chat_exports(db, user_id)),
+            ({'type': 'message', **message} for message in data.crud.iter_message_exports(db, user_id)),
+        )
+        chunk = []
+        size = 0
+        for record in records:
+            line = json.dumps(record, default=json_default, separators=(',', ':')).encode('utf-8') + b'\n'
+            chunk.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_SIZE:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield b''.join(chunk)
+    finally:
+        db.close()
+
+
+def export_uploads(make_session: Callable[[], data.Session], user_id: UUID4) -> Iterator[bytes]:
+    """Stream the uploaded files of a user's chats as an uncompressed tar archive, a file chunk at a time.
+    """
+    db = make_session()
+    try:
+        chat_ids = [chat['id'] for chat in data.crud.iter_chat_exports(db, user_id)]
+    finally:
+        db.close()
+    for chat_id in chat_ids:
+        directory = get_upload_dir(chat_id)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            info = tarfile.TarInfo(f'uploads/{chat_id}/{name}')
+            info.size = os.path.getsize(path)
+            info.mtime = int(os.path.getmtime(path))
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            remaining = info.size
+            with open(path, 'rb') as f:
+                while remaining > 0:
+                    # a file that shrank since its size was read is padded, so the archive stays readable
+                    block = f.read(min(EXPORT_CHUNK_SIZE, remaining)) or bytes(min(EXPORT_CHUNK_SIZE, remaining))
+                    remaining -= len(block)
+                    yield block
+            yield bytes(-info.size % tarfile.BLOCKSIZE)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+
+def import_chats(db: data.Session, user_id: UUID4, lines: Iterable[str], uploads: IO[bytes] | None = None) -> schemas.ImportReport:
+    """Import an export into a user's account. Chats are written before any of their messages, and every batch
+    is committed on its own, so a failed import keeps what was written before the line that failed.
+    Messages of chats that aren't in the export are skipped. Chats exported without a config get the default config
+    of their model.
+
+    Raises:
+        ValueError: If a line isn't a valid record (including image and file contents that aren't uploads of the
+            message's chat), or the export is of a newer format
+    """
+    report = schemas.ImportReport()
+    chat_ids: dict[UUID4, UUID4] = {}
+    candidate_groups: dict[UUID4, UUID4] = {}
+    # messages only follow messages of their own chat, which are exported together, so only one chat's ids are kept
+    message_ids: dict[UUID4, UUID4] = {}
+    message_chat_id = None
+    senders = {
+        Role.SYSTEM: get_service_user(config.system_email).id,
+        Role.ASSISTANT: get_service_user(config.assistant_email).id,
+    }
+    chats: list[schemas.ExportedChat] = []
+    messages: list[tuple[schemas.Message, UUID4, UUID4, datetime.datetime]] = []
+    new_ids: list[UUID4] = []
+    # exports without a header are of the first format
+    version = 1
+
+    def write_chats():
+        if chats:
+            # messages of exports from before messages had parents have none; they are linked when the chat is branched
+            chat_ids.update(zip([chat.id for chat in chats], data.crud.import_chats(db, user_id, chats, messages_linked=version >= 2)))
+            db.commit()
+            report.chats += len(chats)
+            chats.clear()
+
+    def write_messages():
+        if messages:
+            data.crud.insert_messages(db, messages, new_ids)
+            db.commit()
+            report.messages += len(messages)
+            messages.clear()
+            new_ids.clear()
+
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = schemas.export_record_adapter.validate_json(line)
+            except ValidationError as e:
+                raise ValueError(f'Invalid record on line {line_number}: {e.errors()[0]["msg"]}')
+            if isinstance(record, schemas.ExportHeader):
+                if record.version > schemas.EXPORT_FORMAT_VERSION:
+                    raise ValueError(f'Unsupported export format version {record.version}')
+                version = record.version
+            elif isinstance(record, schemas.ExportedChat):
+                if record.config is None:
+                    try:
+                        record.config = chat_models.get_chat_model(record.default_model).config_type()
+                    except ValueError:
+                        raise ValueError(f'Invalid record on line {line_number}: unknown model {record.default_model}')
+                chats.append(record)
+                if len(chats) >= IMPORT_BATCH_SIZE:
+                    write_chats()
+            else:
+                write_chats()
+                chat_id = chat_ids.get(record.chat_id)
+                if chat_id is None:
+                    report.skipped += 1
+                    continue
+                if chat_id != message_chat_id:
+                    message_chat_id = chat_id
+                    message_ids.clear()
+                record.parent_id = message_ids.get(record.parent_id) if record.parent_id is not None else None
+                message_ids[record.id] = uuid.uuid4()
+                new_ids.append(message_ids[record.id])
+                if record.candidate_group is not None:
+                    record.candidate_group = candidate_groups.setdefault(record.candidate_group, uuid.uuid4())
+                for content in record.contents:
+                    if content.type not in (MessageContentType.IMAGE, MessageContentType.FILE):
+                        continue
+                    # the path is read and sent to models on later turns, so it must only ever point into the chat's uploads
+                    prefix = f'uploads/{record.chat_id}/'
+                    name = content.content[len(prefix):] if content.content.startswith(prefix) else ''
+                    if not is_upload_name(name):
+                        raise ValueError(f'Invalid record on line {line_number}: {content.content} is not an upload of chat {record.chat_id}')
+                    content.content = os.path.join(get_upload_dir(chat_id), name)
+                messages.append((record, senders.get(Role(record.role), user_id), chat_id, record.created_at))
+                if len(messages) >= IMPORT_BATCH_SIZE:
+                    write_messages()
+        write_chats()
+        write_messages()
+    except Exception:
+        db.rollback()
+        raise
+    if uploads is not None:
+        report.uploads = import_uploads(uploads, chat_ids)
+    return report
+
+
+def import_uploads(uploads: IO[bytes], chat_ids: dict[UUID4, UUID4]) -> int:
+    """Extract the files of an uploads archive (as made by `export_uploads`) into the upload directories of the
+    imported chats, given by their exported ids. Anything else in the archive is ignored.
+
+    Returns:
+        int: The number of files extracted
+    """
+    extracted = 0
+    with tarfile.open(fileobj=uploads, mode='r|*') as archive:
+        for member in archive:
+            match = UPLOAD_MEMBER.fullmatch(member.name)
+            if match is None or not member.isfile() or not is_upload_name(match[2]):
+                continue
+            try:
+                chat_id = chat_ids.get(uuid.UUID(match[1]))
+            except ValueError:
+                continue
+            source = archive.extractfile(member)
+            if chat_id is None or source is None:
+                continue
+            directory = get_upload_dir(chat_id)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, match[2]), 'wb') as f:
+                shutil.copyfileobj(source, f, EXPORT_CHUNK_SIZE)
+            extracted += 1
+    return extracted
@@ -0,0 +1,52 @@
+"""Files uploaded to chats, stored under `uploads/{chat_id}`.
+
+Usage (from the backend directory), to remove the uploads of chats that no longer exist:
+    python -m app.uploads
+"""
+import os
+import shutil
+import uuid
+
+from pydantic import UUID4
+
+UPLOADS_DIR = 'uploads'
+
+def get_upload_dir(chat_id: UUID4) -> str:
+    return os.path.join(UPLOADS_DIR, str(chat_id))
+
+def remove_chat_uploads(chat_id: UUID4):
+    """Remove the uploaded files of a deleted chat. Meant to run as a background task, so that removing
+    a large directory doesn't hold up the response.
+    """
+    shutil.rmtree(get_upload_dir(chat_id), ignore_errors=True)
+
+def remove_orphaned_uploads() -> int:
+    """Remove the upload directories of chats that no longer exist.
+
+    Returns:
+        int: The number of directories removed
+    """
+    from app import data
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+    chat_ids = []
+    for name in os.listdir(UPLOADS_DIR):
+        try:
+            chat_ids.append(uuid.UUID(name))
+        except ValueError:
+            continue
+    if not chat_ids:
+        return 0
+    db = data.SessionLocal()
+    try:
+        existing = data.crud.get_existing_chat_ids(db, chat_ids)
+    finally:
+        db.close()
+    orphaned = [chat_id for chat_id in chat_ids if chat_id not in existing]
+    for chat_id in orphaned:
+        remove_chat_uploads(chat_id)
+    return len(orphaned)
+
+
+if __name__ == '__main__':
+    print(f'removed {remove_orphaned_uploads()} orphaned upload directories')
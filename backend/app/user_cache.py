@@ -0,0 +1,107 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from typing import Any
+import threading
+
+from app import data, schemas
+from app.config import config
+from app.tool_cache import LRUCache
+
+
+class UserCache:
+    """A short-lived, per-process cache of per-user data, keyed by user id (the subject of their token).
+    Entries are evicted in this process once a change to the underlying rows through the ORM commits; other processes
+    see the change once their entry expires, so the TTL bounds how long stale data can be served.
+
+    Args:
+        max_size (int): The maximum number of users to keep.
+        ttl (float): How long an entry is cached, in seconds. 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        self.ttl = ttl
+        self._entries = LRUCache(max_size)
+
+    def get(self, user_id) -> Any | None:
+        found, value = self._entries.get(str(user_id))
+        return value if found else None
+
+    def set(self, user_id, value: Any):
+        if self.ttl > 0:
+            self._entries.set(str(user_id), value, ttl=self.ttl)
+
+    def invalidate(self, user_id):
+        self._entries.delete(str(user_id))
+
+    def clear(self):
+        self._entries.clear()
+
+
+# authenticated users (schemas.User)
+user_cache = UserCache(max_size=config.user_cache_size, ttl=config.user_cache_ttl)
+# each user's API keys, by provider
+api_key_cache = UserCache(max_size=config.user_cache_size, ttl=config.user_cache_ttl)
+
+_service_users: dict[str, schemas.User] = {}
+_service_users_lock = threading.Lock()
+
+def _invalidate_on_commit(target, user_id, users: bool):
+    """Evict a user's entries once the transaction that changed their rows commits. Evicting them at flush time
+    would let a request that reads the old rows before the commit cache them again.
+    """
+    pending = object_session(target).info.setdefault('user_cache_invalidations', {})
+    pending[user_id] = pending.get(user_id, False) or users
+
+@event.listens_for(data.models.User, 'after_update')
+@event.listens_for(data.models.User, 'after_delete')
+def _invalidate_user(mapper, connection, target: data.models.User):
+    _invalidate_on_commit(target, target.id, users=True)
+
+@event.listens_for(data.models.APIKey, 'after_insert')
+@event.listens_for(data.models.APIKey, 'after_update')
+@event.listens_for(data.models.APIKey, 'after_delete')
+def _invalidate_api_keys(mapper, connection, target: data.models.APIKey):
+    _invalidate_on_commit(target, target.user_id, users=False)
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed(session: Session):
+    for user_id, users in session.info.pop('user_cache_invalidations', {}).items():
+        api_key_cache.invalidate(user_id)
+        if users:
+            user_cache.invalidate(user_id)
+            for email, user in list(_service_users.items()):
+                if user.id == user_id:
+                    _service_users.pop(email, None)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session: Session):
+    session.info.pop('user_cache_invalidations', None)
+
+
+def get_service_user(email: str, db: data.Session | None = None) -> schemas.User:
+    """Get one of the users that own messages not written by a person (the system and assistant users),
+    creating it if it doesn't exist yet. They are looked up once per process, then served from memory.
+    """
+    user = _service_users.get(email)
+    if user is not None:
+        return user
+    with _service_users_lock:
+        if email in _service_users:
+            return _service_users[email]
+        session = db if db is not None else data.SessionLocal()
+        try:
+            db_user = data.crud.get_user_by_email(session, email=email)
+            if db_user is None:
+                db_user = data.crud.create_user(session, user=schemas.UserCreate(email=email, password='password'))
+            user = schemas.User(id=db_user.id, email=db_user.email)
+        finally:
+            if db is None:
+                session.close()
+        _service_users[email] = user
+        return user
+
+def load_service_users():
+    """Resolve the system and assistant users, so that requests never have to.
+    """
+    for email in (config.system_email, config.assistant_email):
+        get_service_user(email)
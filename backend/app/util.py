@@ -2,6 +2,8 @@ from enum import Enum
 import inspect
 from pydantic import BaseModel, field_validator, ValidationInfo, Field, model_validator
 from typing import Callable, Any
+import base64
+import json
 import re
 
 class Role(str, Enum):
@@ -75,4 +77,21 @@ class OptionedString(ConfigItem):
     def validate_val(cls, value, info: ValidationInfo):
         if value not in info.data['options']:
             raise ValueError(f'Value must be one of {cls.options}')
-        return value
\ No newline at end of file
+        return value
+
+
+def encode_cursor(*values: str) -> str:
+    """Encode the sort key of the last item of a page into an opaque pagination cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, length: int) -> list[str]:
+    """Decode a cursor built by `encode_cursor` back into its values.
+
+    Raises:
+        ValueError: If the cursor is malformed, or does not have the expected number of values
+    """
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(values, list) or len(values) != length or not all(isinstance(v, str) for v in values):
+        raise ValueError('Invalid cursor')
+    return values
@@ -0,0 +1,66 @@
+"""Compare deleting a chat through the ORM cascade, which loads and deletes every message and content one by one,
+with `data.crud.delete_chat`, which issues a single DELETE and lets ON DELETE CASCADE remove the children.
+
+Usage (from the backend directory):
+    python -m benchmarks.chat_delete --messages 10000
+"""
+import argparse
+
+from sqlalchemy import func, select
+
+from app import data
+from benchmarks.common import count_queries, create_benchmark_user, delete_benchmark_user, report, seed_chat, timer
+
+
+def delete_orm(chat_id):
+    db = data.SessionLocal()
+    try:
+        db_chat = data.crud.get_chat(db, chat_id)
+        for db_message in db_chat.messages:
+            for db_content in db_message.contents:
+                db.delete(db_content)
+            db.delete(db_message)
+        db.delete(db_chat)
+        db.commit()
+    finally:
+        db.close()
+
+
+def delete_bulk(chat_id):
+    db = data.SessionLocal()
+    try:
+        data.crud.delete_chat(db, chat_id)
+    finally:
+        db.close()
+
+
+def count_messages(db, chat_id) -> int:
+    return db.scalar(select(func.count()).select_from(data.models.Message).where(data.models.Message.chat_id == chat_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--contents', type=int, default=2, help='contents per message')
+    args = parser.parse_args()
+
+    db = data.SessionLocal()
+    db_user = create_benchmark_user(db)
+    try:
+        print(f'chat with {args.messages} messages x {args.contents} contents')
+        for name, delete in [
+            ('orm cascade (previous)', delete_orm),
+            ('crud.delete_chat', delete_bulk),
+        ]:
+            chat_id = seed_chat(db, db_user.id, args.messages, args.contents).id
+            with count_queries() as queries, timer() as elapsed:
+                delete(chat_id)
+            assert count_messages(db, chat_id) == 0
+            report(name, elapsed['seconds'], queries.count)
+    finally:
+        delete_benchmark_user(db, db_user.id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare chat hydration through the ORM relationships with the projected loader in `data.crud.get_chat_full`,
+and with the model history served from `data.history_cache` by `data.crud.get_chat_history`.
+
+Usage (from the backend directory):
+    python -m benchmarks.chat_hydration --messages 1000 --repeat 5
+"""
+import argparse
+
+from app import data, schemas
+from benchmarks.common import count_queries, create_benchmark_user, delete_benchmark_user, report, seed_chat, timer
+
+
+def hydrate_orm(chat_id):
+    db = data.SessionLocal()
+    try:
+        db_chat = data.crud.get_chat(db, chat_id)
+        return schemas.ChatFull.model_validate(db_chat, from_attributes=True)
+    finally:
+        db.close()
+
+
+def hydrate_projected(chat_id, include_message_config=True):
+    db = data.SessionLocal()
+    try:
+        return data.crud.get_chat_full(db, chat_id, include_message_config=include_message_config)
+    finally:
+        db.close()
+
+
+def hydrate_history(chat_id):
+    db = data.SessionLocal()
+    try:
+        return data.crud.get_chat_history(db, chat_id)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--contents', type=int, default=2, help='contents per message')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db = data.SessionLocal()
+    db_user = create_benchmark_user(db)
+    try:
+        db_chat = seed_chat(db, db_user.id, args.messages, args.contents)
+        chat_id = db_chat.id
+        print(f'chat with {args.messages} messages x {args.contents} contents, best of {args.repeat}')
+        for name, hydrate in [
+            ('orm (ChatFull.model_validate)', hydrate_orm),
+            ('crud.get_chat_full', hydrate_projected),
+            ('crud.get_chat_full (history only)', lambda chat_id: hydrate_projected(chat_id, include_message_config=False)),
+            ('crud.get_chat_history (cached)', hydrate_history),
+        ]:
+            best = None
+            for _ in range(args.repeat):
+                with count_queries() as queries, timer() as elapsed:
+                    chat = hydrate(chat_id)
+                if best is None or elapsed['seconds'] < best[0]:
+                    best = (elapsed['seconds'], queries.count)
+            assert chat is not None and len(chat.messages) == args.messages
+            report(name, best[0], best[1])
+    finally:
+        delete_benchmark_user(db, db_user.id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Measure the throughput of exporting a user's chats with `transfer.export_chats`, and of importing the export into
+another user with `transfer.import_chats` (batched inserts, one transaction per batch).
+
+Usage (from the backend directory):
+    python -m benchmarks.chat_transfer --chats 50 --messages 100
+"""
+import argparse
+
+from app import data, transfer
+from benchmarks.common import count_queries, create_benchmark_user, delete_benchmark_user, report, seed_chat, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=100, help='messages per chat')
+    parser.add_argument('--contents', type=int, default=2, help='contents per message')
+    args = parser.parse_args()
+
+    db = data.SessionLocal()
+    source = create_benchmark_user(db)
+    target = create_benchmark_user(db)
+    try:
+        for _ in range(args.chats):
+            seed_chat(db, source.id, args.messages, args.contents)
+        print(f'{args.chats} chats x {args.messages} messages x {args.contents} contents')
+
+        with count_queries() as queries, timer() as elapsed:
+            export = b''.join(transfer.export_chats(data.SessionLocal, source.id))
+        lines = export.decode('utf-8').splitlines()
+        report('transfer.export_chats', elapsed['seconds'], queries.count,
+            f'{len(lines) / elapsed["seconds"]:8.0f} lines/s  {len(export) / elapsed["seconds"] / 2**20:6.1f} MiB/s')
+
+        with count_queries() as queries, timer() as elapsed:
+            imported = transfer.import_chats(db, target.id, lines)
+        assert imported.chats == args.chats and imported.messages == args.chats * args.messages
+        report('transfer.import_chats', elapsed['seconds'], queries.count, f'{imported.messages / elapsed["seconds"]:8.0f} messages/s')
+    finally:
+        delete_benchmark_user(db, target.id)
+        delete_benchmark_user(db, source.id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
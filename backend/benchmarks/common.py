@@ -0,0 +1,83 @@
+"""Helpers shared by the benchmark scripts.
+
+The benchmarks run against the database in DATABASE_URL, which should already be migrated
+(`alembic upgrade heads`). Each benchmark creates its own throwaway user and removes it when it finishes.
+"""
+from contextlib import contextmanager
+import datetime
+import time
+import uuid
+
+from sqlalchemy import event
+
+from app import data, schemas
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Count the statements executed on the engine inside the block."""
+    engine = engine or data.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def timer():
+    """Measure the wall-clock time of the block, in seconds."""
+    result = {'seconds': 0.0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+
+def create_benchmark_user(db: data.Session) -> data.models.User:
+    db_user = data.models.User(email=f'benchmark-{uuid.uuid4()}', hashed_password='!')
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+
+def seed_chat(db: data.Session, user_id, n_messages: int, contents_per_message: int = 2) -> data.models.Chat:
+    """Create a chat with n_messages alternating user/assistant messages, each with a few text contents."""
+    db_chat = data.crud.create_chat(db, schemas.ChatCreate(title='Benchmark'), user_id=user_id)
+    base = db_chat.created_at
+    for i in range(n_messages):
+        role = 'USER' if i % 2 == 0 else 'ASSISTANT'
+        db_message = data.models.Message(
+            id=uuid.uuid4(), role=role, user_id=user_id, chat_id=db_chat.id,
+            created_at=base + datetime.timedelta(milliseconds=i)
+        )
+        db.add(db_message)
+        for j in range(contents_per_message):
+            db.add(data.models.MessageContent(type='TEXT', content=f'message {i} content {j} ' + 'lorem ipsum ' * 20, message_id=db_message.id, order=j))
+    db.commit()
+    return db_chat
+
+
+def delete_benchmark_user(db: data.Session, user_id):
+    db_user = data.crud.get_user(db, user_id)
+    if db_user is not None:
+        db.delete(db_user)
+        db.commit()
+
+
+def report(name: str, seconds: float, queries: int | None = None, extra: str = ''):
+    line = f'{name:<40} {seconds * 1000:10.1f} ms'
+    if queries is not None:
+        line += f' {queries:6d} queries'
+    print(line + (f'  {extra}' if extra else ''))
@@ -0,0 +1,81 @@
+"""Measure login throughput, and how long logins stall the event loop, with password verification running on the
+event loop (as `login_for_access_token` used to) and offloaded to the password executor (`data.auth.authenticate_user_async`).
+
+Usage (from the backend directory):
+    python -m benchmarks.login_throughput --logins 32 --concurrency 8
+"""
+import argparse
+import asyncio
+import time
+
+from app import data
+from app.config import config
+from benchmarks.common import create_benchmark_user, delete_benchmark_user, report, timer
+
+PASSWORD = 'benchmark-password'
+
+
+async def login_on_event_loop(email: str) -> bool:
+    db = data.SessionLocal()
+    try:
+        return bool(data.auth.authenticate_user(db, email, PASSWORD))
+    finally:
+        db.close()
+
+
+async def login_offloaded(email: str) -> bool:
+    async with data.AsyncSessionLocal() as db:
+        return bool(await data.auth.authenticate_user_async(db, email, PASSWORD))
+
+
+async def measure_stalls(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Return the longest time the event loop was late to wake up a sleeping task, in seconds."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(login, email: str, logins: int, concurrency: int) -> tuple[float, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login_once():
+        async with semaphore:
+            assert await login(email)
+
+    stop = asyncio.Event()
+    stalls = asyncio.create_task(measure_stalls(stop))
+    with timer() as elapsed:
+        await asyncio.gather(*(login_once() for _ in range(logins)))
+    stop.set()
+    return elapsed['seconds'], await stalls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    db = data.SessionLocal()
+    db_user = create_benchmark_user(db)
+    user_id = db_user.id
+    try:
+        db_user.hashed_password = data.auth.get_password_hash(PASSWORD)
+        db.commit()
+        print(f'{args.logins} logins, {args.concurrency} at a time, bcrypt cost {config.password_hash_rounds}, {config.password_hash_workers} hashing threads')
+        for name, login in [
+            ('verify on event loop (previous)', login_on_event_loop),
+            ('authenticate_user_async', login_offloaded),
+        ]:
+            seconds, stall = asyncio.run(run(login, db_user.email, args.logins, args.concurrency))
+            report(name, seconds, extra=f'{args.logins / seconds:6.1f} logins/s, longest event loop stall {stall * 1000:7.1f} ms')
+    finally:
+        delete_benchmark_user(db, user_id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
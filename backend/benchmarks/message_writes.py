@@ -0,0 +1,74 @@
+"""Measure message write throughput: the previous per-message write path (two commits and two refreshes per message)
+against `data.crud.create_message` (one transaction per message) and `data.crud.create_messages` (one transaction per batch).
+
+Usage (from the backend directory):
+    python -m benchmarks.message_writes --messages 500 --batch 4
+"""
+import argparse
+
+from app import data, schemas
+from app.util import Role
+from benchmarks.common import count_queries, create_benchmark_user, delete_benchmark_user, report, timer
+
+
+def build_message(i: int, contents: int) -> schemas.Message:
+    builder = schemas.MessageBuilder(role=Role.USER if i % 2 == 0 else Role.ASSISTANT)
+    for j in range(contents):
+        builder.add_text(f'message {i} content {j} ' + 'lorem ipsum ' * 20)
+    return builder.build()
+
+
+def write_per_message_orm(db, messages, user_id, chat_id, batch):
+    for message in messages:
+        message_dict = message.model_dump(exclude={'contents', 'config'})
+        # configs are stored by hash now, rather than copied into every message
+        config_hash = data.crud.store_model_configs(db, [message.config])[0]
+        db_message = data.models.Message(**message_dict, config_hash=config_hash, user_id=user_id, chat_id=chat_id, created_at=data.crud.utcnow())
+        db.add(db_message)
+        db.commit()
+        db.refresh(db_message)
+        for i, content in enumerate(message.contents):
+            db.add(data.models.MessageContent(**content.model_dump(), message_id=db_message.id, order=i))
+        db.commit()
+        db.refresh(db_message)
+
+
+def write_per_message(db, messages, user_id, chat_id, batch):
+    for message in messages:
+        data.crud.create_message(db, message, user_id=user_id, chat_id=chat_id)
+
+
+def write_batched(db, messages, user_id, chat_id, batch):
+    for start in range(0, len(messages), batch):
+        data.crud.create_messages(db, [(message, user_id) for message in messages[start:start + batch]], chat_id=chat_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--contents', type=int, default=2, help='contents per message')
+    parser.add_argument('--batch', type=int, default=4, help='messages per transaction for create_messages, e.g. one tool-loop exchange')
+    args = parser.parse_args()
+
+    messages = [build_message(i, args.contents) for i in range(args.messages)]
+    db = data.SessionLocal()
+    db_user = create_benchmark_user(db)
+    try:
+        print(f'{args.messages} messages x {args.contents} contents')
+        for name, write in [
+            ('per message, orm (previous)', write_per_message_orm),
+            ('crud.create_message', write_per_message),
+            (f'crud.create_messages (batch of {args.batch})', write_batched),
+        ]:
+            db_chat = data.crud.create_chat(db, schemas.ChatCreate(title='Benchmark'), user_id=db_user.id)
+            with count_queries() as queries, timer() as elapsed:
+                write(db, messages, db_user.id, db_chat.id, args.batch)
+            assert len(data.crud.get_chat_messages(db, db_chat.id)) == args.messages
+            report(name, elapsed['seconds'], queries.count, f'{args.messages / elapsed["seconds"]:8.0f} messages/s')
+    finally:
+        delete_benchmark_user(db, db_user.id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,20 @@
 
 cd /app
 
-alembic upgrade head
+# only wait for schema changes; data backfills that can be deferred run next to the app. Revisions on the `contract`
+# branch drop what the previous release may still read, so deploys leave them out
+alembic -x defer_backfills=true upgrade expand@head
+# a failure is logged by the backfill itself; this marks it in the container log, next to the app's output.
+# Set RUN_CONTRACT_MIGRATIONS=true once no instance of the previous release is left to also run the contract
+# revisions, which only happens after every deferred backfill has finished
+(
+    if python -m app.data.backfill; then
+        if [ "$RUN_CONTRACT_MIGRATIONS" = "true" ]; then
+            alembic upgrade contract@head || echo "CONTRACT MIGRATIONS FAILED (exit code $?)" >&2
+        fi
+    else
+        echo "DEFERRED BACKFILLS FAILED (exit code $?): the data migration is incomplete" >&2
+    fi
+) &
 
-fastapi run app/main.py --port 8000
\ No newline at end of file
+fastapi run app/main.py --port 8000
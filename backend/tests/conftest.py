@@ -0,0 +1,41 @@
+"""Shared setup for the tests.
+
+The tests never touch the database in DATABASE_URL: the ones that need tables create them in an in-memory SQLite
+database of their own. Settings the app requires are given placeholder values when they aren't in the environment.
+
+Usage (from the backend directory):
+    python -m pytest tests
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+for var, value in {
+    'DATABASE_URL': 'sqlite://',
+    'SYSTEM_EMAIL': 'system@example.com',
+    'ASSISTANT_EMAIL': 'assistant@example.com',
+    'ALLOWED_ORIGINS': '["*"]',
+    'SECRET_KEY': 'test',
+    'ALGORITHM': 'HS256',
+    'ACCESS_TOKEN_EXPIRE_MINUTES': '60',
+}.items():
+    os.environ.setdefault(var, value)
+
+from app.data.database import Base, enable_sqlite_foreign_keys  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    # like the app's own SQLite engines, so that deletes cascade
+    event.listen(engine, 'connect', enable_sqlite_foreign_keys)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
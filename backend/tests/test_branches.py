@@ -0,0 +1,142 @@
+"""The message tree of a chat: branching from edited and regenerated messages, switching and deleting branches, and the
+chat summary kept up to date through all of them (see `crud.create_messages`)."""
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from app import data, schemas
+from app.util import Role
+
+
+@pytest.fixture
+def user_id(db) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    db.add(data.models.User(id=user_id, email=f'{user_id}@example.com', hashed_password='x'))
+    db.commit()
+    return user_id
+
+
+def text(role: Role, content: str) -> schemas.Message:
+    return schemas.MessageBuilder(role=role).add_text(content).build()
+
+
+def create_chat(db, user_id, *contents: str, system_prompt: bool = True) -> tuple[uuid.UUID, list[schemas.MessageView]]:
+    """Create a chat with messages alternating between the user and the assistant, after a system prompt."""
+    chat_id = data.crud.create_chat(db, schemas.ChatCreate(title='Chat'), user_id).id
+    messages = [(text(Role.SYSTEM, 'Be helpful'), user_id)] if system_prompt else []
+    messages += [(text(Role.USER if i % 2 == 0 else Role.ASSISTANT, content), user_id) for i, content in enumerate(contents)]
+    return chat_id, data.crud.create_messages(db, messages, chat_id)
+
+
+def history(db, chat_id) -> list[str]:
+    return [message.contents[0].content for message in data.crud.get_chat_messages(db, chat_id) if message.selected]
+
+
+def message_count(db, chat_id) -> int:
+    return db.scalar(select(data.models.Chat.message_count).where(data.models.Chat.id == chat_id))
+
+
+def test_messages_follow_each_other(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello')
+    assert [message.parent_id for message in messages] == [None, messages[0].id, messages[1].id]
+    more = data.crud.create_messages(db, [(text(Role.USER, 'How are you?'), user_id)], chat_id)
+    assert more[0].parent_id == messages[-1].id
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'How are you?']
+    assert message_count(db, chat_id) == 3
+
+
+def test_editing_a_message_starts_a_new_branch(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'Tell me a joke', 'No')
+    edited = data.crud.create_messages(db, [(text(Role.USER, 'Tell me a story'), user_id), (text(Role.ASSISTANT, 'Once upon a time'), user_id)], chat_id, parent_id=messages[2].id)
+    assert edited[0].parent_id == messages[2].id
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'Tell me a story', 'Once upon a time']
+    assert message_count(db, chat_id) == 4
+    branches = data.crud.get_branches(db, chat_id)
+    assert [(branch.head_id, branch.active) for branch in branches] == [(edited[1].id, True), (messages[-1].id, False)]
+
+
+def test_switching_back_to_a_branch(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'Tell me a joke', 'No')
+    data.crud.create_messages(db, [(text(Role.USER, 'Tell me a story'), user_id)], chat_id, parent_id=messages[2].id)
+    assert message_count(db, chat_id) == 3
+    # switching to a message activates the newest branch through it
+    assert data.crud.switch_branch(db, chat_id, messages[3].id) == messages[-1].id
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'Tell me a joke', 'No']
+    assert message_count(db, chat_id) == 4
+    # new messages are added to the branch switched to
+    added = data.crud.create_messages(db, [(text(Role.USER, 'Why not?'), user_id)], chat_id)
+    assert added[0].parent_id == messages[-1].id
+    assert message_count(db, chat_id) == 5
+
+
+def test_deleting_the_active_branch_activates_the_newest_remaining_one(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'Tell me a joke', 'No')
+    edited = data.crud.create_messages(db, [(text(Role.USER, 'Tell me a story'), user_id), (text(Role.ASSISTANT, 'Once upon a time'), user_id)], chat_id, parent_id=messages[2].id)
+    data.crud.delete_message(db, edited[0].id)
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'Tell me a joke', 'No']
+    assert message_count(db, chat_id) == 4
+    assert db.scalar(select(data.models.Message.id).where(data.models.Message.id == edited[1].id)) is None
+
+
+def test_deleting_another_branch_leaves_the_history(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'Tell me a joke', 'No')
+    data.crud.create_messages(db, [(text(Role.USER, 'Tell me a story'), user_id)], chat_id, parent_id=messages[2].id)
+    data.crud.delete_message(db, messages[3].id)
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'Tell me a story']
+    assert message_count(db, chat_id) == 3
+    assert len(data.crud.get_branches(db, chat_id)) == 1
+
+
+def test_deleting_a_message_of_the_history_deletes_what_follows_it(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'Tell me a joke', 'No')
+    data.crud.delete_message(db, messages[2].id)
+    assert history(db, chat_id) == ['Be helpful', 'Hi']
+    assert message_count(db, chat_id) == 1
+
+
+def test_candidates_share_a_parent(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi')
+    group = uuid.uuid4()
+    candidates = [text(Role.ASSISTANT, content) for content in ('Hello', 'Hey', 'Howdy')]
+    for i, candidate in enumerate(candidates):
+        candidate.candidate_group = group
+        candidate.candidate_index = i
+        candidate.selected = i == 0
+    written = data.crud.create_messages(db, [(candidate, user_id) for candidate in candidates] + [(text(Role.USER, 'Bye'), user_id)], chat_id)
+    assert [message.parent_id for message in written[:3]] == [messages[-1].id] * 3
+    # the message after the candidates follows the selected one
+    assert written[3].parent_id == written[0].id
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hello', 'Bye']
+    # unselected candidates are loaded with the chat, but aren't counted
+    assert len(data.crud.get_chat_messages(db, chat_id)) == 6
+    assert message_count(db, chat_id) == 3
+    data.crud.select_candidate(db, written[1].id)
+    assert history(db, chat_id) == ['Be helpful', 'Hi', 'Hey']
+    assert message_count(db, chat_id) == 2
+
+
+def test_editing_the_first_message_starts_a_new_tree(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', system_prompt=False)
+    edited = data.crud.create_messages(db, [(text(Role.USER, 'Hey'), user_id)], chat_id, root=True)
+    assert edited[0].parent_id is None
+    assert history(db, chat_id) == ['Hey']
+    assert message_count(db, chat_id) == 1
+    # the original stays a root of its own, rather than being linked after anything
+    assert db.scalar(select(data.models.Message.parent_id).where(data.models.Message.id == messages[0].id)) is None
+    data.crud.switch_branch(db, chat_id, messages[0].id)
+    assert history(db, chat_id) == ['Hi', 'Hello']
+    assert message_count(db, chat_id) == 2
+
+
+def test_messages_of_unlinked_chats_are_linked_once(db, user_id):
+    chat_id, messages = create_chat(db, user_id, 'Hi', 'Hello', 'How are you?')
+    # as written before messages had parents
+    db.query(data.models.Message).filter(data.models.Message.chat_id == chat_id).update({'parent_id': None})
+    db.query(data.models.Chat).filter(data.models.Chat.id == chat_id).update({'messages_linked': False})
+    db.commit()
+    assert data.crud.link_messages(db, chat_id)
+    db.commit()
+    parents = dict(db.execute(select(data.models.Message.id, data.models.Message.parent_id).where(data.models.Message.chat_id == chat_id)).all())
+    assert [parents[message.id] for message in messages] == [None] + [message.id for message in messages[:-1]]
+    assert not data.crud.link_messages(db, chat_id)
@@ -0,0 +1,166 @@
+"""Routing of reads between the primary and the replicas (see `data.RecentWrites` and `dependencies.reads_need_primary`)."""
+import datetime
+import time
+import uuid
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.requests import Request
+
+from app import data, dependencies, schemas
+from app.chat_models.openai.openai_model import OpenAIConfig
+from app.data.database import RecentWrites
+from app.user_cache import api_key_cache
+from app.util import Role
+
+
+@pytest.fixture(autouse=True)
+def recent_writes(monkeypatch):
+    writes = RecentWrites(window=60)
+    monkeypatch.setattr(data.database, 'recent_writes', writes)
+    monkeypatch.setattr(data, 'recent_writes', writes)
+    return writes
+
+
+def request_for(chat_id=None) -> Request:
+    return Request({'type': 'http', 'path_params': {'chat_id': str(chat_id)} if chat_id is not None else {}})
+
+
+def create_chat(db, user_id, chat_id=None) -> uuid.UUID:
+    now = datetime.datetime(2024, 1, 1)
+    chat_id = chat_id or uuid.uuid4()
+    db.add(data.models.User(id=user_id, email=f'{user_id}@example.com', hashed_password='x'))
+    config_hash, = data.crud.store_model_configs(db, [OpenAIConfig()])
+    db.add(data.models.Chat(id=chat_id, title='Chat', user_id=user_id, default_model='gpt-4o-mini', config_hash=config_hash, created_at=now, last_message_at=now))
+    db.commit()
+    return chat_id
+
+
+def test_recent_writes_expire():
+    writes = RecentWrites(window=0.01)
+    writes.mark('key')
+    assert writes.is_recent('key')
+    assert not writes.is_recent('other')
+    time.sleep(0.02)
+    assert not writes.is_recent('key')
+
+
+def test_writes_count_once_committed(db, recent_writes):
+    key = uuid.uuid4()
+    data.mark_written(db, key)
+    assert not recent_writes.is_recent(key)
+    db.commit()
+    assert recent_writes.is_recent(key)
+
+
+def test_rolled_back_writes_are_forgotten(db, recent_writes):
+    key = uuid.uuid4()
+    db.execute(select(data.models.User.id))
+    data.mark_written(db, key)
+    db.rollback()
+    db.commit()
+    assert not recent_writes.is_recent(key)
+
+
+def test_reads_of_a_chat_follow_writes_to_it(recent_writes):
+    user = schemas.User(id=uuid.uuid4(), email='a@example.com')
+    chat_id = uuid.uuid4()
+    assert not dependencies.reads_need_primary(request_for(chat_id), user)
+    recent_writes.mark(chat_id)
+    assert dependencies.reads_need_primary(request_for(chat_id), user)
+    assert not dependencies.reads_need_primary(request_for(uuid.uuid4()), user)
+    # routes that aren't about one chat (e.g. the chat list) follow the user's writes instead
+    assert not dependencies.reads_need_primary(request_for(), user)
+    recent_writes.mark(user.id)
+    assert dependencies.reads_need_primary(request_for(), user)
+
+
+def test_chat_writes_route_the_owners_chat_list_to_the_primary(db, recent_writes):
+    user_id = uuid.uuid4()
+    chat_id = create_chat(db, user_id)
+    user = schemas.User(id=user_id, email=f'{user_id}@example.com')
+    # every message write updates the chat's summary through bump_chat_version
+    data.crud.bump_chat_version(db, chat_id, message_count=1)
+    assert not dependencies.reads_need_primary(request_for(), user)
+    db.commit()
+    assert dependencies.reads_need_primary(request_for(chat_id), user)
+    assert dependencies.reads_need_primary(request_for(), user)
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    """A primary and a replica that lags behind it: each holds the same user and chat, but only the primary has the
+    writes made since (a message, and an API key), as if another process had just made them. Async sessions are
+    served by stand-ins for `AsyncSessionLocal` and `AsyncReadSessionLocal`, bound to the one or the other.
+    """
+    user_id = uuid.uuid4()
+    chat_id = uuid.uuid4()
+    engines = {}
+    for name in ('primary', 'replica'):
+        url = f'sqlite:///{tmp_path / name}.db'
+        engine = create_engine(url)
+        data.database.Base.metadata.create_all(engine)
+        db = sessionmaker(bind=engine)()
+        create_chat(db, user_id, chat_id)
+        if name == 'primary':
+            db.add(data.models.Message(role=Role.USER, user_id=user_id, chat_id=chat_id, created_at=datetime.datetime(2024, 1, 1), selected=True))
+            db.add(data.models.APIKey(key='sk-new', provider='OPENAI', user_id=user_id))
+            db.query(data.models.Chat).filter(data.models.Chat.id == chat_id).update({'version': 1})
+            db.commit()
+        db.close()
+        engine.dispose()
+        engines[name] = create_async_engine(url.replace('sqlite://', 'sqlite+aiosqlite://'), poolclass=NullPool)
+    make_session = async_sessionmaker(engines['primary'], class_=data.AsyncSession, autoflush=False, expire_on_commit=False)
+    make_read_session = async_sessionmaker(engines['replica'], class_=data.AsyncSession, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(data, 'AsyncSessionLocal', make_session)
+    monkeypatch.setattr(data, 'AsyncReadSessionLocal', make_read_session)
+    return user_id, chat_id
+
+
+@pytest.fixture
+def client(databases):
+    user_id, _ = databases
+    app = FastAPI()
+
+    @app.get('/chats/{chat_id}')
+    async def read_chat(chat: schemas.ChatFull = Depends(dependencies.get_chat_full)):
+        return {'messages': len(chat.messages)}
+
+    @app.get('/chats/{chat_id}/history')
+    async def read_history(chat: schemas.ChatFull = Depends(dependencies.get_chat_history)):
+        return {'messages': len(chat.messages)}
+
+    @app.get('/keys')
+    async def read_keys(api_keys = Depends(dependencies.get_api_keys)):
+        return dict(api_keys)
+
+    app.dependency_overrides[dependencies.get_current_user] = lambda: schemas.User(id=user_id, email=f'{user_id}@example.com')
+    with TestClient(app) as client:
+        yield client
+
+
+def test_read_routes_use_the_replica_unless_the_process_wrote(client, databases, recent_writes):
+    # checks that the stand-in replica is the one read routes get, and is behind the primary
+    _, chat_id = databases
+    assert client.get(f'/chats/{chat_id}').json() == {'messages': 0}
+    recent_writes.mark(chat_id)
+    assert client.get(f'/chats/{chat_id}').json() == {'messages': 1}
+
+
+def test_histories_that_are_written_after_are_read_from_the_primary(client, databases):
+    # recent writes are only known to the process that made them, so the history a new message is appended to
+    # must never come from a replica, whatever `reads_need_primary` says
+    _, chat_id = databases
+    assert client.get(f'/chats/{chat_id}/history').json() == {'messages': 1}
+
+
+def test_api_keys_are_cached_from_the_primary(client, databases):
+    # a cached entry outlives the replica's lag, so one filled from a replica could serve keys that were just changed
+    user_id, _ = databases
+    assert client.get('/keys').json() == {'OPENAI': 'sk-new'}
+    assert api_key_cache.get(user_id) == {'OPENAI': 'sk-new'}
@@ -0,0 +1,26 @@
+"""Full-text search over chat titles and messages (see `app.data.search`)."""
+import uuid
+
+from app import data, schemas
+from app.util import Role
+
+
+def create_chat(db, title: str, *texts: str) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    db.add(data.models.User(id=user_id, email=f'{user_id}@example.com', hashed_password='x'))
+    db.commit()
+    chat_id = data.crud.create_chat(db, schemas.ChatCreate(title=title), user_id).id
+    data.crud.create_messages(db, [(schemas.MessageBuilder(role=Role.USER).add_text(text).build(), user_id) for text in texts], chat_id)
+    return user_id
+
+
+def test_snippets_escape_the_text_around_the_matches(db):
+    user_id = create_chat(db, 'Chat', 'hello <img src=x onerror=alert(1)> & goodbye')
+    hits, _ = data.crud.search_chats(db, user_id, 'hello', limit=10)
+    assert [hit.snippet for hit in hits] == ['<mark>hello</mark> &lt;img src=x onerror=alert(1)&gt; &amp; goodbye']
+
+
+def test_titles_are_escaped_too(db):
+    user_id = create_chat(db, '<b>Recipes</b>')
+    hits, _ = data.crud.search_chats(db, user_id, 'recipes', limit=10)
+    assert [hit.snippet for hit in hits] == ['&lt;b&gt;<mark>Recipes</mark>&lt;/b&gt;']
@@ -0,0 +1,29 @@
+"""Compaction of tool results before they are sent to a model (see `ToolResultCompaction`)."""
+from app.schemas.tools import ToolResultCompaction
+
+
+def search_results(n: int) -> list[dict]:
+    return [{'title': f'Result {i}', 'url': f'https://example.com/{i}', 'content': 'text ' * 200, 'score': i / n} for i in range(n)]
+
+
+def test_results_are_cut_to_the_top_items_and_projected():
+    compaction = ToolResultCompaction(fields=['title', 'url'], top_k=2)
+    assert compaction.apply(search_results(5)) == [
+        {'title': 'Result 4', 'url': 'https://example.com/4'},
+        {'title': 'Result 3', 'url': 'https://example.com/3'},
+    ]
+
+
+def test_the_summary_names_the_dropped_items():
+    compaction = ToolResultCompaction(fields=['title'], top_k=2, summary=True, summary_max_items=2)
+    compacted = compaction.apply(search_results(5))
+    assert compacted['results'] == [{'title': 'Result 4'}, {'title': 'Result 3'}]
+    assert compacted['summary'] == (
+        'Showing the top 2 of 5 results. The others were: Result 2 - https://example.com/2; '
+        'Result 1 - https://example.com/1; and 1 more'
+    )
+
+
+def test_nothing_is_summarized_when_nothing_is_dropped():
+    compaction = ToolResultCompaction(fields=['title'], top_k=5, summary=True)
+    assert compaction.apply(search_results(2)) == [{'title': 'Result 1'}, {'title': 'Result 0'}]
@@ -0,0 +1,82 @@
+"""Resource limits of sandboxed tools (see `app.tool_sandbox`). Tool functions are module-level so they can be pickled."""
+import asyncio
+import os
+
+import pytest
+
+from app.routers.tools import run_tool
+from app.schemas.tools import SandboxLimits, ToolConfig
+from app.tool_sandbox import ToolResourceLimitError, ToolSandbox, tool_sandbox
+
+
+def spin():
+    while True:
+        pass
+
+
+def allocate(megabytes: int) -> int:
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+def exit_worker():
+    os._exit(1)
+
+
+@pytest.fixture(scope='module')
+def sandbox():
+    sandbox = ToolSandbox(max_workers=1)
+    sandbox.start()
+    yield sandbox
+    sandbox.shutdown()
+
+
+def test_tools_run_in_a_worker(sandbox):
+    assert sandbox.run(os.getpid, (), {}, cpu_seconds=1, memory_mb=256) != os.getpid()
+
+
+def test_cpu_limit_aborts_only_the_call(sandbox):
+    executor = sandbox.start()
+    with pytest.raises(ToolResourceLimitError, match='CPU'):
+        sandbox.run(spin, (), {}, cpu_seconds=1, memory_mb=256)
+    assert sandbox.run(allocate, (1,), {}, cpu_seconds=1, memory_mb=256) == 1024 * 1024
+    assert sandbox.start() is executor
+
+
+def test_memory_limit_aborts_only_the_call(sandbox):
+    executor = sandbox.start()
+    with pytest.raises(ToolResourceLimitError, match='memory'):
+        sandbox.run(allocate, (1024,), {}, cpu_seconds=5, memory_mb=256)
+    assert sandbox.run(allocate, (1,), {}, cpu_seconds=1, memory_mb=256) == 1024 * 1024
+    assert sandbox.start() is executor
+
+
+def test_pool_is_replaced_when_a_worker_dies(sandbox):
+    executor = sandbox.start()
+    with pytest.raises(ToolResourceLimitError, match='terminated'):
+        sandbox.run(exit_worker, (), {}, cpu_seconds=1, memory_mb=256)
+    assert sandbox.run(allocate, (1,), {}, cpu_seconds=1, memory_mb=256) == 1024 * 1024
+    assert sandbox.start() is not executor
+
+
+def worker_pid(offset: int) -> int:
+    """Get the process id of the process running the tool.
+
+    Args:
+        offset (int): Added to the process id
+    """
+    return os.getpid() + offset
+
+
+def test_tools_run_through_the_api_opt_in_to_the_sandbox():
+    tool = ToolConfig.from_func(worker_pid, sandbox=SandboxLimits(cpu_seconds=1, memory_mb=256))
+    try:
+        response = asyncio.run(run_tool('worker_pid', {'offset': 0}, tools={'worker_pid': tool}))
+    finally:
+        tool_sandbox.shutdown()
+    assert response['result'] != os.getpid()
+    assert response['result_metadata'] == {'cached': False}
+
+
+def test_tools_that_dont_opt_in_are_called_in_process():
+    # calling a tool is synchronous, like calling its function
+    assert ToolConfig.from_func(worker_pid)(offset=1) == os.getpid() + 1
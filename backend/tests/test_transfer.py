@@ -0,0 +1,71 @@
+"""Import of chat exports (see `app.transfer`)."""
+import datetime
+import json
+import uuid
+
+import pytest
+
+from app import data, schemas, transfer, user_cache
+from app.config import config
+
+
+def create_user(db, email: str | None = None) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    db.add(data.models.User(id=user_id, email=email or f'{user_id}@example.com', hashed_password='x'))
+    db.commit()
+    return user_id
+
+
+@pytest.fixture(autouse=True)
+def service_users(db, monkeypatch):
+    users = {email: schemas.User(id=create_user(db, email), email=email) for email in (config.system_email, config.assistant_email)}
+    monkeypatch.setattr(user_cache, '_service_users', users)
+
+
+def export_lines(chat_id, *contents, config=None) -> list[str]:
+    now = datetime.datetime(2024, 1, 1).isoformat()
+    chat = {'type': 'chat', 'id': str(chat_id), 'title': 'Chat', 'default_model': 'gpt-4o-mini', 'created_at': now}
+    if config is not None:
+        chat['config'] = config
+    message = {
+        'type': 'message', 'id': str(uuid.uuid4()), 'chat_id': str(chat_id), 'role': 'user', 'created_at': now,
+        'contents': list(contents),
+    }
+    return [json.dumps({'type': 'export', 'version': 2, 'exported_at': now}), json.dumps(chat), json.dumps(message)]
+
+
+@pytest.mark.parametrize('path', [
+    '/etc/passwd',
+    'uploads/{chat_id}/../../etc/passwd',
+    'uploads/{chat_id}/..',
+    'uploads/{chat_id}/nested/file.txt',
+    'uploads/{other_id}/file.txt',
+    'uploads/{chat_id}/',
+])
+def test_uploads_outside_the_chat_are_rejected(db, path):
+    user_id = create_user(db)
+    chat_id = uuid.uuid4()
+    content = {'type': 'file', 'content': path.format(chat_id=chat_id, other_id=uuid.uuid4()), 'image_type': 'text/plain'}
+    with pytest.raises(ValueError, match='line 3'):
+        transfer.import_chats(db, user_id, export_lines(chat_id, content))
+    assert db.query(data.models.MessageContent).count() == 0
+
+
+def test_uploads_are_moved_to_the_imported_chat(db):
+    user_id = create_user(db)
+    chat_id = uuid.uuid4()
+    content = {'type': 'image', 'content': f'uploads/{chat_id}/photo.png', 'image_type': 'image/png'}
+    report = transfer.import_chats(db, user_id, export_lines(chat_id, content))
+    assert report.messages == 1
+    new_chat_id = db.query(data.models.Chat.id).filter(data.models.Chat.user_id == user_id).scalar()
+    stored = db.query(data.models.MessageContent.content).scalar()
+    assert stored == f'uploads/{new_chat_id}/photo.png'
+
+
+def test_chats_without_a_config_get_their_models_default(db):
+    user_id = create_user(db)
+    chat_id = uuid.uuid4()
+    transfer.import_chats(db, user_id, export_lines(chat_id, {'type': 'text', 'content': 'Hi'}))
+    chat_id = db.query(data.models.Chat.id).filter(data.models.Chat.user_id == user_id).scalar()
+    chat = data.crud.get_chat_history(db, chat_id)
+    assert chat.config.model_dump() == data.crud.get_chat(db, chat_id).config
@@ -0,0 +1,37 @@
+"""Eviction of cached per-user data when the underlying rows change (see `app.user_cache`)."""
+import uuid
+
+from app import data, schemas
+from app.user_cache import api_key_cache, user_cache
+
+
+def create_user(db) -> uuid.UUID:
+    user_id = uuid.uuid4()
+    db.add(data.models.User(id=user_id, email=f'{user_id}@example.com', hashed_password='x'))
+    db.commit()
+    return user_id
+
+
+def test_api_keys_are_evicted_once_committed(db):
+    user_id = create_user(db)
+    api_key_cache.set(user_id, {})
+    db.add(data.models.APIKey(key='sk', provider='OPENAI', user_id=user_id))
+    db.flush()
+    # until the commit, a request reading the keys would only see (and cache) the old ones anyway
+    assert api_key_cache.get(user_id) == {}
+    db.commit()
+    assert api_key_cache.get(user_id) is None
+
+
+def test_rolled_back_changes_evict_nothing(db):
+    user_id = create_user(db)
+    user = schemas.User(id=user_id, email=f'{user_id}@example.com')
+    user_cache.set(user_id, user)
+    db.get(data.models.User, user_id).email = 'changed@example.com'
+    db.flush()
+    db.rollback()
+    db.commit()
+    assert user_cache.get(user_id) == user
+    db.get(data.models.User, user_id).email = 'changed@example.com'
+    db.commit()
+    assert user_cache.get(user_id) is None
@@ -1,5 +1,5 @@
 import { useMutation, useQuery, useQueryClient } from 'react-query';
-import { Message, Chat, Model, MessageView, User, ModelAPIKey, ToolConfig } from './types';
+import { Message, Chat, ChatPage, Model, MessageView, User, ModelAPIKey, ToolConfig } from './types';
 import { useContext, useEffect, useRef } from 'react';
 import UserContext, { UserContextType } from './context/userContext';
 
@@ -69,8 +69,8 @@ export function useGetChats(userId: string) {
         queryFn: async () => {
             const response = await backendFetch(`/chat/`, undefined, token);
             const json: unknown = await response?.json();
-            const chats: Chat[] = json as Chat[];
-            return chats;
+            const page: ChatPage = json as ChatPage;
+            return page.chats;
         }
     });
 }
@@ -5,6 +5,9 @@ export type MessageContentTypeEnum = 'text' | 'image' | 'tool_call' | 'tool_resu
 export interface MessageContent {
     type: MessageContentTypeEnum;
     content: string | Record<string, string | number> | ToolCall;
+    id?: string;
+    // set when content is only a preview; the full content is at /chat/{chatId}/contents/{id}
+    content_size?: number | null;
 }
 
 export interface TextMessageContent extends MessageContent {
@@ -79,6 +82,28 @@ export interface Message {
     id: string;
     model?: string;
     config?: ModelConfig;
+    parent_id?: string | null;
+}
+
+export interface Branch {
+    head_id: string;
+    parent_id: string | null;
+    role: Role;
+    created_at: string;
+    active: boolean;
+    preview: string | null;
+}
+
+export interface UsageRollup {
+    model: string;
+    period_start: string;
+    responses: number;
+    streamed_responses: number;
+    prompt_tokens: number;
+    completion_tokens: number;
+    cached_tokens: number;
+    latency_ms: number;
+    time_to_first_token_ms: number;
 }
 
 export type MessageView = Pick<Message, "contents" | "role"> & Partial<Message>;
@@ -92,6 +117,15 @@ export interface Chat {
     default_model: string;
     config: ModelConfig;
     tools?: string[];
+    message_count?: number;
+    last_message_at?: string;
+    last_preview?: string | null;
+    total_tokens?: number;
+}
+
+export interface ChatPage {
+    chats: Chat[];
+    next_cursor: string | null;
 }
 
 export const MODEL_API_PROVIDERS = ['OPENAI', 'ANTHROPIC'] as const;
@@ -63,6 +63,8 @@ export default function Chat() {
     }, []);
 
     const [toolResultsShown, setToolResultsShown] = useState<Record<string, boolean>>({});
+    // full versions of contents that the chat only has previews of, by content id
+    const [fullContents, setFullContents] = useState<Record<string, MessageContent>>({});
     
     const { chatId } = useParams();
 
@@ -75,13 +77,35 @@ export default function Chat() {
 
     const navigate = useNavigate();
 
-    const setEditingChat = (chat: ChatType) => {
-        setEditing({...chat, system_prompt: (chat.messages?.find(m => m.role === 'system')?.contents[0] as TextMessageContent).content});
+    const fetchFullContent = async (content: MessageContent) => {
+        const response = await backendFetch(`/chat/${chatId}/contents/${content.id}`, undefined, token);
+        const json: unknown = await response.json();
+        return json as MessageContent;
+    }
+
+    const loadFullContent = async (content: MessageContent) => {
+        if (content.content_size == null || !content.id || content.id in fullContents) {
+            return;
+        }
+        const fullContent = await fetchFullContent(content);
+        setFullContents(fc => ({...fc, [content.id!]: fullContent}));
+    }
+
+    const resolveContent = <T extends MessageContent>(content: T): T => {
+        return (content.id && content.id in fullContents ? fullContents[content.id] : content) as T;
+    }
+
+    const setEditingChat = async (chat: ChatType) => {
+        let systemContent = chat.messages?.find(m => m.role === 'system')?.contents[0] as TextMessageContent;
+        if (systemContent.content_size != null) {
+            systemContent = await fetchFullContent(systemContent) as TextMessageContent;
+        }
+        setEditing({...chat, system_prompt: systemContent.content});
     }
 
     useEffect(() => {
         if (chat?.messages?.length === 0 || (chat?.messages?.length === 1 && chat?.messages[0]?.role === 'system')) {
-            setEditingChat(chat);
+            void setEditingChat(chat);
         }
     }, [chat]);
 
@@ -189,12 +213,13 @@ export default function Chat() {
 
     const renderMessageContent = (content: MessageContent, index: number) => {
         if (content.type === 'text') {
+            const textContent = resolveContent(content as TextMessageContent);
             return <div key={index}>
-                <button className={styles.copyButton} onClick={() => void navigator.clipboard.writeText((content as TextMessageContent).content)}>
+                <button className={styles.copyButton} onClick={() => void navigator.clipboard.writeText(textContent.content)}>
                     <FontAwesomeIcon icon={faCopy} />
                 </button>
                 <Markdown
-                    children={(content as TextMessageContent).content.replace(/\\\(/g, '$').replace(/\\\)/g, '$').replace(/\\\[/g, '$$').replace(/\\\]/g, '$$')}
+                    children={textContent.content.replace(/\\\(/g, '$').replace(/\\\)/g, '$').replace(/\\\[/g, '$$').replace(/\\\]/g, '$$')}
                     remarkPlugins={[remarkGfm, remarkMath]}
                     rehypePlugins={[rehypeKatex]}
                     className={styles.markdown}
@@ -217,6 +242,10 @@ export default function Chat() {
                         )
                     }
                 }}/>
+                {textContent.content_size != null &&
+                <button className={styles.showFullButton} onClick={() => void loadFullContent(textContent)}>
+                    Show full message
+                </button>}
             </div>
         } else if (content.type === 'image') {
             const imageContent = content as ImageMessageContent;
@@ -232,7 +261,7 @@ export default function Chat() {
                     : {...tr, [toolCallContent.tool_call_id]: false}
                 )); 
             }
-            let toolResult = undefined;
+            let toolResult: MessageContent | undefined = undefined;
             for (const message of messages.filter(m => m.role === 'tool')) {
                 for (const content of message.contents.filter(c => c.type === 'tool_result')) {
                     if (content.tool_call_id === toolCallContent.tool_call_id) {
@@ -252,12 +281,15 @@ export default function Chat() {
                 </div>
                 {toolResult && 
                 <>
-                    <button className={styles.showResultButton} onClick={() => setToolResultsShown(tr => ({...tr, [toolCallContent.tool_call_id]: !tr[toolCallContent.tool_call_id]}))}>
+                    <button className={styles.showResultButton} onClick={() => {
+                        setToolResultsShown(tr => ({...tr, [toolCallContent.tool_call_id]: !tr[toolCallContent.tool_call_id]}));
+                        void loadFullContent(toolResult!);
+                    }}>
                         {toolResultsShown[toolCallContent.tool_call_id] ? 'Hide' : 'Show'} Result
                     </button>
                     <div key={index} className={styles.toolResult + ' ' + (toolResultsShown[toolCallContent.tool_call_id] ? styles.show : '')}>
                         <h3>Result</h3>
-                        <pre>{JSON.stringify(toolResult.content, null, 2)}</pre>
+                        <pre>{JSON.stringify(resolveContent(toolResult).content, null, 2)}</pre>
                     </div>
                 </>
                 
@@ -396,7 +428,7 @@ export default function Chat() {
         <div className={styles.header}>
             <h1>{chat.title}</h1>
             <h2>{models?.find(m => chat.default_model === m.api_name)?.human_name}</h2>
-            <button className={styles.editButton} onClick={() => setEditingChat(chat)}>Edit</button>
+            <button className={styles.editButton} onClick={() => void setEditingChat(chat)}>Edit</button>
         </div>
         <div className={styles.messagesContainer}>
             {messages.length > 0 && messages.map((msg, index) => renderMessage(msg, index))}
@@ -104,7 +104,7 @@ export default function Sidebar({show, toggleShow}: {show: boolean, toggleShow:
                         [styles.active]: chat.id === activeChat
                     })}>
                         <li className={styles.chatNameCtr}>
-                            <p className={styles.chatName}>
+                            <p className={styles.chatName} title={chat.last_preview ?? undefined}>
                                 {chat.title}
                             </p>
                             <div className={styles.chatButtons}>